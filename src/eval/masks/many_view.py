@@ -1,23 +1,37 @@
-import os, glob
+import os, sys
 import numpy as np
 import open3d as o3d
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "render"))
+from lod import open_lod, segment_palette
+
 LIFT_DIR = r"C:\Users\jmu5\OneDrive - Brown University\Documents\temp school stuff\neurosym-playground\data\output\725lifted"
-files = sorted(glob.glob(os.path.join(LIFT_DIR, "view_*", "*.npz")))
-print("found npzs:", len(files))
+FUSED_PATH = os.path.join(LIFT_DIR, "fused.npz")
 
-rng = np.random.default_rng(0)
-geoms = []
-for f in files[:100]:
-    z = np.load(f)
-    pts = z["points"].astype(np.float32)
-    if pts.shape[0] < 800:
-        continue
+# fuse.py output: one cloud, one color per fused segment (unlabeled voxels gray)
+if os.path.exists(FUSED_PATH):
+    z = np.load(FUSED_PATH)
+    labels = z["labels"]
+    palette = np.random.default_rng(0).random((int(labels.max()) + 2, 3))
+    palette[-1] = 0.5
     pcd = o3d.geometry.PointCloud()
-    pcd.points = o3d.utility.Vector3dVector(pts)
+    pcd.points = o3d.utility.Vector3dVector(z["points"].astype(np.float64))
+    pcd.colors = o3d.utility.Vector3dVector(palette[labels])
+    print("fused segments:", int(labels.max()) + 1)
+    o3d.visualization.draw_geometries([pcd])
+    sys.exit(0)
+
+# every segment with >= 800 points, coarse to fine up to POINT_BUDGET points in one cloud
+# (lod.py, built on first use), colored by a segment palette lookup
+POINT_BUDGET = 2_000_000
+cloud = open_lod(LIFT_DIR)
+segments = cloud.select(min_points=800)
+print("found segments:", len(segments))
 
-    c = rng.random(3)
-    pcd.colors = o3d.utility.Vector3dVector(np.repeat(c[None, :], pts.shape[0], axis=0))
-    geoms.append(pcd)
+pts, seg, _ = cloud.load(POINT_BUDGET, segments=segments)
+pcd = o3d.geometry.PointCloud()
+pcd.points = o3d.utility.Vector3dVector(pts.astype(np.float64))
+pcd.colors = o3d.utility.Vector3dVector(segment_palette(len(cloud.segments))[seg])
+print(f"showing {len(pts)} of {len(cloud)} points")
 
-o3d.visualization.draw_geometries(geoms)
+o3d.visualization.draw_geometries([pcd])
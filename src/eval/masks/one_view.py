@@ -1,24 +1,25 @@
-import os, glob
+import os, sys
 import numpy as np
 import open3d as o3d
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "render"))
+from lod import open_lod
+
 LIFT_DIR = r"C:\Users\jmu5\OneDrive - Brown University\Documents\temp school stuff\neurosym-playground\data\output\725lifted"
-files = sorted(glob.glob(os.path.join(LIFT_DIR, "view_*", "*.npz")))
+# per window, coarse levels of the lod (lod.py) first
+POINT_BUDGET = 500_000
+
+cloud = open_lod(LIFT_DIR)
+segments = cloud.select(min_points=500)
 
-print("files:", len(files))
-for k, f in enumerate(files):
-    z = np.load(f)
-    pts = z["points"].astype(np.float32)
-    cols = z["colors"]
-    if cols.dtype != np.float32:
-        cols = cols.astype(np.float32) / 255.0
-        
-    if pts.shape[0] < 500:
-        continue
+print("segments:", len(segments))
+for k, s in enumerate(segments):
+    pts, _, cols = cloud.load(POINT_BUDGET, segments=[s], colors=True)
 
     pcd = o3d.geometry.PointCloud()
-    pcd.points = o3d.utility.Vector3dVector(pts)
-    pcd.colors = o3d.utility.Vector3dVector(cols)
+    pcd.points = o3d.utility.Vector3dVector(pts.astype(np.float64))
+    pcd.colors = o3d.utility.Vector3dVector(cols.astype(np.float64) / 255.0)
 
-    print(f"[{k}/{len(files)}] {pts.shape[0]} pts  {f}")
+    row = cloud.segments[s]
+    print(f"[{k}/{len(segments)}] {row['count']} pts ({len(pts)} shown)  view {row['view']:03d} mask {row['mask_id']:03d}")
     o3d.visualization.draw_geometries([pcd])
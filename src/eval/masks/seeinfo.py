@@ -10,3 +10,17 @@ for f in files[:5]:
     for k in z.files:
         a = z[k]
         print(f"  {k:15s} shape={a.shape} dtype={a.dtype}")
+
+# same summary straight from the store index, nothing decompressed
+STORE_DIR = os.path.join(os.path.dirname(VIEW_DIR), "store")
+if os.path.isdir(STORE_DIR):
+    import sys
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "render"))
+    from liftstore import LiftStore
+
+    store = LiftStore(STORE_DIR)
+    view = int(os.path.basename(VIEW_DIR).split("_")[1])
+    for k in store.select(views=[view])[:5]:
+        row = store.index[k]
+        print(f"\n view {row['view']} mask {row['mask_id']:03d}: {row['count']} points "
+              f"bbox {row['bbox_min']} .. {row['bbox_max']} iou {row['predicted_iou']:.3f}")
@@ -0,0 +1,374 @@
+import os
+import re
+import sys
+import csv
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "render"))
+from raster import load_obj, normalization
+from fuse import iter_fragments
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None
+
+r'''
+boxes fitted to the lifted segments, scored against the shape programs in
+data/partnet_datasets/<id>/scene.txt (Part(w,h,d,x,y,z) per ref_interface.txt).
+
+every segment gets an axis aligned box (aabb) and a pca oriented box (pca), all segments in one
+pass: grouped min / max / mean / covariance over the concatenated points, one batched eigh.
+min keeps the smaller of the two per segment (pca tilts square cross sections, legs, by 45 deg).
+scene.txt boxes are in the obj frame, they go through the same import rotation and
+normalization as the renders (raster.py): dims (w, d, h), center (x, -z, y), * scale - center.
+each part is then matched to at most one segment by box iou (hungarian, scipy when installed):
+
+  miou     mean over scene.txt parts of the matched box iou (0 when unmatched)
+  acc      parts matched with iou >= --iou
+  acc25    parts matched with iou >= 0.25
+
+one shape (segments from <lift_dir>/fused.npz when fuse.py ran, else every lifted mask):
+
+python src/eval/score_boxes.py --shape_dir "$proj\data\partnet_datasets\725" --lift_dir "$out/725lifted"
+
+every shape of list.txt that has <out_root>/<id>lifted:
+
+python src/eval/score_boxes.py --data "$proj\data\partnet_datasets" --out_root "$out" `
+  --report "$out/boxes.json" --csv "$out/boxes.csv" --workers 8
+
+also prints acc / miou per part name (leg, seat support, ...) over all shapes.
+'''
+
+METHODS = ("aabb", "pca", "min")
+# max (box, gt box, sample) inside tests held at once
+CHUNK = 1 << 22
+# lifted points fitted at once, whole segments per batch
+BATCH_POINTS = 1 << 22
+PART_RE = re.compile(r"^\s*(\w+)\s*=\s*Part\(([^)]*)\)\s*(?:#\s*(.*))?$")
+
+# ---- scene.txt ----
+
+# [(name, label, (w,h,d,x,y,z))] in file order, label is the trailing comment
+def read_scene(path):
+    parts = []
+    with open(path, "r") as f:
+        for line in f:
+            m = PART_RE.match(line)
+            if m is None:
+                continue
+            vals = tuple(float(x) for x in m.group(2).split(","))
+            if len(vals) != 6:
+                raise ValueError(f"{path}: Part needs 6 values: {line.strip()}")
+            parts.append((m.group(1), (m.group(3) or "").strip(), vals))
+    return parts
+
+# scene.txt boxes as (centers, sizes) in the normalized render frame of the shape's obj files
+def scene_boxes(shape_dir, parts):
+    obj_files = sorted(f for f in os.listdir(shape_dir) if f.lower().endswith(".obj"))
+    center, scale = normalization(np.concatenate([load_obj(os.path.join(shape_dir, fn))[0] for fn in obj_files]))
+    p = np.array([v for _, _, v in parts], dtype=np.float64).reshape(-1, 6)
+    sizes = p[:, [0, 2, 1]] * scale
+    centers = np.stack([p[:, 3], -p[:, 5], p[:, 4]], axis=1) * scale - center
+    return centers, sizes
+
+# ---- box fitting ----
+
+# (centers, sizes, rotations) per segment 0..n-1; rotation columns are the box axes.
+# points (N,3), seg (N,) ids, every id present
+def fit_boxes(points, seg, method="aabb"):
+    order = np.argsort(seg, kind="stable")
+    p = np.asarray(points, dtype=np.float64)[order]
+    s = seg[order]
+    starts = np.flatnonzero(np.r_[True, s[1:] != s[:-1]])
+    n = len(starts)
+
+    if method == "aabb":
+        lo = np.minimum.reduceat(p, starts, axis=0)
+        hi = np.maximum.reduceat(p, starts, axis=0)
+        return (lo + hi) * 0.5, hi - lo, np.broadcast_to(np.eye(3), (n, 3, 3)).copy()
+    if method == "min":
+        ca, sa, ra = fit_boxes(points, seg, "aabb")
+        cp, sp, rp = fit_boxes(points, seg, "pca")
+        aligned = sa.prod(axis=1) <= sp.prod(axis=1)
+        return (np.where(aligned[:, None], ca, cp), np.where(aligned[:, None], sa, sp),
+                np.where(aligned[:, None, None], ra, rp))
+    if method != "pca":
+        raise ValueError(f"unknown box method '{method}'")
+
+    count = np.diff(np.r_[starts, len(p)]).astype(np.float64)
+    mean = np.add.reduceat(p, starts, axis=0) / count[:, None]
+    q = p - mean[s]
+    cov = np.empty((n, 3, 3))
+    for i in range(3):
+        for j in range(i, 3):
+            cov[:, i, j] = cov[:, j, i] = np.add.reduceat(q[:, i] * q[:, j], starts) / count
+    _, rot = np.linalg.eigh(cov)
+    # right handed, so a rotation and not a reflection
+    rot[:, :, 2] *= np.sign(np.linalg.det(rot))[:, None]
+
+    lo, hi = np.empty((n, 3)), np.empty((n, 3))
+    for j in range(3):
+        local = (q * rot[:, :, j][s]).sum(axis=1)
+        lo[:, j] = np.minimum.reduceat(local, starts)
+        hi[:, j] = np.maximum.reduceat(local, starts)
+    centers = mean + np.einsum("nij,nj->ni", rot, (lo + hi) * 0.5)
+    return centers, hi - lo, rot
+
+# ---- batched iou ----
+
+def aabb_iou(ca, sa, cb, sb):
+    lo = np.maximum((ca - sa / 2)[:, None], (cb - sb / 2)[None])
+    hi = np.minimum((ca + sa / 2)[:, None], (cb + sb / 2)[None])
+    inter = np.clip(hi - lo, 0, None).prod(axis=2)
+    va, vb = sa.prod(axis=1), sb.prod(axis=1)
+    return inter / np.maximum(va[:, None] + vb[None] - inter, 1e-12)
+
+# (A,B) iou of oriented boxes a against axis aligned boxes b. boxes whose axes are the world
+# axes (any order / sign) are exact, the rest take the share of a's volume inside b from a
+# fixed grid of grid^3 cell centers in a
+def obb_aabb_iou(ca, sa, ra, cb, sb, grid=16):
+    aligned = (np.abs(ra).max(axis=1) > 1.0 - 1e-6).all(axis=1)
+    out = np.empty((len(ca), len(cb)))
+    if aligned.any():
+        # world extent of an axis permuted box: |R| @ size
+        out[aligned] = aabb_iou(ca[aligned], np.einsum("nij,nj->ni", np.abs(ra[aligned]), sa[aligned]), cb, sb)
+    rest = ~aligned
+    if rest.any():
+        out[rest] = _sampled_iou(ca[rest], sa[rest], ra[rest], cb, sb, grid)
+    return out
+
+def _sampled_iou(ca, sa, ra, cb, sb, grid):
+    g = (np.arange(grid) + 0.5) / grid - 0.5
+    unit = np.stack(np.meshgrid(g, g, g, indexing="ij"), axis=-1).reshape(-1, 3)
+    K, B = len(unit), len(cb)
+    lo, hi = cb - sb / 2, cb + sb / 2
+    frac = np.empty((len(ca), B))
+    step = max(1, CHUNK // max(B * K, 1))
+    for a0 in range(0, len(ca), step):
+        sl = slice(a0, a0 + step)
+        pts = ca[sl, None] + np.einsum("aij,akj->aki", ra[sl], unit[None] * sa[sl, None])
+        inside = ((pts[:, None] >= lo[None, :, None]) & (pts[:, None] <= hi[None, :, None])).all(axis=3)
+        frac[sl] = inside.mean(axis=2)
+    va, vb = sa.prod(axis=1), sb.prod(axis=1)
+    inter = np.minimum(frac * va[:, None], vb[None])
+    return inter / np.maximum(va[:, None] + vb[None] - inter, 1e-12)
+
+# ---- assignment ----
+
+# min cost rows -> columns for rows <= columns (shortest augmenting paths, O(rows^2 cols))
+def _hungarian(cost):
+    n, m = cost.shape
+    u, v = np.zeros(n + 1), np.zeros(m + 1)
+    p = np.zeros(m + 1, dtype=np.int64)
+    way = np.zeros(m + 1, dtype=np.int64)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used[1:]
+            cur = cost[i0 - 1] - u[i0] - v[1:]
+            better = free & (cur < minv[1:])
+            minv[1:][better] = cur[better]
+            way[1:][better] = j0
+            cand = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(cand)) + 1
+            delta = cand[j1 - 1]
+            u[p[used]] += delta
+            v[used] -= delta
+            minv[1:][free] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+    rows = p[1:] - 1
+    cols = np.flatnonzero(rows >= 0)
+    return rows[cols], cols
+
+# (part rows, segment cols) maximizing total iou, one segment per part
+def match(iou):
+    if iou.size == 0:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64)
+    if linear_sum_assignment is not None:
+        r, c = linear_sum_assignment(-iou)
+    elif iou.shape[0] <= iou.shape[1]:
+        r, c = _hungarian(-iou)
+    else:
+        c, r = _hungarian(-iou.T)
+    keep = iou[r, c] > 0
+    order = np.argsort(r[keep])
+    return r[keep][order], c[keep][order]
+
+# ---- segments ----
+
+# (points, seg ids 0..k-1, names) batches of whole segments, about batch points each: the fused
+# labels (one batch) or every lifted mask when there is no fused.npz
+def iter_segment_batches(lift_dir, source="auto", min_points=50, batch=BATCH_POINTS):
+    fused = os.path.join(lift_dir, "fused.npz")
+    if source == "fused" or (source == "auto" and os.path.exists(fused)):
+        z = np.load(fused)
+        keep = z["labels"] >= 0
+        points, labels = z["points"][keep], z["labels"][keep].astype(np.int64)
+        count = np.bincount(labels)
+        ids = np.flatnonzero(count >= min_points)
+        remap = np.full(len(count), -1, dtype=np.int64)
+        remap[ids] = np.arange(len(ids))
+        sel = remap[labels] >= 0
+        if len(ids):
+            yield points[sel], remap[labels[sel]], [f"label_{k}" for k in ids]
+        return
+
+    pts, segs, names, n = [], [], [], 0
+    for view, mid, p, _ in iter_fragments(lift_dir):
+        if len(p) < min_points:
+            continue
+        segs.append(np.full(len(p), len(names), dtype=np.int64))
+        pts.append(p)
+        names.append(f"view_{view:03d}/mask_{mid:03d}")
+        n += len(p)
+        if n >= batch:
+            yield np.concatenate(pts), np.concatenate(segs), names
+            pts, segs, names, n = [], [], [], 0
+    if names:
+        yield np.concatenate(pts), np.concatenate(segs), names
+
+# ---- scoring ----
+
+def score_shape(shape_dir, lift_dir, iou_thresh=0.5, source="auto", min_points=50, methods=("aabb", "pca"), grid=16):
+    parts = read_scene(os.path.join(shape_dir, "scene.txt"))
+    gc, gs = scene_boxes(shape_dir, parts)
+    # every batch is fitted at once, only the boxes are kept
+    names, fits = [], {m: [] for m in methods}
+    for points, seg, batch_names in iter_segment_batches(lift_dir, source, min_points):
+        names += batch_names
+        for method in methods:
+            fits[method].append(fit_boxes(points, seg, method))
+    out = {"segments": len(names), "parts": len(parts), "methods": {}}
+
+    for method in methods:
+        if len(names):
+            c, s, r = (np.concatenate(x) for x in zip(*fits[method]))
+            iou = aabb_iou(gc, gs, c, s) if method == "aabb" else obb_aabb_iou(c, s, r, gc, gs, grid).T
+        else:
+            iou = np.zeros((len(parts), 0))
+        rows, cols = match(iou)
+        best = np.zeros(len(parts))
+        best[rows] = iou[rows, cols]
+        seg_of = dict(zip(rows.tolist(), cols.tolist()))
+        per_part = [{"part": name, "label": label, "iou": float(best[k]),
+                     "segment": names[seg_of[k]] if k in seg_of else None}
+                    for k, (name, label, _) in enumerate(parts)]
+        out["methods"][method] = {
+            "miou": float(best.mean()) if len(parts) else 0.0,
+            "acc": float((best >= iou_thresh).mean()) if len(parts) else 0.0,
+            "acc25": float((best >= 0.25).mean()) if len(parts) else 0.0,
+            "parts": per_part}
+    return out
+
+# every list.txt id with both its dataset dir and <out_root>/<id><suffix>
+def find_shapes(data, out_root, list_path=None, lift_suffix="lifted"):
+    list_path = list_path if list_path is not None else os.path.join(data, "list.txt")
+    with open(list_path, "r") as f:
+        ids = [line.split()[0] for line in f if line.strip()]
+    jobs = []
+    for sid in ids:
+        shape_dir = os.path.join(data, sid)
+        lift_dir = os.path.join(out_root, sid + lift_suffix)
+        if os.path.exists(os.path.join(shape_dir, "scene.txt")) and os.path.isdir(lift_dir):
+            jobs.append((sid, shape_dir, lift_dir))
+    return jobs
+
+# part weighted over shapes, and per part label
+def summarize(shapes, method, iou_thresh):
+    rows = [p for s in shapes.values() for p in s["methods"][method]["parts"]]
+    if not rows:
+        return {"parts": 0}
+    iou = np.array([p["iou"] for p in rows])
+    out = {"shapes": len(shapes), "parts": len(rows), "miou": float(iou.mean()),
+           "acc": float((iou >= iou_thresh).mean()), "acc25": float((iou >= 0.25).mean()), "by_label": {}}
+    labels = sorted({p["label"] for p in rows})
+    for lab in labels:
+        v = np.array([p["iou"] for p in rows if p["label"] == lab])
+        out["by_label"][lab] = {"parts": len(v), "miou": float(v.mean()), "acc": float((v >= iou_thresh).mean())}
+    return out
+
+def _score(job):
+    sid, shape_dir, lift_dir, kw = job
+    return sid, score_shape(shape_dir, lift_dir, **kw)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--shape_dir", default=None, help="one dataset shape dir with scene.txt and its objs")
+    ap.add_argument("--lift_dir", default=None)
+    ap.add_argument("--data", default=None, help="partnet_datasets dir, shapes from its list.txt")
+    ap.add_argument("--list", default=None)
+    ap.add_argument("--out_root", default=None)
+    ap.add_argument("--lift_suffix", default="lifted")
+    ap.add_argument("--source", default="auto", choices=["auto", "fused", "fragments"])
+    ap.add_argument("--methods", default="aabb,pca")
+    ap.add_argument("--min_points", type=int, default=50)
+    ap.add_argument("--iou", type=float, default=0.5)
+    ap.add_argument("--grid", type=int, default=16, help="samples per axis for the oriented box iou")
+    ap.add_argument("--workers", type=int, default=1)
+    ap.add_argument("--report", default=None)
+    ap.add_argument("--csv", default=None)
+    args = ap.parse_args()
+
+    methods = tuple(m for m in args.methods.split(",") if m)
+    for m in methods:
+        if m not in METHODS:
+            raise SystemExit(f"unknown box method '{m}', use {', '.join(METHODS)}")
+    if args.shape_dir is not None:
+        if args.lift_dir is None: raise SystemExit("--shape_dir needs --lift_dir")
+        jobs = [(os.path.basename(os.path.normpath(args.shape_dir)), args.shape_dir, args.lift_dir)]
+    elif args.data is not None and args.out_root is not None:
+        jobs = find_shapes(args.data, args.out_root, args.list, args.lift_suffix)
+    else:
+        raise SystemExit("give --shape_dir/--lift_dir or --data/--out_root")
+    if not jobs: raise SystemExit("no shapes with both scene.txt and lifted segments found")
+
+    kw = {"iou_thresh": args.iou, "source": args.source, "min_points": args.min_points, "methods": methods, "grid": args.grid}
+    jobs = [(sid, d, l, kw) for sid, d, l in jobs]
+    if args.workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            shapes = dict(pool.map(_score, jobs))
+    else:
+        shapes = dict(map(_score, jobs))
+
+    report = {"iou_thresh": args.iou, "source": args.source,
+              "summary": {m: summarize(shapes, m, args.iou) for m in methods}, "shapes": shapes}
+
+    for sid, s in shapes.items():
+        line = "  ".join(f"{m} miou {s['methods'][m]['miou']:.3f} acc {s['methods'][m]['acc']:.3f}" for m in methods)
+        print(f"{sid}: {s['parts']} parts, {s['segments']} segments  {line}")
+    for m in methods:
+        sm = report["summary"][m]
+        if not sm["parts"]:
+            continue
+        print(f"{m} over {sm['shapes']} shapes, {sm['parts']} parts: miou {sm['miou']:.3f}  acc {sm['acc']:.3f}  acc25 {sm['acc25']:.3f}")
+        for lab, r in sorted(sm["by_label"].items(), key=lambda kv: -kv[1]["parts"]):
+            print(f"  {lab or '-':32s} {r['parts']:5d}  miou {r['miou']:.3f}  acc {r['acc']:.3f}")
+
+    if args.report is not None:
+        with open(args.report, "w") as f: json.dump(report, f, indent=2)
+    if args.csv is not None:
+        with open(args.csv, "w", newline="") as f:
+            w = csv.writer(f)
+            w.writerow(["shape", "method", "part", "label", "iou", "segment"])
+            for sid, s in shapes.items():
+                for m in methods:
+                    for p in s["methods"][m]["parts"]:
+                        w.writerow([sid, m, p["part"], p["label"], f"{p['iou']:.6f}", p["segment"] or ""])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import os
+import sys
+import csv
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "render"))
+from imgio import load_exr_r
+from maskstore import open_view_masks
+from viewstack import open_stack
+
+r'''
+headless scoring of sam masks against the rendered part ids (part_id_exr, 0 = background).
+
+per view, every (mask, part) intersection is one and + popcount of the bit-packed mask rows
+against the packed part ids (the confusion matrix without unpacking any mask), so
+overlapping masks are scored exactly:
+
+  miou        mean over visible parts of the best mask iou for that part
+  recall      parts whose best mask iou >= --iou
+  precision   masks whose best part iou >= --iou
+  coverage    foreground pixels under at least one mask
+  pixel_acc   foreground pixels labeled right by the exclusive label map (smaller mask wins),
+              each mask counted as the part it overlaps most
+
+one shape:
+
+python src/eval/score_seg.py --render_dir "$out/725" --sam_dir "$out/725sam" --report "$out/725score.json"
+
+a sweep, every <root>/<shape> with a <root>/<shape>sam next to it (or --sam_root/<shape>):
+
+python src/eval/score_seg.py --render_root "$out" --report "$out/score.json" --csv "$out/score.csv" --workers 8
+'''
+
+METRICS = ("miou", "recall", "precision", "coverage", "pixel_acc")
+
+_POP8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+# set bits along the last axis of packed uint64 rows
+def popcount(bits):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(bits).sum(axis=-1, dtype=np.int64)
+    b = bits.view(np.uint8).reshape(bits.shape[:-1] + (-1,))
+    return _POP8[b].sum(axis=-1, dtype=np.int64)
+
+def score_view(part_id, masks, iou_thresh=0.5, min_area=64):
+    gt = np.rint(part_id).astype(np.int64).reshape(-1)
+    G = int(gt.max()) + 1
+    gt_area = np.bincount(gt, minlength=G)
+    parts = np.flatnonzero(gt_area >= min_area)
+    parts = parts[parts > 0]
+    n = len(masks)
+
+    out = {"parts": int(len(parts)), "masks": int(n)}
+    if n == 0:
+        out.update(miou=0.0, recall=0.0, precision=0.0, coverage=0.0, pixel_acc=0.0)
+        return out
+
+    # everything below is and/popcount on bit-packed rows, masks never get unpacked
+    bits = masks.bits if isinstance(getattr(masks, "bits", None), np.ndarray) else np.packbits(masks.flat(), axis=1)
+    if bits.shape[1] != (gt.shape[0] + 7) // 8:
+        raise ValueError(f"mask size does not match part_id size {gt.shape[0]}")
+    gbits = np.packbits(gt[None, :] == np.arange(G)[:, None], axis=1)
+    # 64 pixels per word from here on
+    pad = -bits.shape[1] % 8
+    bits = np.pad(bits, ((0, 0), (0, pad))).view(np.uint64)
+    gbits = np.pad(gbits, ((0, 0), (0, pad))).view(np.uint64)
+
+    inter = popcount(bits[:, None, :] & gbits[None, :, :])
+    m_area = popcount(bits)
+    iou = inter / np.maximum(m_area[:, None] + gt_area[None, :] - inter, 1)
+
+    best_part = iou[:, parts].max(axis=0) if len(parts) else np.zeros(0)
+    best_mask = iou[:, 1:].max(axis=1) if G > 1 else np.zeros(n)
+    fg_bits = ~gbits[0]
+    fg = int(gt_area[1:].sum())
+    covered = int(popcount(np.bitwise_or.reduce(bits, axis=0) & fg_bits))
+
+    # exclusive labels (smallest covering mask wins, like MaskStore.label_map):
+    # confusion of (label, part) pairs, each label counted as its majority part
+    own = np.empty_like(bits)
+    claimed = np.zeros(bits.shape[1], dtype=np.uint64)
+    for k in np.argsort(m_area, kind="stable"):
+        own[k] = bits[k] & ~claimed
+        claimed |= bits[k]
+    conf = popcount(own[:, None, :] & gbits[None, :, :])
+    right = conf[:, 1:].max(axis=1).sum() if G > 1 else 0
+
+    out.update(
+        miou=float(best_part.mean()) if len(parts) else 0.0,
+        recall=float((best_part >= iou_thresh).mean()) if len(parts) else 0.0,
+        precision=float((best_mask >= iou_thresh).mean()),
+        coverage=covered / fg if fg else 0.0,
+        pixel_acc=float(right / max(fg, 1)))
+    return out
+
+def score_shape(render_dir, sam_dir, iou_thresh=0.5, min_area=64):
+    part_dir = os.path.join(render_dir, "part_id_exr")
+    # an up to date viewstack (viewstack.py) saves decoding the exrs, it is not built here
+    stack = open_stack(render_dir, build=False)
+    if stack is not None and not stack.has("part_id"):
+        stack = None
+    views = {}
+    for fn in sorted(os.listdir(part_dir)):
+        if not fn.lower().endswith(".exr"):
+            continue
+        stem = os.path.splitext(fn)[0]
+        masks = open_view_masks(os.path.join(sam_dir, f"view_{stem}"))
+        if masks is None:
+            continue
+        if stack is not None and stem.isdigit() and int(stem) in stack:
+            part_id = stack.get("part_id", int(stem))
+        else:
+            part_id = load_exr_r(os.path.join(part_dir, fn))
+        views[stem] = score_view(part_id, masks, iou_thresh, min_area)
+    return {"views": views, "summary": summarize(list(views.values()))}
+
+# view means, parts weighted by how many parts each view shows for miou / recall
+def summarize(rows):
+    if not rows:
+        return {"views": 0}
+    parts = np.array([r["parts"] for r in rows], dtype=np.float64)
+    out = {"views": len(rows), "parts": int(parts.sum()), "masks": int(sum(r["masks"] for r in rows))}
+    for k in METRICS:
+        v = np.array([r[k] for r in rows], dtype=np.float64)
+        if k in ("miou", "recall") and parts.sum() > 0:
+            out[k] = float((v * parts).sum() / parts.sum())
+        else:
+            out[k] = float(v.mean())
+    return out
+
+def find_shapes(render_root, sam_root=None, sam_suffix="sam"):
+    pairs = []
+    for name in sorted(os.listdir(render_root)):
+        render_dir = os.path.join(render_root, name)
+        if not os.path.isdir(os.path.join(render_dir, "part_id_exr")):
+            continue
+        sam_dir = os.path.join(sam_root, name) if sam_root is not None else os.path.join(render_root, name + sam_suffix)
+        if os.path.isdir(sam_dir):
+            pairs.append((name, render_dir, sam_dir))
+    return pairs
+
+def _score(job):
+    name, render_dir, sam_dir, iou_thresh, min_area = job
+    return name, score_shape(render_dir, sam_dir, iou_thresh, min_area)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--render_dir", default=None)
+    ap.add_argument("--sam_dir", default=None)
+    ap.add_argument("--render_root", default=None)
+    ap.add_argument("--sam_root", default=None)
+    ap.add_argument("--sam_suffix", default="sam")
+    ap.add_argument("--iou", type=float, default=0.5)
+    ap.add_argument("--min_area", type=int, default=64)
+    ap.add_argument("--workers", type=int, default=1)
+    ap.add_argument("--report", default=None)
+    ap.add_argument("--csv", default=None)
+    args = ap.parse_args()
+
+    if args.render_dir is not None:
+        if args.sam_dir is None: raise SystemExit("--render_dir needs --sam_dir")
+        name = os.path.basename(os.path.normpath(args.render_dir))
+        pairs = [(name, args.render_dir, args.sam_dir)]
+    elif args.render_root is not None:
+        pairs = find_shapes(args.render_root, args.sam_root, args.sam_suffix)
+    else:
+        raise SystemExit("give --render_dir/--sam_dir or --render_root")
+    if not pairs: raise SystemExit("no shapes with both part_id_exr and sam masks found")
+
+    jobs = [(name, r, s, args.iou, args.min_area) for name, r, s in pairs]
+    if args.workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            shapes = dict(pool.map(_score, jobs))
+    else:
+        shapes = dict(map(_score, jobs))
+
+    all_views = [v for s in shapes.values() for v in s["views"].values()]
+    report = {"iou_thresh": args.iou, "min_area": args.min_area,
+              "summary": summarize(all_views),
+              "shapes": shapes}
+
+    for name, s in shapes.items():
+        m = s["summary"]
+        if m["views"]:
+            print(f"{name}: {m['views']} views  miou {m['miou']:.3f}  recall {m['recall']:.3f}  "
+                  f"precision {m['precision']:.3f}  coverage {m['coverage']:.3f}  pixel_acc {m['pixel_acc']:.3f}")
+    m = report["summary"]
+    if len(shapes) > 1 and m["views"]:
+        print(f"all: {m['views']} views  miou {m['miou']:.3f}  recall {m['recall']:.3f}  precision {m['precision']:.3f}")
+
+    if args.report is not None:
+        with open(args.report, "w") as f: json.dump(report, f, indent=2)
+    if args.csv is not None:
+        with open(args.csv, "w", newline="") as f:
+            w = csv.writer(f)
+            w.writerow(["shape", "view", "parts", "masks"] + list(METRICS))
+            for name, s in shapes.items():
+                for stem, r in s["views"].items():
+                    w.writerow([name, stem, r["parts"], r["masks"]] + [f"{r[k]:.6f}" for k in METRICS])
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,14 @@
-import os, glob, json
+import os, sys, json
 import numpy as np
 import open3d as o3d
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "render"))
+from lod import open_lod, segment_palette
+
 LIFT_DIR = r"C:\Users\jmu5\OneDrive - Brown University\Documents\temp school stuff\neurosym-playground\data\output\725lifted"
 OUT_DIR = r"C:\Users\jmu5\OneDrive - Brown University\Documents\temp school stuff\neurosym-playground\data\output\725"
 CAM_PATH = os.path.join(OUT_DIR, "cameras.json")
 
-view_dirs = sorted(glob.glob(os.path.join(LIFT_DIR, "view_*")))
-
 with open(CAM_PATH, "r") as f:
     cams = json.load(f)
 
@@ -18,7 +19,6 @@ for ci in cams:
         "c2w": np.array(ci["c2w"], dtype=np.float32),
         "w2c": np.array(ci["w2c"], dtype=np.float32)}
 
-rng = np.random.default_rng(0)
 geoms = []
 
 def cam_frame(c2w, size=0.1):
@@ -26,33 +26,21 @@ def cam_frame(c2w, size=0.1):
     frame.transform(c2w)
     return frame
 
-for vd in view_dirs[:20]:
-    view = int(os.path.basename(vd).split("_")[1])
-
-    files = sorted(glob.glob(os.path.join(vd, "*.npz")))
-    best = None
-    for fpath in files:
-        z = np.load(fpath)
-        n = int(z["points"].shape[0])
-        if n >= 2000 and (best is None or n > best[0]):
-            best = (n, fpath)
-    if best is None:
-        continue
-
-    z = np.load(best[1])
-    pts = z["points"].astype(np.float32)
-
-    if pts.shape[0] > 20000:
-        idx = rng.choice(pts.shape[0], 20000, replace=False)
-        pts = pts[idx]
-
-    pcd = o3d.geometry.PointCloud()
-    pcd.points = o3d.utility.Vector3dVector(pts)
-    c = rng.random(3)
-    pcd.colors = o3d.utility.Vector3dVector(np.repeat(c[None, :], pts.shape[0], axis=0))
-    geoms.append(pcd)
-
-    # add camera frame for this view
+# largest segment (>= 2000 points) of every view, all of them from the lod (lod.py) within
+# POINT_BUDGET points, one cloud colored by segment
+POINT_BUDGET = 2_000_000
+cloud = open_lod(LIFT_DIR)
+best = cloud.largest_per_view(min_points=2000)
+pts, seg, _ = cloud.load(POINT_BUDGET, segments=best)
+
+pcd = o3d.geometry.PointCloud()
+pcd.points = o3d.utility.Vector3dVector(pts.astype(np.float64))
+pcd.colors = o3d.utility.Vector3dVector(segment_palette(len(cloud.segments))[seg])
+geoms.append(pcd)
+
+# add camera frame for every view shown
+for view in np.unique(cloud.segments["view"][best]):
+    view = int(view)
     if view in cam_by_view:
         w2c = cam_by_view[view]["w2c"]
         c2w = np.linalg.inv(w2c).astype(np.float32)  # robust
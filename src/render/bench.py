@@ -0,0 +1,219 @@
+import os
+import sys
+import json
+import shutil
+import argparse
+import platform
+import subprocess
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import raster
+import stagetrace
+from imgio import load_exr_r
+from maskstore import STORE_NAME, write_mask_store, open_view_masks
+from fuse import fuse, iter_fragments
+
+r'''
+reproducible throughput benchmark for everything after the renderer, no blender or sam needed:
+
+  render      raster.py geometry passes (stand-in for cycles, same files)
+  mask_write  synthetic sam output per view (one mask per visible part plus seeded unions
+              of neighbouring parts up to --masks), written as packed masks.npz
+  mask_read   reading and unpacking those masks
+  lift        lift.py on the synthetic masks (subprocess, its own --trace spans)
+  fuse        fuse.py over the lifted fragments
+
+on a fixed shape subset of data/partnet_datasets. prints throughput per stage, the slowest
+traced sub stages, and compares with the reference baseline bench_baseline.json next to this
+file (or --baseline). only the settings have to match; a different cpu count is printed next
+to the ratios but still compared, so a plain linux box (ci) catches regressions:
+
+python src/render/bench.py --work /tmp/bench --require_baseline 1
+python src/render/bench.py --work /tmp/bench --save_baseline 1     # after an intended change
+
+exits 1 when a stage is more than --tolerance slower than the baseline, and with
+--require_baseline 1 also when there is no baseline for these settings.
+'''
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(HERE, "bench_baseline.json")
+DATA = os.path.join(HERE, "..", "..", "data", "partnet_datasets")
+SHAPES = "725,3229,2239"
+STAGES = ("render", "mask_write", "mask_read", "lift", "fuse")
+
+# parts plus unions of parts that touch in the image, fixed seed so every run writes the same masks
+def synthetic_masks(part_id, n_masks, seed):
+    pid = np.rint(part_id).astype(np.int64)
+    ids, area = np.unique(pid[pid > 0], return_counts=True)
+    ids = ids[area >= 64]
+    masks = [pid == i for i in ids]
+    if len(masks) == 0:
+        return np.zeros((0,) + pid.shape, dtype=bool)
+
+    # parts touching horizontally or vertically
+    a = np.concatenate([pid[:, :-1].reshape(-1), pid[:-1, :].reshape(-1)])
+    b = np.concatenate([pid[:, 1:].reshape(-1), pid[1:, :].reshape(-1)])
+    keep = (a != b) & np.isin(a, ids) & np.isin(b, ids)
+    pairs = np.unique(np.sort(np.stack([a[keep], b[keep]], axis=1), axis=1), axis=0)
+
+    rng = np.random.default_rng(seed)
+    masks.append(np.isin(pid, ids))
+    while len(masks) < n_masks and len(pairs):
+        i, j = pairs[rng.integers(len(pairs))]
+        grown = (pid == i) | (pid == j)
+        # sometimes a third part off either end
+        if rng.random() < 0.5:
+            near = pairs[(pairs[:, 0] == j) | (pairs[:, 1] == j)].reshape(-1)
+            grown |= pid == near[rng.integers(len(near))]
+        masks.append(grown)
+    return np.stack(masks[:n_masks])
+
+def mask_meta(masks, stem):
+    meta = []
+    for j, m in enumerate(masks):
+        ys, xs = np.nonzero(m)
+        bbox = [int(xs.min()), int(ys.min()), int(xs.max() - xs.min() + 1), int(ys.max() - ys.min() + 1)] if len(xs) else [0, 0, 0, 0]
+        meta.append({"mask_id": j, "area": int(m.sum()), "bbox": bbox,
+                     "predicted_iou": 1.0, "stability_score": 1.0,
+                     "mask_path": f"view_{stem}/{STORE_NAME}", "mask_index": j})
+    return meta
+
+def run_shape(sid, args, work, trace_path):
+    in_dir = os.path.join(args.data, sid)
+    out_dir = os.path.join(work, sid)
+    sam_dir = out_dir + "sam"
+    lift_dir = out_dir + "lifted"
+    for d in (out_dir, sam_dir, lift_dir):
+        shutil.rmtree(d, ignore_errors=True)
+
+    sec, n = {}, {}
+    with stagetrace.span("bench_render", shape=sid) as rec:
+        raster.render_shape(in_dir, out_dir, args.views, args.res)
+    sec["render"], n["render"] = rec["dt"], args.views
+
+    stems = [f"{v:03d}" for v in range(args.views)]
+    written = 0
+    with stagetrace.span("bench_mask_write", shape=sid) as rec:
+        for v, stem in enumerate(stems):
+            masks = synthetic_masks(load_exr_r(os.path.join(out_dir, "part_id_exr", f"{stem}.exr")), args.masks, v)
+            view_dir = os.path.join(sam_dir, f"view_{stem}")
+            os.makedirs(view_dir, exist_ok=True)
+            meta = mask_meta(masks, stem)
+            write_mask_store(os.path.join(view_dir, STORE_NAME), masks, meta)
+            with open(os.path.join(view_dir, "meta.json"), "w") as f: json.dump(meta, f)
+            written += len(masks)
+    sec["mask_write"], n["mask_write"] = rec["dt"], written
+
+    with stagetrace.span("bench_mask_read", shape=sid) as rec:
+        for stem in stems:
+            open_view_masks(os.path.join(sam_dir, f"view_{stem}")).flat()
+    sec["mask_read"], n["mask_read"] = rec["dt"], written
+
+    cmd = [sys.executable, os.path.join(HERE, "lift.py"), "--",
+           "--out_dir", out_dir, "--sam2d_dir", sam_dir, "--lift_dir", lift_dir,
+           "--voxel", str(args.voxel), "--workers", str(args.lift_workers), "--trace", trace_path]
+    with stagetrace.span("bench_lift", shape=sid) as rec:
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+    sec["lift"], n["lift"] = rec["dt"], args.views
+
+    with stagetrace.span("bench_fuse", shape=sid) as rec:
+        _, _, _, segments = fuse(iter_fragments(lift_dir), args.fuse_voxel)
+        rec["segments"] = len(segments)
+    sec["fuse"], n["fuse"] = rec["dt"], args.views
+    return sec, n
+
+def settings(args):
+    return {"shapes": args.shapes, "views": args.views, "res": args.res, "masks": args.masks,
+            "voxel": args.voxel, "fuse_voxel": args.fuse_voxel, "lift_workers": args.lift_workers}
+
+UNITS = {"render": "views", "mask_write": "masks", "mask_read": "masks", "lift": "views", "fuse": "views"}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--work", required=True, help="scratch dir, its shape dirs are wiped per run")
+    ap.add_argument("--data", default=DATA)
+    ap.add_argument("--shapes", default=SHAPES)
+    ap.add_argument("--views", type=int, default=12)
+    ap.add_argument("--res", type=int, default=256)
+    ap.add_argument("--masks", type=int, default=30)
+    ap.add_argument("--voxel", type=float, default=0.0)
+    ap.add_argument("--fuse_voxel", type=float, default=0.02)
+    ap.add_argument("--lift_workers", type=int, default=1)
+    ap.add_argument("--repeat", type=int, default=1, help="best of n per stage")
+    ap.add_argument("--baseline", default=BASELINE)
+    ap.add_argument("--save_baseline", type=int, default=0)
+    ap.add_argument("--require_baseline", type=int, default=0, help="fail without a comparable baseline")
+    ap.add_argument("--tolerance", type=float, default=0.25)
+    ap.add_argument("--report", default=None)
+    args = ap.parse_args()
+
+    os.makedirs(args.work, exist_ok=True)
+    trace_path = os.path.join(args.work, "trace.jsonl")
+    if os.path.exists(trace_path):
+        os.remove(trace_path)
+    stagetrace.configure(trace_path, "bench")
+
+    # best of --repeat per stage, item counts are the same every pass
+    best = {s: float("inf") for s in STAGES}
+    items = {s: 0 for s in STAGES}
+    for k in range(max(1, args.repeat)):
+        total = {s: 0.0 for s in STAGES}
+        for sid in args.shapes.split(","):
+            sec, n = run_shape(sid, args, args.work, trace_path)
+            for s in STAGES:
+                total[s] += sec[s]
+                if k == 0:
+                    items[s] += n[s]
+        for s in STAGES:
+            best[s] = min(best[s], total[s])
+
+    result = {"settings": settings(args), "machine": {"platform": platform.platform(), "cpus": os.cpu_count(),
+              "python": platform.python_version(), "numpy": np.__version__}, "stages": {}}
+    for s in STAGES:
+        result["stages"][s] = {"seconds": best[s], "items": items[s], "per_s": items[s] / max(best[s], 1e-9)}
+
+    base = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, "r") as f:
+            base = json.load(f)
+        if base.get("settings") != result["settings"]:
+            print(f"baseline {args.baseline} was taken with other settings, not comparing")
+            base = None
+        elif base.get("machine", {}).get("cpus") != result["machine"]["cpus"]:
+            print(f"baseline {args.baseline} was taken with {base['machine'].get('cpus')} cpus, "
+                  f"this machine has {result['machine']['cpus']}")
+    if base is None and args.require_baseline and not args.save_baseline:
+        raise SystemExit(f"no baseline for these settings in {args.baseline}")
+
+    regressions = []
+    print(f"{'stage':12s} {'seconds':>9s} {'throughput':>18s} {'baseline':>12s} {'ratio':>7s}")
+    for s in STAGES:
+        r = result["stages"][s]
+        line = f"{s:12s} {r['seconds']:9.2f} {r['per_s']:11.1f} {UNITS[s] + '/s':>6s}"
+        if base is not None and s in base["stages"]:
+            ratio = r["per_s"] / max(base["stages"][s]["per_s"], 1e-9)
+            r["ratio"] = ratio
+            line += f" {base['stages'][s]['per_s']:12.1f} {ratio:7.2f}"
+            if ratio < 1.0 - args.tolerance:
+                regressions.append(s)
+                line += "  SLOWER"
+        print(line)
+
+    summary = stagetrace.summarize(stagetrace.read([trace_path]))
+    result["trace"] = summary
+    print()
+    stagetrace.print_summary({k: v for k, v in summary.items() if not k.startswith("bench/bench_")})
+
+    if args.report is not None:
+        with open(args.report, "w") as f: json.dump(result, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({k: result[k] for k in ("settings", "machine", "stages")}, f, indent=2)
+        print("saved baseline", args.baseline)
+
+    if regressions:
+        raise SystemExit(f"slower than baseline by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import math
+import numpy as np
+
+# camera math shared by the numpy backends, mirrors render_multi.py:
+# blender camera looks down -Z with +Y up, look_at tracks '-Z' with world Z as up
+
+LENS = 50.0
+SENSOR_WIDTH = 36.0
+
+def intrinsics(res, lens=LENS, sensor_width=SENSOR_WIDTH):
+    fx = (lens / sensor_width) * res
+    return {"fx": fx, "fy": fx, "cx": res / 2.0, "cy": res / 2.0, "w": res, "h": res}
+
+def look_at_c2w(eye, target=(0.0, 0.0, 0.0)):
+    eye = np.asarray(eye, dtype=np.float64)
+    fwd = np.asarray(target, dtype=np.float64) - eye
+    fwd /= np.linalg.norm(fwd)
+
+    right = np.cross(fwd, [0.0, 0.0, 1.0])
+    if np.linalg.norm(right) < 1e-8:
+        # looking straight up or down, blender falls back to the world Y axis
+        right = np.cross(fwd, [0.0, 1.0, 0.0])
+    right /= np.linalg.norm(right)
+    up = np.cross(right, fwd)
+
+    c2w = np.eye(4)
+    c2w[:3, 0] = right
+    c2w[:3, 1] = up
+    c2w[:3, 2] = -fwd
+    c2w[:3, 3] = eye
+    return c2w
+
+def orbit_eye(i, views, radius, elev_deg):
+    az = 2.0 * math.pi * (i / views)
+    elev = math.radians(elev_deg)
+    return (radius * math.cos(az) * math.cos(elev),
+            radius * math.sin(az) * math.cos(elev),
+            radius * math.sin(elev))
+
+# one cameras.json record
+def camera_record(view, c2w, res, lens=LENS, sensor_width=SENSOR_WIDTH):
+    c2w = np.asarray(c2w, dtype=np.float64)
+    w2c = np.linalg.inv(c2w)
+    return {
+        "view": int(view),
+        "intrinsics": intrinsics(res, lens, sensor_width),
+        "c2w": c2w.tolist(),
+        "w2c": w2c.tolist()}
+
+def orbit_cameras(views, res, radius, elev_deg, view_start=0, view_end=None):
+    view_end = views if view_end is None else view_end
+    return [camera_record(i, look_at_c2w(orbit_eye(i, views, radius, elev_deg)), res)
+            for i in range(view_start, view_end)]
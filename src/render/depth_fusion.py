@@ -0,0 +1,326 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from imgio import load_exr_r, load_png_rgb_u8
+from maskstore import open_view_masks
+from lift_engine import ray_grid, save_npz
+from viewstack import open_stack
+from voxel import group
+import stagetrace
+
+r'''
+volumetric fusion of every depth_exr view into one sparse truncated signed distance grid,
+instead of lift.py's copy of every surface point per view that sees it. only voxels within
+--trunc of some observed surface exist, so the output grows with surface area, not --views.
+
+two passes over the views:
+  allocate   every valid depth pixel marks the voxels its ray crosses within +-trunc
+  integrate  every allocated voxel center is projected into every view: sdf = observed depth
+             minus voxel depth (planar, like the renders), clipped to [-1, 1] in trunc units,
+             averaged over the views that see it (background pixels count as free space)
+
+near the surface every view also votes with its part_id_exr id and, with --sam2d_dir and a
+fuse.py fused.json in --lift_dir, with the fused sam segment of that pixel; a voxel keeps the
+majority of each.
+
+python src/render/depth_fusion.py --out_dir "$out/725" --sam2d_dir "$out/725sam" `
+  --lift_dir "$out/725lifted" --voxel 0.01 [--ply "$out/725tsdf.ply"]
+
+writes <out_dir>tsdf.npz (next to <out_dir>sam / <out_dir>lifted, or --out):
+  coords (M,3) int32 voxel ids, tsdf (M,) float16, weight (M,) uint16, colors (M,3) uint8,
+  ray (M,3) float16 mean viewing direction, part (M,) int32 / segment (M,) int32 (-1 = none),
+  voxel, trunc
+
+surface_points(z) turns it into one oriented, colored point per surface voxel (each voxel
+center moved by its sdf along the viewing direction, normals from the sdf gradient); --ply
+writes those. an up to date viewstack (viewstack.py) is used instead of the png / exr files.
+'''
+
+# packed voxel keys: 21 bits per axis around zero
+KEY_BITS = 21
+KEY_OFF = 1 << (KEY_BITS - 1)
+
+def pack(coords):
+    c = coords.astype(np.int64) + KEY_OFF
+    return (c[:, 0] << (2 * KEY_BITS)) | (c[:, 1] << KEY_BITS) | c[:, 2]
+
+# vote keys: voxel index in the high bits, label in the low ones
+LABEL_BITS = 20
+
+# (vox, label) vote pairs merged into running (keys, counts)
+def merge_votes(keys, counts, vox, labels):
+    new = (vox.astype(np.int64) << LABEL_BITS) | labels.astype(np.int64)
+    u, inv = np.unique(np.concatenate([keys, new]), return_inverse=True)
+    c = np.bincount(inv, weights=np.concatenate([counts, np.ones(len(new))]), minlength=len(u))
+    return u, c
+
+# (M,) label with the most votes per voxel, -1 without any; ties go to the smaller label
+def majority(keys, counts, n_vox):
+    out = np.full(n_vox, -1, dtype=np.int32)
+    if len(keys) == 0:
+        return out
+    vox, lab = keys >> LABEL_BITS, keys & ((1 << LABEL_BITS) - 1)
+    order = np.lexsort((lab, -counts, vox))
+    vox, lab = vox[order], lab[order]
+    head = np.r_[True, vox[1:] != vox[:-1]]
+    out[vox[head]] = lab[head]
+    return out
+
+class TsdfFusion:
+    def __init__(self, voxel=0.01, trunc=None, min_d=1e-6, max_d=1e9):
+        self.voxel = float(voxel)
+        self.trunc = float(trunc) if trunc is not None else 3.0 * self.voxel
+        self.min_d, self.max_d = min_d, max_d
+        self.coords = np.zeros((0, 3), dtype=np.int64)
+
+    # camera space (planar depth) of pixels -> world
+    def _pixels(self, depth, c2w, intr):
+        H, W = depth.shape
+        rx, ry = ray_grid(H, W, float(intr["fx"]), float(intr["fy"]), float(intr["cx"]), float(intr["cy"]))
+        d = depth.reshape(-1)
+        pix = np.flatnonzero((d > self.min_d) & (d < self.max_d))
+        return pix, rx[pix], ry[pix], d[pix], np.asarray(c2w, dtype=np.float64)
+
+    # pass 1: the voxels every ray crosses within +-trunc of its depth
+    def allocate(self, depth, c2w, intr):
+        pix, rx, ry, d, c2w = self._pixels(depth, c2w, intr)
+        if len(pix) == 0:
+            return
+        # half voxel steps in depth, so no voxel along the ray is skipped
+        steps = np.arange(-self.trunc, self.trunc + 1e-9, 0.5 * self.voxel)
+        new = []
+        for s in steps:
+            z = d + s
+            cam = np.stack([rx * z, ry * z, -z], axis=1)
+            new.append(np.floor((cam @ c2w[:3, :3].T + c2w[:3, 3]) / self.voxel).astype(np.int64))
+        coords = np.concatenate([self.coords] + new)
+        _, first = group(coords)
+        self.coords = coords[first]
+
+    # pass 2 setup, after every view went through allocate
+    def begin(self):
+        M = len(self.coords)
+        self.centers = (self.coords + 0.5) * self.voxel
+        self.tsdf_sum = np.zeros(M)
+        self.weight = np.zeros(M)
+        self.color_sum = np.zeros((M, 3))
+        self.ray_sum = np.zeros((M, 3))
+        self.votes = {}
+
+    # pass 2: one view into every allocated voxel; labels are (H,W) int maps, -1 = none
+    def integrate(self, depth, c2w, intr, rgb=None, labels=None):
+        H, W = depth.shape
+        c2w = np.asarray(c2w, dtype=np.float64)
+        w2c = np.linalg.inv(c2w)
+        cam = self.centers @ w2c[:3, :3].T + w2c[:3, 3]
+        z = -cam[:, 2]
+        front = z > self.min_d
+        u = np.full(len(z), -1, dtype=np.int64)
+        v = np.full(len(z), -1, dtype=np.int64)
+        u[front] = np.floor(float(intr["cx"]) + float(intr["fx"]) * cam[front, 0] / z[front]).astype(np.int64)
+        v[front] = np.floor(float(intr["cy"]) - float(intr["fy"]) * cam[front, 1] / z[front]).astype(np.int64)
+        seen = np.flatnonzero(front & (u >= 0) & (u < W) & (v >= 0) & (v < H))
+        pix = v[seen] * W + u[seen]
+        d = depth.reshape(-1)[pix]
+
+        # background is free space, 0 / unrendered (a render border) says nothing
+        sdf = np.where(d >= self.max_d, 1.0, (d - z[seen]) / self.trunc)
+        ok = (d > self.min_d) & (sdf >= -1.0)
+        idx, pix, sdf = seen[ok], pix[ok], np.minimum(sdf[ok], 1.0)
+
+        self.tsdf_sum[idx] += sdf
+        self.weight[idx] += 1.0
+        ray = self.centers[idx] - c2w[:3, 3]
+        self.ray_sum[idx] += ray / np.linalg.norm(ray, axis=1, keepdims=True)
+        if rgb is not None:
+            self.color_sum[idx] += rgb.reshape(-1, 3)[pix]
+
+        # labels only from views that see the voxel at the surface
+        near = np.abs(sdf) < 0.5
+        for name, lab in (labels or {}).items():
+            l = lab.reshape(-1)[pix[near]]
+            keep = (l >= 0) & (l < (1 << LABEL_BITS))
+            keys, counts = self.votes.get(name, (np.zeros(0, np.int64), np.zeros(0)))
+            self.votes[name] = merge_votes(keys, counts, idx[near][keep], l[keep])
+
+    # voxels some view saw within the band, compact arrays
+    def result(self, min_weight=1):
+        w = self.weight
+        tsdf = np.divide(self.tsdf_sum, w, out=np.ones_like(w), where=w > 0)
+        keep = (w >= min_weight) & (tsdf < 1.0)
+        out = {"coords": self.coords[keep].astype(np.int32),
+               "tsdf": tsdf[keep].astype(np.float16),
+               "weight": np.minimum(w[keep], 65535).astype(np.uint16),
+               "colors": np.clip(np.rint(self.color_sum[keep] / np.maximum(w[keep], 1)[:, None]), 0, 255).astype(np.uint8),
+               "voxel": np.float32(self.voxel), "trunc": np.float32(self.trunc)}
+        ray = self.ray_sum[keep]
+        out["ray"] = (ray / np.maximum(np.linalg.norm(ray, axis=1, keepdims=True), 1e-12)).astype(np.float16)
+        for name, (keys, counts) in self.votes.items():
+            out[name] = majority(keys, counts, len(w))[keep]
+        return out
+
+# sdf of the 6 neighbours by packed key lookup, central / one sided differences
+def sdf_gradient(coords, tsdf):
+    keys = pack(coords)
+    order = np.argsort(keys)
+    sk = keys[order]
+    vals = tsdf.astype(np.float64)[order]
+    grad = np.zeros((len(coords), 3))
+    for axis in range(3):
+        step = np.int64(1) << np.int64((2 - axis) * KEY_BITS)
+        side = []
+        for sgn in (1, -1):
+            q = sk + sgn * step
+            pos = np.minimum(np.searchsorted(sk, q), len(sk) - 1)
+            hit = sk[pos] == q
+            side.append((hit, np.where(hit, vals[pos], 0.0)))
+        (hp, vp), (hm, vm) = side
+        g = np.where(hp & hm, (vp - vm) / 2, np.where(hp, vp - vals, np.where(hm, vals - vm, 0.0)))
+        grad[order, axis] = g
+    return grad
+
+# one point per voxel the surface passes through: center moved by sdf along the mean viewing
+# direction, normal from the sdf gradient (the viewing direction where that is flat)
+def surface_points(z, min_weight=1):
+    voxel, trunc = float(z["voxel"]), float(z["trunc"])
+    tsdf = z["tsdf"].astype(np.float64)
+    ray = z["ray"].astype(np.float64)
+    grad = sdf_gradient(z["coords"], tsdf)
+    # within half a voxel diagonal of the surface, so the band gives one layer of points
+    keep = (np.abs(tsdf) * trunc <= 0.87 * voxel) & (z["weight"] >= min_weight)
+    centers = (z["coords"][keep] + 0.5) * voxel
+    points = centers + (tsdf[keep] * trunc)[:, None] * ray[keep]
+    n = grad[keep]
+    norm = np.linalg.norm(n, axis=1, keepdims=True)
+    n = np.where(norm > 1e-9, n / np.maximum(norm, 1e-12), -ray[keep])
+    out = {"points": points.astype(np.float32), "normals": n.astype(np.float32), "colors": z["colors"][keep]}
+    for name in ("part", "segment"):
+        if name in z:
+            out[name] = z[name][keep]
+    return out
+
+def write_ply(path, surf):
+    fields = [("x", "<f4"), ("y", "<f4"), ("z", "<f4"), ("nx", "<f4"), ("ny", "<f4"), ("nz", "<f4"),
+              ("red", "u1"), ("green", "u1"), ("blue", "u1")]
+    labels = [k for k in ("part", "segment") if k in surf]
+    fields += [(k, "<i4") for k in labels]
+    rec = np.empty(len(surf["points"]), dtype=fields)
+    for j, k in enumerate("xyz"):
+        rec[k] = surf["points"][:, j]
+        rec["n" + k] = surf["normals"][:, j]
+    for j, k in enumerate(("red", "green", "blue")):
+        rec[k] = surf["colors"][:, j]
+    for k in labels:
+        rec[k] = surf[k]
+    types = {"<f4": "float", "u1": "uchar", "<i4": "int"}
+    header = "ply\nformat binary_little_endian 1.0\n" + f"element vertex {len(rec)}\n"
+    header += "".join(f"property {types[t]} {k}\n" for k, t in fields) + "end_header\n"
+    with open(path, "wb") as f:
+        f.write(header.encode("ascii"))
+        f.write(rec.tobytes())
+
+# (view, mask_id) -> fused label from fuse.py's fused.json
+def fused_segment_ids(lift_dir):
+    path = os.path.join(lift_dir, "fused.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        segments = json.load(f)
+    return {(int(v), int(m)): int(s["label"]) for s in segments for v, m in s["fragments"]}
+
+# (H,W) fused segment per pixel, the smaller mask where masks overlap
+def segment_map(sam2d_dir, stem, seg_ids):
+    masks = open_view_masks(os.path.join(sam2d_dir, f"view_{stem}"))
+    if masks is None or len(masks) == 0:
+        return None
+    lm = masks.label_map()
+    lut = np.array([seg_ids.get((int(stem), int(m)), -1) for m in masks.mask_id] + [-1], dtype=np.int32)
+    return lut[lm]
+
+def fuse_depth(out_dir, voxel=0.01, trunc=None, sam2d_dir=None, lift_dir=None, min_weight=1, max_d=1e9):
+    stack = open_stack(out_dir, build=False)
+    if stack is not None:
+        cams = stack.cameras()
+    else:
+        with open(os.path.join(out_dir, "cameras.json"), "r") as f:
+            cams = sorted(json.load(f), key=lambda d: int(d.get("view", 0)))
+
+    def path(name, v):
+        sub = {"depth": "depth_exr", "part_id": "part_id_exr", "rgb": "rgb"}[name]
+        return os.path.join(out_dir, sub, f"{v:03d}" + (".png" if name == "rgb" else ".exr"))
+
+    # checked without decoding, every pass reads each view once
+    def has(name, v):
+        if stack is not None and stack.has(name):
+            return v in stack
+        return os.path.exists(path(name, v))
+
+    def read(name, v):
+        if not has(name, v):
+            return None
+        if stack is not None and stack.has(name):
+            return stack.get(name, v)
+        return (load_png_rgb_u8 if name == "rgb" else load_exr_r)(path(name, v))
+
+    seg_ids = fused_segment_ids(lift_dir) if (sam2d_dir is not None and lift_dir is not None) else None
+    if sam2d_dir is not None and seg_ids is None:
+        print("no fused.json in --lift_dir, skipping sam segment labels (run fuse.py first)")
+
+    fusion = TsdfFusion(voxel, trunc, max_d=max_d)
+    cams = [c for c in cams if has("depth", int(c["view"]))]
+    for c in cams:
+        with stagetrace.span("fusion_allocate", view=f"{int(c['view']):03d}"):
+            fusion.allocate(read("depth", int(c["view"])), c["c2w"], c["intrinsics"])
+    fusion.begin()
+
+    for c in cams:
+        v = int(c["view"])
+        stem = f"{v:03d}"
+        with stagetrace.span("fusion_integrate", view=stem, voxels=len(fusion.coords)):
+            labels = {}
+            part = read("part_id", v)
+            if part is not None:
+                # pass index 0 is background
+                labels["part"] = np.rint(part).astype(np.int64) - 1
+            if seg_ids is not None:
+                seg = segment_map(sam2d_dir, stem, seg_ids)
+                if seg is not None:
+                    labels["segment"] = seg
+            fusion.integrate(read("depth", v), c["c2w"], c["intrinsics"], read("rgb", v), labels)
+    return fusion.result(min_weight), len(cams)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--out_dir", required=True, help="render dir with depth_exr/ and cameras.json")
+    ap.add_argument("--sam2d_dir", default=None)
+    ap.add_argument("--lift_dir", default=None, help="for fuse.py's fused.json, the global sam segment ids")
+    ap.add_argument("--out", default=None, help="default <out_dir>tsdf.npz")
+    ap.add_argument("--voxel", type=float, default=0.01)
+    ap.add_argument("--trunc", type=float, default=None, help="default 3 voxels")
+    ap.add_argument("--min_weight", type=int, default=1, help="views that must see a voxel")
+    ap.add_argument("--max_depth", type=float, default=1e9)
+    ap.add_argument("--ply", default=None, help="write the surface points here")
+    ap.add_argument("--trace", default=None)
+    args = ap.parse_args()
+    stagetrace.configure(args.trace, "depth_fusion")
+
+    t0 = time.time()
+    z, n_views = fuse_depth(args.out_dir, args.voxel, args.trunc, args.sam2d_dir, args.lift_dir,
+                            args.min_weight, args.max_depth)
+    out = args.out if args.out is not None else os.path.normpath(args.out_dir) + "tsdf.npz"
+    save_npz(out, **z)
+    print(f"fused {n_views} views into {len(z['tsdf'])} voxels in {time.time() - t0:.1f}s -> {out} "
+          f"({os.path.getsize(out) / 2**20:.1f} MB)")
+
+    if args.ply is not None:
+        surf = surface_points(z, args.min_weight)
+        write_ply(args.ply, surf)
+        print(f"{len(surf['points'])} surface points -> {args.ply}")
+
+if __name__ == "__main__":
+    main()
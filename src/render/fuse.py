@@ -0,0 +1,228 @@
+import os
+import sys
+import glob
+import json
+import shutil
+import argparse
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from voxel import voxel_coords, group, reduce_sum
+from liftstore import LiftStore
+from lift_engine import save_npz
+
+r'''
+cross-view fusion: every lifted (view, mask) fragment becomes a set of voxels in one
+shared grid, fragments from different views are merged when their voxel sets overlap
+(iou over voxels, never two masks of one view into the same segment), and each voxel gets the label of the smallest fused segment that
+covers it, so nested parts (a leg inside the whole chair) keep their own label.
+
+python src/render/fuse.py --lift_dir "$out/725lifted" --voxel 0.02 [--drop_lifted 1]
+
+writes <lift_dir>/fused.npz (points, colors, labels per voxel) and fused.json
+(which fragments went into every label). reads <lift_dir>/store if lift.py wrote one.
+'''
+
+# max (fragment, fragment) candidates held at once while counting overlaps
+CHUNK = 1 << 22
+# above this many candidate pairs overlaps are estimated on a fixed hashed subset of the
+# voxels (sizes on the same subset), so the work stays proportional to the lifted points
+PAIR_BUDGET = 1 << 26
+
+def iter_fragments(lift_dir):
+    store_dir = os.path.join(lift_dir, "store")
+    if os.path.isdir(store_dir):
+        store = LiftStore(store_dir)
+        for k in range(len(store)):
+            pts, cols = store.segment(k)
+            row = store.index[k]
+            yield int(row["view"]), int(row["mask_id"]), pts, cols
+        return
+    for f in sorted(glob.glob(os.path.join(lift_dir, "view_*", "mask_*.npz"))):
+        view = int(os.path.basename(os.path.dirname(f)).split("_")[1])
+        mid = int(os.path.splitext(os.path.basename(f))[0].split("_")[1])
+        z = np.load(f)
+        yield view, mid, z["points"].astype(np.float32), z["colors"]
+
+# every fragment reduced to its own voxels (with point/color sums), concatenated
+def fragment_voxels(fragments, voxel):
+    frags, seg, coords, count, psum, csum = [], [], [], [], [], []
+    for view, mid, pts, cols in fragments:
+        if len(pts) == 0:
+            continue
+        c = voxel_coords(pts, voxel)
+        labels, first = group(c)
+        m = len(first)
+        seg.append(np.full(m, len(frags), dtype=np.int64))
+        coords.append(c[first])
+        count.append(np.bincount(labels, minlength=m))
+        psum.append(reduce_sum(labels, m, pts))
+        csum.append(reduce_sum(labels, m, cols))
+        frags.append((view, mid))
+    if not frags:
+        e = np.zeros(0, np.int64)
+        return frags, e, np.zeros((0, 3), np.int64), np.zeros(0), np.zeros((0, 3)), np.zeros((0, 3))
+    return (frags, np.concatenate(seg), np.concatenate(coords), np.concatenate(count),
+            np.concatenate(psum), np.concatenate(csum))
+
+# shared voxel count of every pair of fragments from different views, only pairs that share a voxel
+def pair_overlaps(seg, vox, frag_view):
+    n = len(seg)
+    if n == 0:
+        # nothing lifted, or no voxel survived the sampling
+        e = np.zeros(0, np.int64)
+        return e, e, e
+    order = np.lexsort((seg, vox))
+    seg, vox = seg[order], vox[order]
+
+    # entry i pairs with the rest of its voxel run after it
+    run_end = np.r_[np.flatnonzero(vox[1:] != vox[:-1]) + 1, n]
+    ends = np.repeat(run_end, np.diff(np.r_[0, run_end]))
+    later = ends - np.arange(n) - 1
+
+    S = int(seg.max()) + 1
+    keys, counts = [], []
+    cum = np.cumsum(later)
+    start = 0
+    while start < n:
+        stop = max(int(np.searchsorted(cum, cum[start] - later[start] + CHUNK, side="right")), start + 1)
+        idx = np.arange(start, stop)
+        start = stop
+
+        k = later[idx]
+        a = np.repeat(idx, k)
+        b = a + 1 + np.arange(k.sum()) - np.repeat(np.cumsum(k) - k, k)
+        sa, sb = seg[a], seg[b]
+        cross = frag_view[sa] != frag_view[sb]
+        u, c = np.unique(sa[cross] * S + sb[cross], return_counts=True)
+        keys.append(u)
+        counts.append(c)
+
+    keys = np.concatenate(keys)
+    counts = np.concatenate(counts)
+    u, inv = np.unique(keys, return_inverse=True)
+    inter = np.bincount(inv.reshape(-1), weights=counts).astype(np.int64)
+    return u // S, u % S, inter
+
+# greedy merge in order of decreasing score; a view shows a 3d segment as one mask,
+# so two groups that both hold a fragment of the same view are never merged
+def merge_groups(n, a, b, score, frag_view):
+    parent = np.arange(n)
+    views = np.zeros((n, int(frag_view.max()) + 1), dtype=bool)
+    views[np.arange(n), frag_view] = True
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for k in np.argsort(-score, kind="stable").tolist():
+        rx, ry = find(int(a[k])), find(int(b[k]))
+        if rx == ry or (views[rx] & views[ry]).any():
+            continue
+        lo, hi = min(rx, ry), max(rx, ry)
+        parent[hi] = lo
+        views[lo] |= views[hi]
+    return np.array([find(x) for x in range(n)])
+
+def fuse(fragments, voxel=0.02, iou=0.5, min_support=2, min_fragments=2, min_voxels=20):
+    frags, seg, coords, count, psum, csum = fragment_voxels(fragments, voxel)
+    frag_view = np.array([v for v, _ in frags], dtype=np.int64)
+    n_frag = len(frags)
+    if n_frag == 0:
+        return np.zeros((0, 3), np.float32), np.zeros((0, 3), np.uint8), np.zeros(0, np.int32), []
+
+    # one grid for all fragments: vox is the shared voxel id of every (fragment, voxel) entry
+    vox, first = group(coords)
+    V = len(first)
+    size = np.bincount(seg, minlength=n_frag)
+
+    # voxel shared by k fragments is k*(k-1)/2 candidates
+    per_vox = np.bincount(vox, minlength=V)
+    total = int((per_vox * (per_vox - 1) // 2).sum())
+    if total > PAIR_BUDGET:
+        rate = PAIR_BUDGET / total
+        h = (vox.astype(np.uint64) * np.uint64(2654435761)) & np.uint64(0xffffffff)
+        sample = h < np.uint64(rate * 2**32)
+        a, b, inter = pair_overlaps(seg[sample], vox[sample], frag_view)
+        sub = np.bincount(seg[sample], minlength=n_frag)
+        score = inter / np.maximum(sub[a] + sub[b] - inter, 1)
+    else:
+        a, b, inter = pair_overlaps(seg, vox, frag_view)
+        score = inter / (size[a] + size[b] - inter)
+    hit = score >= iou
+    root = merge_groups(n_frag, a[hit], b[hit], score[hit], frag_view)
+    _, fused = np.unique(root, return_inverse=True)
+    n_fused = int(fused.max()) + 1
+    members = np.bincount(fused, minlength=n_fused)
+
+    # a fused segment covers a voxel when enough of its fragments do
+    f_of = fused[seg]
+    fk, fc = np.unique(f_of * V + vox, return_counts=True)
+    cf, cv = fk // V, fk % V
+    keep = (fc >= np.minimum(min_support, members[cf])) & (members[cf] >= min_fragments)
+    cf, cv = cf[keep], cv[keep]
+    f_size = np.bincount(cf, minlength=n_fused)
+    keep = f_size[cf] >= min_voxels
+    cf, cv = cf[keep], cv[keep]
+
+    # smallest covering segment wins the voxel
+    order = np.lexsort((cf, f_size[cf], cv))
+    cf, cv = cf[order], cv[order]
+    head = np.ones(len(cv), dtype=bool)
+    head[1:] = cv[1:] != cv[:-1]
+    labels = np.full(V, -1, dtype=np.int64)
+    labels[cv[head]] = cf[head]
+
+    # compact labels, biggest first
+    won = np.bincount(labels[labels >= 0], minlength=n_fused)
+    rank = np.argsort(-won, kind="stable")
+    n_out = int((won > 0).sum())
+    remap = np.full(n_fused, -1, dtype=np.int64)
+    remap[rank[:n_out]] = np.arange(n_out)
+    labels = np.where(labels >= 0, remap[np.maximum(labels, 0)], -1).astype(np.int32)
+
+    # voxel centroid / mean color over every fragment that saw it
+    w = np.bincount(vox, weights=count, minlength=V)
+    points = (reduce_sum(vox, V, psum) / w[:, None]).astype(np.float32)
+    colors = np.clip(np.rint(reduce_sum(vox, V, csum) / w[:, None]), 0, 255).astype(np.uint8)
+
+    segments = []
+    for f in rank[:n_out]:
+        mem = np.flatnonzero(fused == f)
+        segments.append({
+            "label": int(remap[f]),
+            "voxels": int(won[f]),
+            "views": int(len(np.unique(frag_view[mem]))),
+            "fragments": [[int(frags[j][0]), int(frags[j][1])] for j in mem]})
+    return points, colors, labels, segments
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--lift_dir", required=True)
+    ap.add_argument("--out", default=None)
+    ap.add_argument("--voxel", type=float, default=0.02)
+    ap.add_argument("--iou", type=float, default=0.5)
+    ap.add_argument("--min_support", type=int, default=2)
+    ap.add_argument("--min_fragments", type=int, default=2)
+    ap.add_argument("--min_voxels", type=int, default=20)
+    ap.add_argument("--drop_lifted", type=int, default=0)
+    args = ap.parse_args()
+
+    out = args.out if args.out is not None else os.path.join(args.lift_dir, "fused.npz")
+    points, colors, labels, segments = fuse(iter_fragments(args.lift_dir), args.voxel, args.iou,
+                                            args.min_support, args.min_fragments, args.min_voxels)
+    save_npz(out, points=points, colors=colors, labels=labels, voxel=np.float32(args.voxel))
+    with open(os.path.splitext(out)[0] + ".json", "w") as f: json.dump(segments, f, indent=2)
+    print(f"fused into {len(segments)} segments over {len(points)} voxels ({int((labels >= 0).sum())} labeled) -> {out}")
+
+    # the per-view fragments are redundant once fused; the store goes too, iter_fragments
+    # would otherwise keep finding segments that fused.npz no longer matches
+    if args.drop_lifted:
+        for vd in sorted(glob.glob(os.path.join(args.lift_dir, "view_*"))) + [os.path.join(args.lift_dir, "store")]:
+            if os.path.isdir(vd):
+                shutil.rmtree(vd)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+import struct
+import zlib
+import numpy as np
+
+# opencv decodes png in C when it is installed (sam_seg.py needs it anyway),
+# otherwise png falls back to the zlib + numpy decoder below
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+# numpy image io for the formats the pipeline writes, no blender needed:
+# 8/16-bit PNG (gray, RGB, RGBA) and scanline OpenEXR with FLOAT/HALF channels.
+# arrays are row 0 = top of the image, the order the files store
+
+# png
+
+PNG_CHANNELS = {0: 1, 2: 3, 4: 2, 6: 4}
+
+def _png_unfilter(raw, h, stride, bpp):
+    rows = np.frombuffer(raw, np.uint8).reshape(h, stride + 1)
+    out = np.empty((h, stride), np.uint8)
+    prev = np.zeros(stride, np.uint8)
+    for y in range(h):
+        ftype = rows[y, 0]
+        line = rows[y, 1:]
+        if ftype == 0:
+            cur = line
+        elif ftype == 1:
+            # sub is a running sum per byte lane, uint8 wraps mod 256
+            cur = np.cumsum(line.reshape(-1, bpp), axis=0, dtype=np.uint8).reshape(-1)
+        elif ftype == 2:
+            cur = line + prev
+        else:
+            # average / paeth depend on the pixel just decoded, byte loop on this row only
+            cur = bytearray(line.tobytes())
+            up = prev.tobytes()
+            for x in range(stride):
+                a = cur[x - bpp] if x >= bpp else 0
+                b = up[x]
+                if ftype == 3:
+                    cur[x] = (cur[x] + ((a + b) >> 1)) & 0xff
+                else:
+                    c = up[x - bpp] if x >= bpp else 0
+                    p = a + b - c
+                    pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+                    pred = a if (pa <= pb and pa <= pc) else (b if pb <= pc else c)
+                    cur[x] = (cur[x] + pred) & 0xff
+            cur = np.frombuffer(bytes(cur), np.uint8)
+        out[y] = cur
+        prev = out[y]
+    return out
+
+def _read_png_np(path):
+    with open(path, "rb") as f:
+        buf = f.read()
+    if buf[:8] != b"\x89PNG\r\n\x1a\n":
+        raise ValueError(f"not a png: {path}")
+
+    pos, idat = 8, []
+    while pos < len(buf):
+        n, tag = struct.unpack(">I4s", buf[pos:pos + 8])
+        data = buf[pos + 8:pos + 8 + n]
+        if tag == b"IHDR":
+            w, h, bit_depth, color_type, _, _, interlace = struct.unpack(">IIBBBBB", data)
+        elif tag == b"IDAT":
+            idat.append(data)
+        elif tag == b"IEND":
+            break
+        pos += 12 + n
+
+    if color_type not in PNG_CHANNELS or bit_depth not in (8, 16) or interlace:
+        raise ValueError(f"unsupported png (type {color_type}, depth {bit_depth}, interlace {interlace}): {path}")
+
+    c = PNG_CHANNELS[color_type]
+    bpp = c * bit_depth // 8
+    px = _png_unfilter(zlib.decompress(b"".join(idat)), h, w * bpp, bpp)
+    if bit_depth == 16:
+        px = px.view(">u2").astype(np.uint16)
+    return px.reshape(h, w, c) if c > 1 else px.reshape(h, w)
+
+def read_png(path):
+    # (H,W) gray or (H,W,C) in RGB(A) order, uint8 or uint16 as stored
+    if cv2 is not None:
+        img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        if img is None:
+            raise ValueError(f"couldn't read {path}")
+        if img.ndim == 3 and img.shape[2] == 3:
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        elif img.ndim == 3 and img.shape[2] == 4:
+            img = cv2.cvtColor(img, cv2.COLOR_BGRA2RGBA)
+        return img
+    return _read_png_np(path)
+
+def _png_chunk(tag, data):
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff)
+
+def write_png(path, img, level=6):
+    img = np.asarray(img)
+    if img.ndim == 2:
+        img = img[..., None]
+    h, w, c = img.shape
+    color_type = {1: 0, 2: 4, 3: 2, 4: 6}[c]
+    if img.dtype == np.uint16:
+        bit_depth = 16
+        px = img.astype(">u2")
+    else:
+        bit_depth = 8
+        px = img.astype(np.uint8)
+
+    # filter type 0 on every row
+    rows = px.reshape(h, -1).view(np.uint8)
+    raw = np.concatenate([np.zeros((h, 1), np.uint8), rows], axis=1)
+
+    ihdr = struct.pack(">IIBBBBB", w, h, bit_depth, color_type, 0, 0, 0)
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(_png_chunk(b"IHDR", ihdr))
+        f.write(_png_chunk(b"IDAT", zlib.compress(raw.tobytes(), level)))
+        f.write(_png_chunk(b"IEND", b""))
+
+# exr
+
+EXR_MAGIC = 20000630
+EXR_NONE, EXR_ZIPS, EXR_ZIP = 0, 2, 3
+EXR_LINES = {EXR_NONE: 1, EXR_ZIPS: 1, EXR_ZIP: 16}
+
+def _exr_attr(name, kind, data):
+    return name.encode() + b"\0" + kind.encode() + b"\0" + struct.pack("<i", len(data)) + data
+
+# zip blocks store bytes split into even/odd halves, then delta coded
+def _exr_zip_encode(raw, level):
+    b = np.frombuffer(raw, np.uint8)
+    t = np.concatenate([b[0::2], b[1::2]])
+    d = t.copy()
+    d[1:] = (t[1:].astype(np.int16) - t[:-1] + 128).astype(np.uint8)
+    return zlib.compress(d.tobytes(), level)
+
+def write_exr(path, channels, compression=EXR_ZIP, level=6):
+    # channels: {"R": (H,W) float32, ...}, written as 32-bit float
+    names = sorted(channels)
+    planes = [np.ascontiguousarray(channels[n], dtype="<f4") for n in names]
+    h, w = planes[0].shape
+
+    chlist = b"".join(n.encode() + b"\0" + struct.pack("<iB3xii", 2, 0, 1, 1) for n in names) + b"\0"
+    header = struct.pack("<ii", EXR_MAGIC, 2)
+    header += _exr_attr("channels", "chlist", chlist)
+    header += _exr_attr("compression", "compression", struct.pack("<B", compression))
+    header += _exr_attr("dataWindow", "box2i", struct.pack("<iiii", 0, 0, w - 1, h - 1))
+    header += _exr_attr("displayWindow", "box2i", struct.pack("<iiii", 0, 0, w - 1, h - 1))
+    header += _exr_attr("lineOrder", "lineOrder", struct.pack("<B", 0))
+    header += _exr_attr("pixelAspectRatio", "float", struct.pack("<f", 1.0))
+    header += _exr_attr("screenWindowCenter", "v2f", struct.pack("<ff", 0.0, 0.0))
+    header += _exr_attr("screenWindowWidth", "float", struct.pack("<f", 1.0))
+    header += b"\0"
+
+    # scanline blocks hold each line's channels one after another
+    lines = EXR_LINES[compression]
+    stacked = np.stack(planes, axis=1)  # (H, C, W)
+    chunks = []
+    for y0 in range(0, h, lines):
+        raw = stacked[y0:y0 + lines].tobytes()
+        data = raw
+        if compression != EXR_NONE:
+            packed = _exr_zip_encode(raw, level)
+            if len(packed) < len(raw):
+                data = packed
+        chunks.append(struct.pack("<ii", y0, len(data)) + data)
+
+    offset = len(header) + 8 * len(chunks)
+    table = []
+    for c in chunks:
+        table.append(offset)
+        offset += len(c)
+
+    with open(path, "wb") as f:
+        f.write(header)
+        f.write(struct.pack(f"<{len(table)}Q", *table))
+        for c in chunks:
+            f.write(c)
+
+def _exr_zip_decode(data):
+    d = np.frombuffer(zlib.decompress(data), np.uint8).copy()
+    # undo the delta coding (uint8 cumsum wraps), then re-interleave the halves
+    d[1:] -= np.uint8(128)
+    t = np.cumsum(d, dtype=np.uint8)
+    out = np.empty_like(t)
+    half = (len(t) + 1) // 2
+    out[0::2] = t[:half]
+    out[1::2] = t[half:]
+    return out
+
+EXR_TYPES = {0: np.dtype("<u4"), 1: np.dtype("<f2"), 2: np.dtype("<f4")}
+
+def _exr_header(buf):
+    magic, version = struct.unpack("<ii", buf[:8])
+    if magic != EXR_MAGIC:
+        raise ValueError("not an exr")
+    if version & 0x200:
+        raise ValueError("tiled exr is not supported")
+
+    attrs, pos = {}, 8
+    while buf[pos] != 0:
+        end = buf.index(b"\0", pos)
+        name = buf[pos:end].decode()
+        tend = buf.index(b"\0", end + 1)
+        size = struct.unpack("<i", buf[tend + 1:tend + 5])[0]
+        attrs[name] = buf[tend + 5:tend + 5 + size]
+        pos = tend + 5 + size
+    return attrs, pos + 1
+
+def _exr_channels(chlist):
+    chans, pos = [], 0
+    while chlist[pos] != 0:
+        end = chlist.index(b"\0", pos)
+        ptype, _, xs, ys = struct.unpack("<iB3xii", chlist[end + 1:end + 17])
+        if xs != 1 or ys != 1:
+            raise ValueError("subsampled exr channels are not supported")
+        chans.append((chlist[pos:end].decode(), EXR_TYPES[ptype]))
+        pos = end + 17
+    return chans
+
+def read_exr(path):
+    # {channel: (H,W)} float32 (uint32 channels stay uint32)
+    with open(path, "rb") as f:
+        buf = f.read()
+    attrs, pos = _exr_header(buf)
+
+    compression = attrs["compression"][0]
+    if compression not in EXR_LINES:
+        raise ValueError(f"unsupported exr compression {compression}: {path}")
+    lines = EXR_LINES[compression]
+    chans = _exr_channels(attrs["channels"])
+    x0, y0, x1, y1 = struct.unpack("<iiii", attrs["dataWindow"])
+    w, h = x1 - x0 + 1, y1 - y0 + 1
+
+    # a scanline holds each channel's row back to back
+    row_bytes = sum(dt.itemsize for _, dt in chans) * w
+    n_chunks = (h + lines - 1) // lines
+    offsets = struct.unpack(f"<{n_chunks}Q", buf[pos:pos + 8 * n_chunks])
+
+    pixels = np.empty((h, row_bytes), np.uint8)
+    for off in offsets:
+        y, size = struct.unpack("<ii", buf[off:off + 8])
+        r0 = y - y0
+        n = min(lines, h - r0)
+        data = buf[off + 8:off + 8 + size]
+        if size < n * row_bytes:
+            block = _exr_zip_decode(data)
+        else:
+            block = np.frombuffer(data, np.uint8)
+        pixels[r0:r0 + n] = block.reshape(n, row_bytes)
+
+    out, col = {}, 0
+    for name, dt in chans:
+        nb = dt.itemsize * w
+        plane = np.ascontiguousarray(pixels[:, col:col + nb]).view(dt).reshape(h, w)
+        out[name] = plane.astype(np.float32) if dt.kind == "f" else plane.astype(np.uint32)
+        col += nb
+    return out
+
+def write_exr_gray(path, img, compression=EXR_ZIP):
+    # same layout blender writes for depth / IndexOB: value copied into R, G and B
+    img = np.asarray(img, dtype=np.float32)
+    write_exr(path, {"R": img, "G": img, "B": img}, compression=compression)
+
+# loaders lift.py and the eval scripts share
+
+def load_exr_r(path):
+    ch = read_exr(path)
+    key = "R" if "R" in ch else sorted(ch)[0]
+    return ch[key].astype(np.float32)
+
+def load_png_rgb_u8(path):
+    img = read_png(path)
+    if img.dtype == np.uint16:
+        img = (img >> 8).astype(np.uint8)
+    if img.ndim == 2:
+        return np.repeat(img[..., None], 3, axis=2)
+    if img.shape[2] == 2:
+        return np.repeat(img[..., :1], 3, axis=2)
+    return np.ascontiguousarray(img[..., :3])
+
+def load_png_alpha(path):
+    img = read_png(path)
+    if img.ndim == 3 and img.shape[2] in (2, 4):
+        return img[..., -1]
+    return None
+
+# sam masks are 0/255 gray
+def load_mask(path):
+    img = read_png(path)
+    if img.ndim == 3:
+        img = img[..., 0]
+    half = 32768 if img.dtype == np.uint16 else 128
+    return img >= half
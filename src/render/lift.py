@@ -1,17 +1,36 @@
-import bpy
 import os, sys, json
-import numpy as np
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from imgio import load_exr_r, load_png_rgb_u8
+from maskstore import open_view_masks
+from liftstore import LiftStoreWriter
+from lift_engine import ViewLift, save_npz
+from voxel import voxel_downsample
+from viewstack import open_stack
+import stagetrace
 
 r'''
-$blender42 = "C:\Users\jmu5\Downloads\blender-4.2.16-windows-x64\blender-4.2.16-windows-x64\blender.exe"
+plain python, no blender needed (images are decoded by imgio.py):
+
 $out = "C:\Users\jmu5\OneDrive - Brown University\Documents\temp school stuff\neurosym-playground/data/output"
 
-& $blender42 -b -P "src/render/lift.py" -- `
+python "src/render/lift.py" -- `
   --out_dir "$out/725" `
   --sam2d_dir "$out/725sam" `
   --lift_dir "$out/725lifted" `
   --voxel 0
 
+add --workers N to lift views in N processes, --writers M sets the compression/write threads.
+--format store (or both) writes one mmap-able columnar store instead of per-mask npz (see liftstore.py),
+at --store (default <lift_dir>/store), --points_dtype float16 halves it
+--views 3,7,12 lifts only those views (the rest of <lift_dir> is left alone, with --format store
+the other views' segments are carried over into the rewritten store)
+--voxel_mode first|centroid|mean_color picks what a voxel keeps when --voxel > 0 (see voxel.py)
+--stack 1 reads rgb / depth / cameras from the memory mapped <out_dir>/viewstack (built first if
+missing or older than the renders, see viewstack.py) instead of decoding png / exr per view
+--trace run.jsonl records read / back-projection / gather / compression time and memory per view (see stagetrace.py)
 '''
 
 # get the arguments
@@ -33,112 +52,152 @@ LIFT_DIR = get_arg("--lift_dir", None, str)
 MIN_D = get_arg("--min_depth", 1e-6, float)
 MAX_D = get_arg("--max_depth", 1e9, float)
 VOXEL = get_arg("--voxel", 0.0, float)
-
-if OUT_DIR is None or SAM2D_DIR is None:
-    raise SystemExit("missing out or sam dirs")
-
-rgb_dir = os.path.join(OUT_DIR, "rgb")
-depth_dir = os.path.join(OUT_DIR, "depth_exr")
-cam_path = os.path.join(OUT_DIR, "cameras.json")
-if LIFT_DIR is None:
-    LIFT_DIR = os.path.join(OUT_DIR, "lifted")
-os.makedirs(LIFT_DIR, exist_ok=True)
-
-def load_image_rgba(path):
-    img = bpy.data.images.load(path, check_existing=False)
-    w, h = img.size
-    px = np.asarray(img.pixels[:], dtype=np.float32).reshape((h, w, 4))
-    bpy.data.images.remove(img)
-    return px
-
-def load_exr_r(path):
-    return load_image_rgba(path)[..., 0].astype(np.float32)
-
-def load_png_rgb_u8(path):
-    rgba = load_image_rgba(path)
-    rgb = np.clip(rgba[..., :3], 0.0, 1.0)
-    return (rgb * 255.0 + 0.5).astype(np.uint8)
-
-def load_mask(path):
-    rgba = load_image_rgba(path)
-    return rgba[..., 0] > 0.5
-
-def lift_points(depth, fx, fy, cx, cy, vm):
-    H, W = depth.shape
-    u = np.arange(W, dtype=np.float32)[None, :].repeat(H, axis=0)
-    v = np.arange(H, dtype=np.float32)[:, None].repeat(W, axis=1)
-
-    # select only regions with the valid mask for this one
-    d = depth[vm]
-    uu = u[vm]
-    vv = v[vm]
-
-    # project onto 3d
-    x = (uu - cx) * d / fx
-    y = -(vv - cy) * d / fy
-    z = -d
-    pts = np.stack([x, y, z], axis=1).astype(np.float32)
-
-    return pts
-
-def apply_c2w(pts_cam, c2w):
-    N = pts_cam.shape[0]
-    hom = np.concatenate([pts_cam, np.ones((N,1), np.float32)], axis=1)
-    pts_w = (c2w @ hom.T).T[:, :3]
-
-    return pts_w.astype(np.float32)
-
-# so downsampling chooses first point it sees within cloud
-def voxel_downsample(points, colors, voxel):
-    if voxel <= 0: return points, colors
-    key = np.floor(points / voxel).astype(np.int64)
-    _, idx = np.unique(key, axis=0, return_index=True)
-    idx = np.sort(idx)
-
-    return points[idx], colors[idx]
-
-with open(cam_path, "r") as f:
-    cams = sorted(json.load(f), key=lambda d: d.get("view", 0))
-
-for caminfo in cams:
+VOXEL_MODE = get_arg("--voxel_mode", "first", str)
+WORKERS = get_arg("--workers", 1, int)
+WRITERS = get_arg("--writers", 0, int)
+FORMAT = get_arg("--format", "npz", str)
+STORE_DIR = get_arg("--store", None, str)
+POINTS_DTYPE = get_arg("--points_dtype", "float32", str)
+VIEWS = get_arg("--views", None, str)
+TRACE = get_arg("--trace", None, str)
+STACK = get_arg("--stack", 0, int)
+
+# opened once per process (lift workers too), the arrays are memory maps
+_stack = None
+
+def get_stack():
+    global _stack
+    if _stack is None:
+        _stack = open_stack(OUT_DIR)
+    return _stack
+
+# lift one view: depth is back-projected once, each mask gathers from it
+def lift_view(caminfo, rgb_dir, depth_dir):
     i = int(caminfo["view"])
     stem = f"{i:03d}"
-    intr = caminfo["intrinsics"]
-    fx, fy, cx, cy = map(float, [intr["fx"], intr["fy"], intr["cx"], intr["cy"]])
-    c2w = np.array(caminfo["c2w"], dtype=np.float32)
 
     rgb_path = os.path.join(rgb_dir, f"{stem}.png")
     d_path   = os.path.join(depth_dir, f"{stem}.exr")
-    view_mask_dir = os.path.join(SAM2D_DIR, f"view_{stem}", "masks")
-
-    if not (os.path.exists(rgb_path) and os.path.exists(d_path) and os.path.isdir(view_mask_dir)):
-        print("skipping", stem)
-
-        continue
-
-    rgb = load_png_rgb_u8(rgb_path)
-    depth = load_exr_r(d_path)
-    depth_valid = (depth > MIN_D) & (depth < MAX_D)
-
-    out_view = os.path.join(LIFT_DIR, f"view_{stem}")
-    os.makedirs(out_view, exist_ok=True)
-
-    mask_files = sorted([f for f in os.listdir(view_mask_dir) if f.lower().endswith(".png")])
-    for mf in mask_files:
-        mp = os.path.join(view_mask_dir, mf)
-        m = load_mask(mp)
-        valid = depth_valid & m
-        if valid.sum() < 200:
-            continue
-
-        pts_cam = lift_points(depth, fx, fy, cx, cy, valid)
-        pts_w = apply_c2w(pts_cam, c2w)
-        cols = rgb[valid].reshape(-1, 3)
-
-        pts_w, cols = voxel_downsample(pts_w, cols, VOXEL)
-
-        out_npz = os.path.join(out_view, mf.replace(".png", ".npz"))
-        np.savez_compressed(out_npz, points=pts_w, colors=cols)
-    print("lifted masks for view", stem)
-
-print("finished, lifted masks to", LIFT_DIR)
+    with stagetrace.span("lift_read", view=stem):
+        masks = open_view_masks(os.path.join(SAM2D_DIR, f"view_{stem}"))
+
+        if STACK:
+            stack = get_stack()
+            if masks is None or i not in stack or not (stack.has("rgb") and stack.has("depth")):
+                return stem, None
+            rgb = stack.get("rgb", i)
+            depth = stack.get("depth", i)
+        else:
+            if not (os.path.exists(rgb_path) and os.path.exists(d_path) and masks is not None):
+                return stem, None
+
+            rgb = load_png_rgb_u8(rgb_path)
+            depth = load_exr_r(d_path)
+    with stagetrace.span("lift_backproject", view=stem) as rec:
+        view = ViewLift(depth, rgb, caminfo["c2w"], caminfo["intrinsics"], MIN_D, MAX_D)
+        rec["points"] = int(len(view.pix))
+
+    # (masks, lifted points) membership in one gather, packed stores unpack all masks at once
+    results = []
+    if len(masks) == 0:
+        return stem, results
+    with stagetrace.span("lift_gather", view=stem, masks=len(masks)):
+        sel_all = masks.flat()[:, view.pix]
+        counts = sel_all.sum(axis=1)
+        meta = masks.meta
+        for j, mid in enumerate(masks.mask_id):
+            if counts[j] < 200:
+                continue
+
+            sel = sel_all[j]
+            pts_w, cols = voxel_downsample(view.points[sel], view.colors[sel], VOXEL, VOXEL_MODE)
+            results.append((int(mid), pts_w, cols, meta[j]))
+
+    return stem, results
+
+def save_mask(stem, mid, path, points, colors):
+    with stagetrace.span("lift_compress", view=stem, mask=mid, points=int(len(points))):
+        save_npz(path, points=points, colors=colors)
+
+def main():
+    if OUT_DIR is None or SAM2D_DIR is None:
+        raise SystemExit("missing out or sam dirs")
+    stagetrace.configure(TRACE, "lift")
+
+    rgb_dir = os.path.join(OUT_DIR, "rgb")
+    depth_dir = os.path.join(OUT_DIR, "depth_exr")
+    cam_path = os.path.join(OUT_DIR, "cameras.json")
+    lift_dir = LIFT_DIR if LIFT_DIR is not None else os.path.join(OUT_DIR, "lifted")
+    os.makedirs(lift_dir, exist_ok=True)
+
+    if STACK:
+        # build (if needed) before any worker forks, so only one process writes it
+        cams = get_stack().cameras()
+    else:
+        with open(cam_path, "r") as f:
+            cams = sorted(json.load(f), key=lambda d: d.get("view", 0))
+
+    # zlib releases the gil, so compression runs on writer threads off the lifting path
+    writers = WRITERS if WRITERS > 0 else max(2, WORKERS)
+    max_pending = 64 * writers
+    pending = deque()
+
+    if FORMAT not in ("npz", "store", "both"):
+        raise SystemExit(f"unknown --format {FORMAT}")
+    wanted = {int(v) for v in VIEWS.split(",")} if VIEWS is not None else None
+    store = None
+    if FORMAT in ("store", "both"):
+        store = LiftStoreWriter(STORE_DIR if STORE_DIR is not None else os.path.join(lift_dir, "store"), POINTS_DTYPE)
+        if wanted is not None:
+            print("kept", store.keep_existing(wanted), "segments of other views in", store.path)
+
+    def write_view(wpool, stem, results):
+        if store is not None:
+            with stagetrace.span("lift_store_add", view=stem, masks=len(results)):
+                for mid, pts_w, cols, meta in results:
+                    store.add(int(stem), mid, pts_w, cols, meta)
+        if FORMAT in ("npz", "both"):
+            out_view = os.path.join(lift_dir, f"view_{stem}")
+            os.makedirs(out_view, exist_ok=True)
+            # masks that no longer exist upstream must not survive a re-lift
+            for fn in os.listdir(out_view):
+                if fn.startswith("mask_") and fn.endswith(".npz"):
+                    os.remove(os.path.join(out_view, fn))
+            for mid, pts_w, cols, _ in results:
+                out_npz = os.path.join(out_view, f"mask_{mid:03d}.npz")
+                pending.append(wpool.submit(save_mask, stem, mid, out_npz, pts_w, cols))
+        while len(pending) > max_pending:
+            pending.popleft().result()
+        print("lifted masks for view", stem)
+
+    if wanted is not None:
+        cams = [c for c in cams if int(c["view"]) in wanted]
+
+    jobs = [(caminfo, rgb_dir, depth_dir) for caminfo in cams]
+    with ThreadPoolExecutor(max_workers=writers) as wpool:
+        if WORKERS > 1:
+            with ProcessPoolExecutor(max_workers=WORKERS) as pool:
+                for stem, results in pool.map(lift_view, *zip(*jobs)):
+                    if results is None:
+                        print("skipping", stem)
+                        continue
+                    write_view(wpool, stem, results)
+        else:
+            for job in jobs:
+                stem, results = lift_view(*job)
+                if results is None:
+                    print("skipping", stem)
+                    continue
+                write_view(wpool, stem, results)
+
+        while pending:
+            pending.popleft().result()
+
+    if store is not None:
+        with stagetrace.span("lift_store_close"):
+            store.close()
+
+    print("finished, lifted masks to", lift_dir)
+
+if __name__ == "__main__":
+    main()
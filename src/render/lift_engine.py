@@ -0,0 +1,87 @@
+import io
+import zipfile
+import numpy as np
+
+# per-view lifting: back-project every valid depth pixel of a view to world once,
+# then every mask is a gather into that shared array instead of its own back-projection
+
+_RAYS = {}
+
+# camera-space ray per pixel (x/d, y/d), cached per intrinsics
+def ray_grid(h, w, fx, fy, cx, cy):
+    key = (h, w, fx, fy, cx, cy)
+    rays = _RAYS.get(key)
+    if rays is None:
+        u = np.arange(w, dtype=np.float32)
+        v = np.arange(h, dtype=np.float32)
+        rx = np.broadcast_to((u - cx) / fx, (h, w)).reshape(-1)
+        ry = np.broadcast_to((-(v - cy) / fy)[:, None], (h, w)).reshape(-1)
+        rays = (np.ascontiguousarray(rx, dtype=np.float32), np.ascontiguousarray(ry, dtype=np.float32))
+        _RAYS[key] = rays
+    return rays
+
+def apply_c2w(pts_cam, c2w):
+    c2w = np.asarray(c2w, dtype=np.float32)
+    return (pts_cam @ c2w[:3, :3].T + c2w[:3, 3]).astype(np.float32)
+
+class ViewLift:
+    def __init__(self, depth, rgb, c2w, intr, min_d=1e-6, max_d=1e9):
+        H, W = depth.shape
+        fx, fy, cx, cy = map(float, [intr["fx"], intr["fy"], intr["cx"], intr["cy"]])
+
+        self.shape = (H, W)
+        self.valid = (depth > min_d) & (depth < max_d)
+        # flat pixel ids of the lifted points, row-major like a boolean index
+        self.pix = np.flatnonzero(self.valid)
+
+        d = depth.reshape(-1)[self.pix]
+        rx, ry = ray_grid(H, W, fx, fy, cx, cy)
+        pts_cam = np.empty((len(d), 3), dtype=np.float32)
+        pts_cam[:, 0] = rx[self.pix] * d
+        pts_cam[:, 1] = ry[self.pix] * d
+        pts_cam[:, 2] = -d
+
+        self.points = apply_c2w(pts_cam, c2w)
+        self.colors = rgb.reshape(-1, 3)[self.pix]
+
+    def __len__(self):
+        return len(self.pix)
+
+    # which lifted points fall inside a (H,W) boolean mask
+    def select(self, mask):
+        return mask.reshape(-1)[self.pix]
+
+    def gather(self, mask):
+        sel = self.select(mask)
+        return self.points[sel], self.colors[sel]
+
+    # one pass over a (H,W) int label map (-1 = none), returns {label: (points, colors)}
+    def gather_labels(self, labels, min_points=0):
+        lab = labels.reshape(-1)[self.pix]
+        keep = lab >= 0
+        idx = np.flatnonzero(keep)
+        lab = lab[keep]
+
+        order = np.argsort(lab, kind="stable")
+        idx, lab = idx[order], lab[order]
+        uniq, starts, counts = np.unique(lab, return_index=True, return_counts=True)
+
+        out = {}
+        for l, s, c in zip(uniq, starts, counts):
+            if c < min_points:
+                continue
+            sel = idx[s:s + c]
+            out[int(l)] = (self.points[sel], self.colors[sel])
+        return out
+
+# same archive np.savez_compressed writes, but with a fixed timestamp so the
+# bytes only depend on the arrays (serial and parallel runs write identical files)
+def save_npz(path, **arrays):
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+        for name, arr in arrays.items():
+            buf = io.BytesIO()
+            np.lib.format.write_array(buf, np.asanyarray(arr), allow_pickle=False)
+            info = zipfile.ZipInfo(name + ".npy", date_time=(1980, 1, 1, 0, 0, 0))
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = 0o600 << 16
+            zf.writestr(info, buf.getvalue())
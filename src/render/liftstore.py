@@ -0,0 +1,168 @@
+import os
+import sys
+import json
+import glob
+import argparse
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from maskstore import open_view_masks
+
+r'''
+columnar store for one shape's lifted segments, opened with mmap so index queries
+never touch (or decompress) point data:
+
+  <store>/points.npy   (N,3) float32 or float16, all segments back to back
+  <store>/colors.npy   (N,3) uint8
+  <store>/index.npy    one row per (view, mask): offset/count into points, bbox, sam scores
+  <store>/store.json   dtype and counts
+
+convert an existing lifted layout (view_XXX/mask_XXX.npz):
+
+python src/render/liftstore.py --lift_dir "$out/725lifted" --sam2d_dir "$out/725sam" --store "$out/725lifted/store"
+'''
+
+INDEX_DTYPE = np.dtype([
+    ("view", np.int32),
+    ("mask_id", np.int32),
+    ("offset", np.int64),
+    ("count", np.int64),
+    ("bbox_min", np.float32, (3,)),
+    ("bbox_max", np.float32, (3,)),
+    ("area", np.int64),
+    ("predicted_iou", np.float32),
+    ("stability_score", np.float32)])
+
+class LiftStoreWriter:
+    def __init__(self, path, points_dtype="float32"):
+        self.path = path
+        self.points_dtype = np.dtype(points_dtype)
+        self.points, self.colors, self.rows = [], [], []
+        self.n = 0
+
+    def add(self, view, mask_id, points, colors, meta=None):
+        meta = meta or {}
+        k = len(points)
+        if k:
+            lo, hi = points.min(axis=0), points.max(axis=0)
+        else:
+            lo = hi = np.zeros(3, np.float32)
+        self.rows.append((int(view), int(mask_id), self.n, k, lo, hi,
+                          int(meta.get("area", -1)),
+                          float(meta.get("predicted_iou", -1.0)),
+                          float(meta.get("stability_score", -1.0))))
+        self.points.append(np.asarray(points, dtype=self.points_dtype))
+        self.colors.append(np.asarray(colors, dtype=np.uint8))
+        self.n += k
+
+    # carry over every segment of the store already at self.path except those of skip_views,
+    # so a run over some views replaces just those. read into memory, close() overwrites the files
+    def keep_existing(self, skip_views):
+        if not os.path.exists(os.path.join(self.path, "index.npy")):
+            return 0
+        old = LiftStore(self.path, mmap=False)
+        kept = 0
+        for k, row in enumerate(old.index):
+            if int(row["view"]) in skip_views:
+                continue
+            pts, cols = old.segment(k, dtype=self.points_dtype)
+            self.add(row["view"], row["mask_id"], pts, cols,
+                     {"area": row["area"], "predicted_iou": row["predicted_iou"], "stability_score": row["stability_score"]})
+            kept += 1
+        return kept
+
+    def close(self):
+        os.makedirs(self.path, exist_ok=True)
+        index = np.array(self.rows, dtype=INDEX_DTYPE)
+        order = np.lexsort((index["mask_id"], index["view"]))
+        index = index[order]
+
+        # re-pack so segments sit in (view, mask) order
+        pts = [self.points[i] for i in order]
+        cols = [self.colors[i] for i in order]
+        counts = index["count"]
+        index["offset"] = np.cumsum(counts) - counts
+
+        points = np.concatenate(pts) if pts else np.zeros((0, 3), self.points_dtype)
+        colors = np.concatenate(cols) if cols else np.zeros((0, 3), np.uint8)
+        np.save(os.path.join(self.path, "points.npy"), points)
+        np.save(os.path.join(self.path, "colors.npy"), colors)
+        np.save(os.path.join(self.path, "index.npy"), index)
+        with open(os.path.join(self.path, "store.json"), "w") as f:
+            json.dump({"points_dtype": self.points_dtype.name, "segments": len(index), "points": int(len(points))}, f, indent=2)
+
+class LiftStore:
+    def __init__(self, path, mmap=True):
+        mode = "r" if mmap else None
+        self.path = path
+        self.index = np.load(os.path.join(path, "index.npy"))
+        self.points = np.load(os.path.join(path, "points.npy"), mmap_mode=mode)
+        self.colors = np.load(os.path.join(path, "colors.npy"), mmap_mode=mode)
+
+    def __len__(self):
+        return len(self.index)
+
+    def views(self):
+        return np.unique(self.index["view"])
+
+    def segment(self, k, dtype=np.float32):
+        row = self.index[k]
+        s = slice(int(row["offset"]), int(row["offset"] + row["count"]))
+        return np.asarray(self.points[s], dtype=dtype), np.asarray(self.colors[s])
+
+    def find(self, view, mask_id):
+        hit = np.flatnonzero((self.index["view"] == view) & (self.index["mask_id"] == mask_id))
+        return int(hit[0]) if len(hit) else None
+
+    def select(self, min_points=0, views=None):
+        keep = self.index["count"] >= min_points
+        if views is not None:
+            keep &= np.isin(self.index["view"], views)
+        return np.flatnonzero(keep)
+
+    def largest_per_view(self, min_points=0):
+        # row index of the biggest segment of every view that has one >= min_points
+        idx = self.select(min_points)
+        if len(idx) == 0:
+            return idx
+        rows = self.index[idx]
+        order = np.lexsort((-rows["count"], rows["view"]))
+        idx, rows = idx[order], rows[order]
+        first = np.ones(len(idx), dtype=bool)
+        first[1:] = rows["view"][1:] != rows["view"][:-1]
+        return idx[first]
+
+def _view_of(path):
+    return int(os.path.basename(os.path.dirname(path)).split("_")[1])
+
+def _mask_of(path):
+    return int(os.path.splitext(os.path.basename(path))[0].split("_")[1])
+
+def convert_lifted(lift_dir, store_path, sam2d_dir=None, points_dtype="float32"):
+    files = sorted(glob.glob(os.path.join(lift_dir, "view_*", "mask_*.npz")))
+    writer = LiftStoreWriter(store_path, points_dtype)
+    sam_meta = {}
+    for f in files:
+        view, mid = _view_of(f), _mask_of(f)
+        if sam2d_dir is not None and view not in sam_meta:
+            masks = open_view_masks(os.path.join(sam2d_dir, f"view_{view:03d}"))
+            sam_meta[view] = {} if masks is None else {int(m["mask_id"]): m for m in masks.meta}
+        z = np.load(f)
+        writer.add(view, mid, z["points"], z["colors"], sam_meta.get(view, {}).get(mid))
+    writer.close()
+    return len(files)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--lift_dir", required=True)
+    ap.add_argument("--store", default=None)
+    ap.add_argument("--sam2d_dir", default=None)
+    ap.add_argument("--points_dtype", default="float32", choices=["float32", "float16"])
+    args = ap.parse_args()
+
+    store = args.store if args.store is not None else os.path.join(args.lift_dir, "store")
+    n = convert_lifted(args.lift_dir, store, args.sam2d_dir, args.points_dtype)
+    print(f"packed {n} segments into {store}")
+
+if __name__ == "__main__":
+    main()
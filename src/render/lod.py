@@ -0,0 +1,255 @@
+import os
+import sys
+import json
+import glob
+import time
+import argparse
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from fuse import iter_fragments
+
+r'''
+level of detail cloud for one shape's lifted segments, for the eval viewers.
+
+every segment gets its own octree over one shared cube (the bbox of all points): a point's
+level is the coarsest depth at which it is the (random priority) representative of its
+segment's cell, so levels 0..L together hold exactly one point per occupied cell at depth L
+and every level adds the next octant split. points are stored level by level, random order
+inside a level, so any prefix of the arrays is a uniform subsample:
+
+  <lift_dir>/lod/points.npy    (N,3) float32 or float16
+  <lift_dir>/lod/seg.npy       (N,) uint16 / int32 row in segments.npy (no per point rgb needed)
+  <lift_dir>/lod/colors.npy    (N,3) uint8 rgb from the renders
+  <lift_dir>/lod/segments.npy  view, mask_id, count per segment
+  <lift_dir>/lod/levels.npy    (levels+1, segments) points of each segment on each level
+  <lift_dir>/lod/lod.json      cube, depth, level offsets
+
+the last level holds what no cell picked (duplicates at the finest depth). loading reads
+levels coarse to fine until --budget points (only counting the selected segments) are in:
+
+cloud = LodCloud(os.path.join(lift_dir, "lod"))
+pts, seg, _ = cloud.load(budget=1_000_000, views=[0, 3], min_points=800)
+
+build (reads <lift_dir>/store or the view_*/mask_*.npz files):
+
+python src/render/lod.py --lift_dir "$out/725lifted" [--depth 9] [--budget 1000000]
+'''
+
+LOD_NAME = "lod"
+SEGMENT_DTYPE = np.dtype([("view", np.int32), ("mask_id", np.int32), ("count", np.int64)])
+
+# every 10 bit value with its bits spread 3 apart
+_SPREAD = np.zeros(1024, dtype=np.uint64)
+for _b in range(10):
+    _SPREAD |= ((np.arange(1024, dtype=np.uint64) >> np.uint64(_b)) & np.uint64(1)) << np.uint64(3 * _b)
+
+# (N,3) cell coords of bits bits each -> morton code, bits <= 21
+def morton(q, bits):
+    code = np.zeros(len(q), dtype=np.uint64)
+    for axis in range(3):
+        v = q[:, axis].astype(np.uint64)
+        for c in range(0, bits, 10):
+            code |= _SPREAD[(v >> np.uint64(c)) & np.uint64(1023)] << np.uint64(3 * c + axis)
+    return code
+
+# level of every point, see the module docstring; depth + 1 for points no cell picked
+def point_levels(points, seg, depth, lo, size, seed=0):
+    n = len(points)
+    cells = 1 << depth
+    q = np.floor((points - lo) / size * cells).astype(np.int64)
+    np.clip(q, 0, cells - 1, out=q)
+    # sorted by (segment, cell), so one sort groups every level's (segment, cell) runs. two sort
+    # keys: 3 * depth morton bits plus the segment bits do not fit one uint64 at every depth
+    key = morton(q, depth)
+    prio = np.random.default_rng(seed).permutation(n)
+    if n == 0:
+        return np.zeros(0, np.int8), prio
+
+    order = np.lexsort((key, seg))
+    key, pr = key[order], prio[order]
+    new_seg = np.r_[True, seg[order][1:] != seg[order][:-1]]
+    pos = np.empty(n, dtype=np.int64)
+    pos[pr] = np.arange(n)
+
+    level = np.full(n, depth + 1, dtype=np.int8)
+    # finest to coarsest, so a point ends up with the coarsest level it represents
+    start = np.empty(n, dtype=bool)
+    for L in range(depth, -1, -1):
+        cell = key >> np.uint64(3 * (depth - L))
+        start[0] = True
+        np.not_equal(cell[1:], cell[:-1], out=start[1:])
+        start |= new_seg
+        level[pos[np.minimum.reduceat(pr, np.flatnonzero(start))]] = L
+
+    out = np.empty(n, dtype=np.int8)
+    out[order] = level
+    return out, prio
+
+def build_lod(lift_dir, out=None, depth=9, points_dtype="float32", seed=0):
+    out = out if out is not None else os.path.join(lift_dir, LOD_NAME)
+    rows, pts, cols, segs = [], [], [], []
+    for view, mid, p, c in iter_fragments(lift_dir):
+        if len(p) == 0:
+            continue
+        segs.append(np.full(len(p), len(rows), dtype=np.int32))
+        rows.append((view, mid, len(p)))
+        pts.append(np.asarray(p, dtype=np.float32))
+        cols.append(np.asarray(c, dtype=np.uint8))
+    segments = np.array(rows, dtype=SEGMENT_DTYPE)
+    points = np.concatenate(pts) if pts else np.zeros((0, 3), np.float32)
+    colors = np.concatenate(cols) if cols else np.zeros((0, 3), np.uint8)
+    seg = np.concatenate(segs) if segs else np.zeros(0, np.int32)
+    del pts, cols, segs
+
+    lo = points.min(axis=0) if len(points) else np.zeros(3, np.float32)
+    hi = points.max(axis=0) if len(points) else np.ones(3, np.float32)
+    size = float(max((hi - lo).max(), 1e-9))
+
+    level, prio = point_levels(points, seg, depth, lo, size, seed)
+    # by level, priority order inside a level (a stable sort of the few level values)
+    by_prio = np.empty(len(prio), dtype=np.int64)
+    by_prio[prio] = np.arange(len(prio))
+    order = by_prio[np.argsort(level[by_prio], kind="stable")]
+    n_levels = depth + 2
+    level_counts = np.zeros((n_levels, len(segments)), dtype=np.int64)
+    np.add.at(level_counts, (level, seg), 1)
+    per_level = level_counts.sum(axis=1)
+
+    seg_dtype = np.uint16 if len(segments) < (1 << 16) else np.int32
+    os.makedirs(out, exist_ok=True)
+    np.save(os.path.join(out, "points.npy"), points[order].astype(points_dtype))
+    np.save(os.path.join(out, "colors.npy"), colors[order])
+    np.save(os.path.join(out, "seg.npy"), seg[order].astype(seg_dtype))
+    np.save(os.path.join(out, "segments.npy"), segments)
+    np.save(os.path.join(out, "levels.npy"), level_counts)
+    with open(os.path.join(out, "lod.json"), "w") as f:
+        json.dump({"depth": depth, "lo": [float(x) for x in lo], "size": size,
+                   "points": int(len(points)), "segments": int(len(segments)),
+                   "level_offsets": [0] + [int(x) for x in np.cumsum(per_level)],
+                   "points_dtype": np.dtype(points_dtype).name}, f, indent=2)
+    return out
+
+# lod sources newer than the lod (or no lod at all)
+def lod_stale(lift_dir, lod_dir=None):
+    lod_dir = lod_dir if lod_dir is not None else os.path.join(lift_dir, LOD_NAME)
+    meta = os.path.join(lod_dir, "lod.json")
+    if not os.path.exists(meta):
+        return True
+    store_index = os.path.join(lift_dir, "store", "index.npy")
+    sources = [store_index] if os.path.exists(store_index) else glob.glob(os.path.join(lift_dir, "view_*", "mask_*.npz"))
+    built = os.path.getmtime(meta)
+    return any(os.path.getmtime(p) > built for p in sources)
+
+def open_lod(lift_dir, depth=9):
+    lod_dir = os.path.join(lift_dir, LOD_NAME)
+    if lod_stale(lift_dir, lod_dir):
+        print("building lod for", lift_dir)
+        build_lod(lift_dir, lod_dir, depth)
+    return LodCloud(lod_dir)
+
+class LodCloud:
+    def __init__(self, path, mmap=True):
+        mode = "r" if mmap else None
+        self.path = path
+        with open(os.path.join(path, "lod.json"), "r") as f:
+            self.meta = json.load(f)
+        self.segments = np.load(os.path.join(path, "segments.npy"))
+        self.level_counts = np.load(os.path.join(path, "levels.npy"))
+        self.offsets = np.array(self.meta["level_offsets"], dtype=np.int64)
+        self.points = np.load(os.path.join(path, "points.npy"), mmap_mode=mode)
+        self.colors = np.load(os.path.join(path, "colors.npy"), mmap_mode=mode)
+        self.seg = np.load(os.path.join(path, "seg.npy"), mmap_mode=mode)
+
+    def __len__(self):
+        return len(self.points)
+
+    def views(self):
+        return np.unique(self.segments["view"])
+
+    def select(self, min_points=0, views=None):
+        keep = self.segments["count"] >= min_points
+        if views is not None:
+            keep &= np.isin(self.segments["view"], views)
+        return np.flatnonzero(keep)
+
+    def largest_per_view(self, min_points=0):
+        idx = self.select(min_points)
+        if len(idx) == 0:
+            return idx
+        rows = self.segments[idx]
+        order = np.lexsort((-rows["count"], rows["view"]))
+        idx, rows = idx[order], rows[order]
+        first = np.ones(len(idx), dtype=bool)
+        first[1:] = rows["view"][1:] != rows["view"][:-1]
+        return idx[first]
+
+    # how many whole levels fit the budget for these segments, and what is left for the next
+    def plan(self, budget, segments=None):
+        per_level = self.level_counts.sum(axis=1) if segments is None else self.level_counts[:, segments].sum(axis=1)
+        total = np.cumsum(per_level)
+        full = int(np.searchsorted(total, budget, side="right"))
+        used = int(total[full - 1]) if full else 0
+        return full, used, per_level
+
+    # (points float32, segment ids, colors or None), coarse to fine up to budget points
+    def load(self, budget=1_000_000, segments=None, views=None, min_points=0, colors=False):
+        if segments is None and (views is not None or min_points > 0):
+            segments = self.select(min_points, views)
+        if segments is not None:
+            segments = np.asarray(segments, dtype=np.int64)
+        full, used, per_level = self.plan(budget, segments)
+        end = int(self.offsets[min(full + 1, len(per_level))])
+
+        seg = np.asarray(self.seg[:end])
+        if segments is None:
+            keep = np.arange(min(end, budget))
+        else:
+            wanted = np.zeros(len(self.segments), dtype=bool)
+            wanted[segments] = True
+            keep = np.flatnonzero(wanted[seg])
+            # a partial last level is a random subset too, since levels are shuffled
+            keep = keep[:budget]
+        pts = np.asarray(self.points[:end][keep] if segments is not None else self.points[:len(keep)], dtype=np.float32)
+        cols = None
+        if colors:
+            cols = np.asarray(self.colors[:end][keep] if segments is not None else self.colors[:len(keep)])
+        return pts, seg[keep].astype(np.int32), cols
+
+    def level_of(self, n):
+        # level the n-th stored point belongs to
+        return int(np.searchsorted(self.offsets, n, side="right") - 1)
+
+# stable per segment rgb in [0,1], index it with the seg ids instead of repeating colors
+def segment_palette(n, seed=0):
+    return np.random.default_rng(seed).random((max(n, 1), 3))
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--lift_dir", required=True)
+    ap.add_argument("--out", default=None)
+    ap.add_argument("--depth", type=int, default=9)
+    ap.add_argument("--points_dtype", default="float32", choices=["float32", "float16"])
+    ap.add_argument("--budget", type=int, default=1_000_000, help="test load of this many points")
+    args = ap.parse_args()
+    if not 0 <= args.depth <= 20:
+        raise SystemExit("--depth must be in 0..20")
+
+    t0 = time.time()
+    out = build_lod(args.lift_dir, args.out, args.depth, args.points_dtype)
+    print(f"built {out} in {time.time() - t0:.1f}s")
+
+    cloud = LodCloud(out)
+    counts = cloud.level_counts.sum(axis=1)
+    print(f"{len(cloud)} points, {len(cloud.segments)} segments over {len(cloud.views())} views")
+    for L, c in enumerate(counts):
+        name = f"level {L:2d}" if L <= cloud.meta["depth"] else "rest    "
+        print(f"  {name} {int(c):10d} points  cumulative {int(cloud.offsets[L + 1]):10d}")
+
+    t0 = time.time()
+    pts, seg, _ = cloud.load(args.budget)
+    print(f"loaded {len(pts)} points of {len(np.unique(seg))} segments in {1000 * (time.time() - t0):.0f} ms "
+          f"(levels 0..{cloud.level_of(max(len(pts) - 1, 0))})")
+
+if __name__ == "__main__":
+    main()
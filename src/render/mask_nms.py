@@ -0,0 +1,74 @@
+import numpy as np
+
+r'''
+mask level nms for sam output, run on ranked masks before top-k:
+
+  duplicate  iou with an already kept mask >= iou_thresh
+  nested     >= contain_thresh of the mask lies inside a kept mask that is at most
+             1/NESTED_MIN_RATIO times bigger (small parts inside a whole object survive)
+
+all pairwise overlaps come from one matmul over area-pooled masks (pool x pool px blocks).
+'''
+
+NESTED_MIN_RATIO = 0.5
+
+# (N,H,W) bool -> (N, h*w) float32 coverage of every pool x pool block
+def pool_masks(masks, pool=4):
+    masks = np.asarray(masks, dtype=bool)
+    n, H, W = masks.shape
+    if pool <= 1:
+        return masks.reshape(n, -1).astype(np.float32)
+    ph, pw = -H % pool, -W % pool
+    if ph or pw:
+        masks = np.pad(masks, ((0, 0), (0, ph), (0, pw)))
+    h, w = masks.shape[1] // pool, masks.shape[2] // pool
+    blocks = masks.reshape(n, h, pool, w, pool).sum(axis=(2, 4), dtype=np.float32)
+    return (blocks / (pool * pool)).reshape(n, -1)
+
+# iou[i, j] and inside[i, j] = fraction of mask i inside mask j
+def mask_overlaps(masks, pool=4):
+    a = pool_masks(masks, pool)
+    inter = a @ a.T
+    # a mask's "area" is its overlap with itself, so identical masks score exactly 1
+    # even though blocks on the boundary are only partly covered
+    area = np.diag(inter).copy()
+    union = area[:, None] + area[None, :] - inter
+    iou = inter / np.maximum(union, 1e-9)
+    inside = inter / np.maximum(area[:, None], 1e-9)
+    return iou, inside, area
+
+# masks already in rank order; returns the kept masks, each carrying a "suppressed" list
+def dedup_masks(masks, iou_thresh=0.85, contain_thresh=0.95, pool=4):
+    if len(masks) < 2 or (iou_thresh >= 1 and contain_thresh >= 1):
+        return list(masks)
+    iou, inside, area = mask_overlaps(np.stack([m["segmentation"] for m in masks]), pool)
+
+    kept = []
+    suppressed = {}
+    for i in range(len(masks)):
+        if kept:
+            k = np.asarray(kept)
+            dup = iou[i, k] >= iou_thresh
+            nest = (inside[i, k] >= contain_thresh) & (area[i] >= NESTED_MIN_RATIO * area[k])
+            hit = dup | nest
+            if hit.any():
+                # credit the kept mask that overlaps it most
+                j = int(k[hit][np.argmax(iou[i, k[hit]])])
+                reason = "duplicate" if iou[i, j] >= iou_thresh else "nested"
+                suppressed.setdefault(j, []).append({
+                    "reason": reason,
+                    "iou": round(float(iou[i, j]), 4),
+                    "inside": round(float(inside[i, j]), 4),
+                    "area": int(masks[i]["area"]),
+                    "predicted_iou": float(masks[i].get("predicted_iou", -1.0)),
+                    "stability_score": float(masks[i].get("stability_score", -1.0))})
+                continue
+        kept.append(i)
+
+    out = []
+    for i in kept:
+        m = dict(masks[i])
+        if i in suppressed:
+            m["suppressed"] = suppressed[i]
+        out.append(m)
+    return out
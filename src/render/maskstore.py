@@ -0,0 +1,193 @@
+import os
+import sys
+import json
+import argparse
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from imgio import load_mask
+from lift_engine import save_npz
+
+r'''
+one file per view for all sam masks: view_XXX/masks.npz holds the masks bit-packed
+(np.packbits over the flattened HxW mask, then deflate) plus the meta columns. written with
+lift_engine.save_npz (fixed zip timestamps), so the same masks give the same bytes and the
+pipeline's content hashes do not re-lift a view whose sam rerun changed nothing.
+
+convert an existing png layout (view_XXX/masks/mask_XXX.png + meta.json):
+
+python src/render/maskstore.py --sam2d_dir "$out/725sam" [--remove_png 1]
+'''
+
+STORE_NAME = "masks.npz"
+
+def write_mask_store(path, masks, meta):
+    # masks: (N,H,W) bool or a list of (H,W) bool, meta: one dict per mask
+    masks = np.asarray(masks, dtype=bool)
+    n = len(meta)
+    if n:
+        h, w = masks.shape[1:]
+    else:
+        h, w = 0, 0
+    bits = np.packbits(masks.reshape(n, -1), axis=1) if n else np.zeros((0, 0), np.uint8)
+
+    save_npz(
+        path,
+        shape=np.array([h, w], dtype=np.int64),
+        bits=bits,
+        mask_id=np.array([m["mask_id"] for m in meta], dtype=np.int32),
+        area=np.array([m["area"] for m in meta], dtype=np.int64),
+        bbox=np.array([m["bbox"] for m in meta], dtype=np.int32).reshape(n, 4),
+        predicted_iou=np.array([m.get("predicted_iou", -1.0) for m in meta], dtype=np.float32),
+        stability_score=np.array([m.get("stability_score", -1.0) for m in meta], dtype=np.float32))
+
+class MaskStore:
+    def __init__(self, path):
+        z = np.load(path)
+        self.path = path
+        self.shape = tuple(int(x) for x in z["shape"])
+        self.bits = z["bits"]
+        self.mask_id = z["mask_id"]
+        self.area = z["area"]
+        self.bbox = z["bbox"]
+        self.predicted_iou = z["predicted_iou"]
+        self.stability_score = z["stability_score"]
+
+    def __len__(self):
+        return len(self.mask_id)
+
+    @property
+    def meta(self):
+        return [{"mask_id": int(self.mask_id[j]),
+                 "area": int(self.area[j]),
+                 "bbox": [int(x) for x in self.bbox[j]],
+                 "predicted_iou": float(self.predicted_iou[j]),
+                 "stability_score": float(self.stability_score[j])} for j in range(len(self))]
+
+    def mask(self, j):
+        h, w = self.shape
+        return np.unpackbits(self.bits[j], count=h * w).astype(bool).reshape(h, w)
+
+    def stack(self, idx=None):
+        # (N,H,W) bool, one unpack for all requested masks
+        h, w = self.shape
+        bits = self.bits if idx is None else self.bits[np.asarray(idx)]
+        return np.unpackbits(bits, axis=1, count=h * w).astype(bool).reshape(len(bits), h, w)
+
+    def flat(self, idx=None):
+        # (N,H*W) bool, handy for gathers at flat pixel ids
+        h, w = self.shape
+        bits = self.bits if idx is None else self.bits[np.asarray(idx)]
+        return np.unpackbits(bits, axis=1, count=h * w).astype(bool)
+
+    def label_map(self, order="area"):
+        # (H,W) int32 index into the store, -1 = no mask. where masks overlap the
+        # smaller one wins (painted last), so nested parts keep their own label
+        h, w = self.shape
+        labels = np.full(h * w, -1, dtype=np.int32)
+        if len(self) == 0:
+            return labels.reshape(h, w)
+        if order == "area":
+            paint = np.argsort(-self.area, kind="stable")
+        else:
+            paint = np.arange(len(self))
+        flat = self.flat()
+        for j in paint:
+            labels[flat[j]] = j
+        return labels.reshape(h, w)
+
+    def coverage(self):
+        # (H,W) how many masks cover each pixel
+        h, w = self.shape
+        return self.flat().sum(axis=0, dtype=np.int32).reshape(h, w)
+
+# same reader api over the legacy one-png-per-mask layout
+class PngMaskDir:
+    def __init__(self, view_dir):
+        self.mask_dir = os.path.join(view_dir, "masks")
+        self.files = sorted([f for f in os.listdir(self.mask_dir) if f.lower().endswith(".png")])
+        self.mask_id = np.array([int(os.path.splitext(f)[0].split("_")[-1]) for f in self.files], dtype=np.int32)
+
+        meta_path = os.path.join(view_dir, "meta.json")
+        by_id = {}
+        if os.path.exists(meta_path):
+            with open(meta_path, "r") as f:
+                by_id = {int(m["mask_id"]): m for m in json.load(f)}
+        self._meta = [by_id.get(int(i), {"mask_id": int(i)}) for i in self.mask_id]
+        self.shape = None
+
+    def __len__(self):
+        return len(self.files)
+
+    @property
+    def meta(self):
+        return self._meta
+
+    def mask(self, j):
+        m = load_mask(os.path.join(self.mask_dir, self.files[j]))
+        self.shape = m.shape
+        return m
+
+    def stack(self, idx=None):
+        idx = range(len(self)) if idx is None else idx
+        return np.stack([self.mask(j) for j in idx]) if len(idx) else np.zeros((0, 0, 0), bool)
+
+    def flat(self, idx=None):
+        s = self.stack(idx)
+        return s.reshape(len(s), -1)
+
+def open_view_masks(view_dir):
+    # packed store if the view has one, else the png directory, else None. sam_seg.py removes
+    # masks.npz when it writes pngs only, so a store here is never older than the pngs
+    store = os.path.join(view_dir, STORE_NAME)
+    if os.path.exists(store):
+        return MaskStore(store)
+    if os.path.isdir(os.path.join(view_dir, "masks")):
+        return PngMaskDir(view_dir)
+    return None
+
+def convert_view(view_dir, remove_png=False):
+    src = PngMaskDir(view_dir)
+    masks = src.stack()
+    meta = []
+    for m, i, seg in zip(src.meta, src.mask_id, masks):
+        meta.append({
+            "mask_id": int(i),
+            "area": int(m.get("area", seg.sum())),
+            "bbox": m.get("bbox", [0, 0, 0, 0]),
+            "predicted_iou": float(m.get("predicted_iou", -1.0)),
+            "stability_score": float(m.get("stability_score", -1.0))})
+    write_mask_store(os.path.join(view_dir, STORE_NAME), masks, meta)
+
+    if remove_png:
+        for f in src.files:
+            os.remove(os.path.join(src.mask_dir, f))
+        if not os.listdir(src.mask_dir):
+            os.rmdir(src.mask_dir)
+
+        # meta.json now points into the store
+        meta_path = os.path.join(view_dir, "meta.json")
+        if os.path.exists(meta_path):
+            vd = os.path.basename(os.path.normpath(view_dir))
+            for j, m in enumerate(src.meta):
+                m["mask_path"] = f"{vd}/{STORE_NAME}"
+                m["mask_index"] = j
+            with open(meta_path, "w") as f: json.dump(src.meta, f, indent=2)
+    return len(meta)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sam2d_dir", required=True)
+    ap.add_argument("--remove_png", type=int, default=0)
+    args = ap.parse_args()
+
+    views = sorted(d for d in os.listdir(args.sam2d_dir) if d.startswith("view_"))
+    for vd in views:
+        view_dir = os.path.join(args.sam2d_dir, vd)
+        if not os.path.isdir(os.path.join(view_dir, "masks")):
+            continue
+        n = convert_view(view_dir, bool(args.remove_png))
+        print(f"{vd}: packed {n} masks")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,409 @@
+import os
+import sys
+import json
+import glob
+import shlex
+import hashlib
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from render_launcher import read_shape_list, worker_env
+import stagetrace
+
+r'''
+incremental render -> sam -> lift per shape. every stage keeps a pipeline_state.json in its
+output dir with a key over its arguments (plus obj files / checkpoint) and one hash per view
+over that view's inputs (upstream outputs by content). a rerun only redoes stale stages, and
+inside a stage only stale views:
+
+  --topk 15 -> 30     sam reruns every view, lift reruns the views whose masks changed
+  --voxel 0 -> 0.01   lift only
+  one rgb/*.png gone  render re-renders that view, then sam/lift follow for it
+
+shapes run concurrently, each stage waits until its cpu share fits under --cpus.
+
+python src/render/pipeline.py `
+  --list "$proj\data\partnet_datasets\list.txt" --out_root "$proj\data\output" `
+  --blender $blender42 --views 24 --res 512 `
+  --sam_ckpt "$proj\checkpoints\sam_vit_h_4b8939.pth" --device cpu --topk 15 `
+  --voxel 0.01 --cpus 16
+
+--engine RASTER renders with raster.py (no blender). --dry_run 1 prints what would run.
+--trace run.jsonl collects every stage's per view trace (see stagetrace.py) in one file.
+per shape the layout is <out_root>/<id>, <id>sam, <id>lifted like the hand-run scripts.
+'''
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STATE_NAME = "pipeline_state.json"
+
+# content hashes, memoized on (size, mtime) so unchanged files are read once per run
+class FileHasher:
+    def __init__(self):
+        self.memo = {}
+        self.lock = threading.Lock()
+
+    def file(self, path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+        with self.lock:
+            if key in self.memo:
+                return self.memo[key]
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        digest = h.hexdigest()
+        with self.lock:
+            self.memo[key] = digest
+        return digest
+
+    # None if any file is missing, so a missing input always reads as stale
+    def files(self, paths, *extra):
+        h = hashlib.sha1()
+        for p in paths:
+            d = self.file(p)
+            if d is None:
+                return None
+            h.update(d.encode())
+        for e in extra:
+            h.update(json.dumps(e, sort_keys=True).encode())
+        return h.hexdigest()
+
+def key_of(*parts):
+    return hashlib.sha1(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+def load_state(out_dir):
+    path = os.path.join(out_dir, STATE_NAME)
+    if not os.path.exists(path):
+        return {"key": None, "views": {}}
+    with open(path, "r") as f:
+        return json.load(f)
+
+def save_state(out_dir, state):
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, STATE_NAME)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f: json.dump(state, f, indent=2)
+    os.replace(tmp, path)
+
+# views whose input hash changed (or is unknown) since the stage last ran with this key
+def stale_views(state, key, view_hashes):
+    if state.get("key") != key:
+        return sorted(view_hashes, key=int)
+    done = state.get("views", {})
+    return sorted((v for v, h in view_hashes.items() if h is None or done.get(v) != h), key=int)
+
+def ranges(views):
+    out = []
+    for v in views:
+        if out and v == out[-1][1]:
+            out[-1][1] = v + 1
+        else:
+            out.append([v, v + 1])
+    return out
+
+class CpuBudget:
+    def __init__(self, total):
+        self.total = max(1, total)
+        self.free = self.total
+        self.cond = threading.Condition()
+
+    def acquire(self, n):
+        n = min(max(1, n), self.total)
+        with self.cond:
+            self.cond.wait_for(lambda: self.free >= n)
+            self.free -= n
+        return n
+
+    def release(self, n):
+        with self.cond:
+            self.free += n
+            self.cond.notify_all()
+
+class Shape:
+    def __init__(self, sid, in_dir, out_dir):
+        self.sid = sid
+        self.in_dir = in_dir
+        self.out_dir = out_dir
+        self.sam_dir = out_dir + "sam"
+        self.lift_dir = out_dir + "lifted"
+
+class Pipeline:
+    def __init__(self, args, budget, hasher, log_dir):
+        self.args = args
+        self.budget = budget
+        self.hasher = hasher
+        self.log_dir = log_dir
+        self.ckpt = hasher.file(args.sam_ckpt) if args.sam_ckpt is not None else None
+
+    def run(self, cmd, cpus, name, stage):
+        if self.args.dry_run:
+            print(f"[dry run] {name}: {' '.join(cmd)}")
+            return 0
+        n = self.budget.acquire(cpus)
+        try:
+            with stagetrace.span(f"pipeline_{stage}", job=name, cpus=n), \
+                 open(os.path.join(self.log_dir, f"{name}.log"), "w") as log:
+                rc = subprocess.run(cmd, stdout=log, stderr=subprocess.STDOUT, env=worker_env(n)).returncode
+        finally:
+            self.budget.release(n)
+        if rc != 0:
+            raise RuntimeError(f"{name} failed ({rc}), see {name}.log")
+        return rc
+
+    # ---- render ----
+    def render_key(self, shape):
+        a = self.args
+        objs = sorted(glob.glob(os.path.join(shape.in_dir, "*.obj")))
+        return key_of("render", [os.path.basename(p) for p in objs], self.hasher.files(objs),
+                      a.engine, a.views, a.res, a.radius, a.elev, a.render_extra)
+
+    def render_outputs(self, shape, v):
+        stem = f"{v:03d}"
+        return [os.path.join(shape.out_dir, "rgb", f"{stem}.png"),
+                os.path.join(shape.out_dir, "depth_exr", f"{stem}.exr"),
+                os.path.join(shape.out_dir, "part_id_exr", f"{stem}.exr")]
+
+    def cameras(self, shape):
+        path = os.path.join(shape.out_dir, "cameras.json")
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r") as f:
+            return {int(c["view"]): c for c in json.load(f)}
+
+    def render(self, shape):
+        a = self.args
+        key = self.render_key(shape)
+        state = load_state(shape.out_dir)
+        cams = self.cameras(shape)
+        # a view is done when the key matches and its files and camera record are all there
+        present = {v: (v in cams and all(os.path.exists(p) for p in self.render_outputs(shape, v)))
+                   for v in range(a.views)}
+        views = {str(v): ("ok" if present[v] else None) for v in range(a.views)}
+        stale = [int(v) for v in stale_views(state, key, views)]
+        if not stale:
+            return False
+
+        for start, end in ranges(stale):
+            if a.engine == "RASTER":
+                cmd = [sys.executable, os.path.join(HERE, "raster.py"),
+                       "--in_dir", shape.in_dir, "--out_dir", shape.out_dir,
+                       "--views", str(a.views), "--res", str(a.res), "--radius", str(a.radius), "--elev", str(a.elev),
+                       "--view_start", str(start), "--view_end", str(end)] + shlex.split(a.render_extra)
+            else:
+                cmd = [a.blender, "-b", "-P", os.path.join(HERE, "render_multi.py"), "--",
+                       "--in_dir", shape.in_dir, "--out_dir", shape.out_dir, "--engine", a.engine,
+                       "--views", str(a.views), "--res", str(a.res), "--radius", str(a.radius), "--elev", str(a.elev),
+                       "--view_start", str(start), "--view_end", str(end),
+                       "--threads", str(a.render_threads)] + shlex.split(a.render_extra)
+            self.run(cmd, a.render_threads, f"{shape.sid}_render_{start:03d}_{end:03d}", "render")
+        if a.dry_run:
+            return True
+
+        # fold the partial-range camera files into cameras.json next to the views kept
+        shard_files = sorted(glob.glob(os.path.join(shape.out_dir, "cameras_*_*.json")))
+        if shard_files:
+            cams = self.cameras(shape)
+            for sf in shard_files:
+                with open(sf, "r") as f:
+                    for rec in json.load(f):
+                        cams[int(rec["view"])] = rec
+            with open(os.path.join(shape.out_dir, "cameras.json"), "w") as f:
+                json.dump([cams[v] for v in sorted(cams) if v < a.views], f, indent=2)
+            for sf in shard_files:
+                os.remove(sf)
+
+        save_state(shape.out_dir, {"key": key, "views": {str(v): "ok" for v in range(a.views)}})
+        return True
+
+    # ---- sam ----
+    def sam_key(self):
+        a = self.args
+        return key_of("sam", self.ckpt, a.model_type, a.points_per_side, a.pred_iou_thresh,
+                      a.stability_score_thresh, a.min_mask_region_area, a.topk, a.rank,
+                      a.prompts, a.sam_extra)
+
+    def sam_inputs(self, shape, v):
+        stem = f"{v:03d}"
+        paths = [os.path.join(shape.out_dir, "rgb", f"{stem}.png")]
+        if self.args.prompts == "seeded":
+            paths.append(os.path.join(shape.out_dir, "depth_exr", f"{stem}.exr"))
+        return self.hasher.files(paths)
+
+    def sam_outputs(self, shape, v):
+        view_dir = os.path.join(shape.sam_dir, f"view_{v:03d}")
+        meta = os.path.join(view_dir, "meta.json")
+        if not os.path.exists(meta):
+            return None
+        paths = [meta] + sorted(glob.glob(os.path.join(view_dir, "masks.npz"))) \
+            + sorted(glob.glob(os.path.join(view_dir, "masks", "*.png")))
+        return self.hasher.files(paths)
+
+    def sam(self, shape):
+        a = self.args
+        key = self.sam_key()
+        state = load_state(shape.sam_dir)
+        inputs = {str(v): self.sam_inputs(shape, v) for v in range(a.views)}
+        # a view whose masks went missing reads as stale too
+        for v in range(a.views):
+            if self.sam_outputs(shape, v) is None:
+                inputs[str(v)] = None
+        stale = stale_views(state, key, inputs)
+        if not stale:
+            return False
+
+        cmd = [sys.executable, os.path.join(HERE, "sam_seg.py"),
+               "--rgb_dir", os.path.join(shape.out_dir, "rgb"), "--out_dir", shape.sam_dir,
+               "--sam_ckpt", a.sam_ckpt, "--model_type", a.model_type, "--device", a.device,
+               "--points_per_side", str(a.points_per_side), "--pred_iou_thresh", str(a.pred_iou_thresh),
+               "--stability_score_thresh", str(a.stability_score_thresh),
+               "--min_mask_region_area", str(a.min_mask_region_area),
+               "--topk", str(a.topk), "--rank", a.rank, "--prompts", a.prompts,
+               "--workers", str(a.sam_workers),
+               "--threads_per_worker", str(max(1, a.sam_cpus // max(1, a.sam_workers)))] + shlex.split(a.sam_extra)
+        if len(stale) < a.views:
+            cmd += ["--views", ",".join(f"{int(v):03d}" for v in stale)]
+        self.run(cmd, a.sam_cpus, f"{shape.sid}_sam", "sam")
+        if a.dry_run:
+            return True
+
+        inputs = {str(v): self.sam_inputs(shape, v) for v in range(a.views)}
+        save_state(shape.sam_dir, {"key": key, "views": inputs})
+        return True
+
+    # ---- lift ----
+    def lift_key(self):
+        a = self.args
+        return key_of("lift", a.voxel, a.voxel_mode, a.lift_format, a.lift_extra)
+
+    def lift_inputs(self, shape, v, cams):
+        stem = f"{v:03d}"
+        sam = self.sam_outputs(shape, v)
+        if sam is None or v not in cams:
+            return None
+        return self.hasher.files([os.path.join(shape.out_dir, "rgb", f"{stem}.png"),
+                                  os.path.join(shape.out_dir, "depth_exr", f"{stem}.exr")], sam, cams[v])
+
+    def lift(self, shape):
+        a = self.args
+        key = self.lift_key()
+        state = load_state(shape.lift_dir)
+        cams = self.cameras(shape)
+        inputs = {str(v): self.lift_inputs(shape, v, cams) for v in range(a.views)}
+        stale = stale_views(state, key, inputs)
+        if not stale:
+            return False
+
+        cmd = [sys.executable, os.path.join(HERE, "lift.py"), "--",
+               "--out_dir", shape.out_dir, "--sam2d_dir", shape.sam_dir, "--lift_dir", shape.lift_dir,
+               "--voxel", str(a.voxel), "--voxel_mode", a.voxel_mode, "--format", a.lift_format,
+               "--workers", str(a.lift_workers)] + shlex.split(a.lift_extra)
+        # the columnar store is written whole, so it only allows full re-lifts
+        if len(stale) < a.views and a.lift_format == "npz":
+            cmd += ["--views", ",".join(str(int(v)) for v in stale)]
+        self.run(cmd, a.lift_workers, f"{shape.sid}_lift", "lift")
+        if a.dry_run:
+            return True
+
+        save_state(shape.lift_dir, {"key": key, "views": inputs})
+        return True
+
+    def shape(self, shape):
+        done = []
+        for name, stage in (("render", self.render), ("sam", self.sam), ("lift", self.lift)):
+            if name == "sam" and self.args.sam_ckpt is None:
+                break
+            if stage(shape):
+                done.append(name)
+        return done
+
+def collect_shapes(args):
+    if args.in_dir is not None:
+        sid = os.path.basename(os.path.normpath(args.out_dir))
+        return [Shape(sid, args.in_dir, os.path.normpath(args.out_dir))]
+    if args.list is not None:
+        in_root = args.in_root if args.in_root is not None else os.path.dirname(os.path.abspath(args.list))
+        return [Shape(sid, os.path.join(in_root, sid), os.path.join(args.out_root, sid)) for sid in read_shape_list(args.list)]
+    dirs = sorted(d for d in glob.glob(args.glob) if os.path.isdir(d))
+    return [Shape(os.path.basename(os.path.normpath(d)), d, os.path.join(args.out_root, os.path.basename(os.path.normpath(d)))) for d in dirs]
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--in_dir", default=None)
+    ap.add_argument("--out_dir", default=None)
+    ap.add_argument("--list", default=None)
+    ap.add_argument("--glob", default=None)
+    ap.add_argument("--in_root", default=None)
+    ap.add_argument("--out_root", default=None)
+    ap.add_argument("--cpus", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--dry_run", type=int, default=0)
+    ap.add_argument("--trace", default=None)
+    # render
+    ap.add_argument("--blender", default="blender")
+    ap.add_argument("--engine", default="CYCLES")
+    ap.add_argument("--views", type=int, default=48)
+    ap.add_argument("--res", type=int, default=512)
+    ap.add_argument("--radius", type=float, default=2.2)
+    ap.add_argument("--elev", type=float, default=15.0)
+    ap.add_argument("--render_threads", type=int, default=4)
+    ap.add_argument("--render_extra", default="")
+    # sam (skipped without a checkpoint)
+    ap.add_argument("--sam_ckpt", default=None)
+    ap.add_argument("--model_type", default="vit_h")
+    ap.add_argument("--device", default="cpu")
+    ap.add_argument("--points_per_side", type=int, default=32)
+    ap.add_argument("--pred_iou_thresh", type=float, default=0.88)
+    ap.add_argument("--stability_score_thresh", type=float, default=0.95)
+    ap.add_argument("--min_mask_region_area", type=int, default=200)
+    ap.add_argument("--topk", type=int, default=50)
+    ap.add_argument("--rank", default="quality")
+    ap.add_argument("--prompts", default="grid")
+    ap.add_argument("--sam_workers", type=int, default=1)
+    ap.add_argument("--sam_cpus", type=int, default=4)
+    ap.add_argument("--sam_extra", default="")
+    # lift
+    ap.add_argument("--voxel", type=float, default=0.0)
+    ap.add_argument("--voxel_mode", default="first")
+    ap.add_argument("--lift_format", default="npz")
+    ap.add_argument("--lift_workers", type=int, default=2)
+    ap.add_argument("--lift_extra", default="")
+    args = ap.parse_args()
+
+    if args.in_dir is None and args.list is None and args.glob is None:
+        raise SystemExit("need --in_dir/--out_dir, --list or --glob")
+    if args.in_dir is not None and args.out_dir is None:
+        raise SystemExit("--in_dir needs --out_dir")
+    if args.in_dir is None and args.out_root is None:
+        raise SystemExit("--list/--glob need --out_root")
+
+    stagetrace.configure(args.trace, "pipeline")
+    shapes = collect_shapes(args)
+    root = args.out_root if args.out_root is not None else os.path.dirname(os.path.normpath(args.out_dir))
+    log_dir = os.path.join(root, "pipeline_logs")
+    os.makedirs(log_dir, exist_ok=True)
+
+    budget = CpuBudget(args.cpus)
+    pipe = Pipeline(args, budget, FileHasher(), log_dir)
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(1, min(len(shapes), args.cpus))) as ex:
+        futs = {ex.submit(pipe.shape, s): s for s in shapes}
+        for fut, s in futs.items():
+            try:
+                done = fut.result()
+                print(f"{s.sid}: {'ran ' + ', '.join(done) if done else 'up to date'}")
+            except Exception as e:
+                failed.append(s.sid)
+                print(f"{s.sid}: {e}")
+
+    if failed:
+        raise SystemExit(f"failed shapes: {failed}")
+
+if __name__ == "__main__":
+    main()
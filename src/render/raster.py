@@ -0,0 +1,239 @@
+import os
+import sys
+import json
+import argparse
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import cameras as camlib
+import imgio
+import stagetrace
+
+r'''
+numpy z-buffer backend for the geometry passes lift.py needs, no blender.
+writes the same rgb/, depth_exr/, part_id_exr/ layout and cameras.json as render_multi.py
+(rgb is flat headlight shading, only meant for driving sam/lift without cycles)
+
+cli:
+
+python src/render/raster.py `
+  --in_dir "$proj\data\partnet_datasets\725" `
+  --out_dir "$proj\data\output\725raster" `
+  --views 24 --res 512 --radius 2.2 --elev 15
+
+or through the blender script's flag, still without blender:
+
+python src/render/render_multi.py -- --engine RASTER --in_dir ... --out_dir ...
+
+--trace run.jsonl records raster / write time per view (see stagetrace.py)
+--cameras plan.json renders those poses (viewplan.py output) instead of the orbit ring
+'''
+
+# blender writes this into the Z pass where nothing was hit
+BG_DEPTH = 1e10
+NEAR = 0.01
+
+# max (triangle, pixel) candidates held at once
+CHUNK = 1 << 22
+
+def load_obj(path):
+    verts, faces = [], []
+    with open(path, "r") as f:
+        for line in f:
+            if line.startswith("v "):
+                verts.append(line.split()[1:4])
+            elif line.startswith("f "):
+                idx = [int(t.split("/")[0]) for t in line.split()[1:]]
+                # fan triangulation for polygons
+                for k in range(1, len(idx) - 1):
+                    faces.append((idx[0], idx[k], idx[k + 1]))
+
+    v = np.asarray(verts, dtype=np.float64).reshape(-1, 3)
+    fc = np.asarray(faces, dtype=np.int64).reshape(-1, 3)
+    fc = np.where(fc < 0, fc + len(v), fc - 1)
+
+    # blender obj import: forward -Z, up Y -> (x, -z, y)
+    v = np.stack([v[:, 0], -v[:, 2], v[:, 1]], axis=1)
+    return v, fc
+
+# same bbox as compute_bbox_world; render_multi sets location = -center and
+# scale = 1/size, so world = v * scale - center (center is not scaled)
+def normalization(verts):
+    mins = verts.min(axis=0)
+    maxs = verts.max(axis=0)
+    center = (mins + maxs) * 0.5
+    size = float((maxs - mins).max())
+    scale = 1.0 / size if size > 1e-9 else 1.0
+    return center, scale
+
+# triangles in normalized world space plus the pass index of their part
+def load_shape(in_dir):
+    obj_files = sorted([f for f in os.listdir(in_dir) if f.lower().endswith(".obj")])
+    if not obj_files: raise SystemExit(f"no obj files found in {in_dir}")
+
+    parts = [load_obj(os.path.join(in_dir, fn)) for fn in obj_files]
+    center, scale = normalization(np.concatenate([v for v, _ in parts], axis=0))
+
+    tris, pids = [], []
+    for idx, (v, fc) in enumerate(parts):
+        tris.append(v[fc] * scale - center)
+        pids.append(np.full(len(fc), idx + 1, dtype=np.int32))
+
+    return np.concatenate(tris, axis=0), np.concatenate(pids), obj_files
+
+def rasterize(tris, pids, c2w, intr):
+    W, H = int(intr["w"]), int(intr["h"])
+    fx, fy, cx, cy = intr["fx"], intr["fy"], intr["cx"], intr["cy"]
+
+    w2c = np.linalg.inv(np.asarray(c2w, dtype=np.float64))
+    cam = tris @ w2c[:3, :3].T + w2c[:3, 3]
+    d = -cam[..., 2]
+
+    # planar depth, same convention lift.py inverts
+    keep = (d > NEAR).all(axis=1)
+    cam, d, tris, pids = cam[keep], d[keep], tris[keep], pids[keep]
+    u = cx + fx * cam[..., 0] / d
+    v = cy - fy * cam[..., 1] / d
+
+    # headlight shading from the face normal
+    n = np.cross(tris[:, 1] - tris[:, 0], tris[:, 2] - tris[:, 0])
+    n /= np.linalg.norm(n, axis=1, keepdims=True) + 1e-12
+    view_dir = tris.mean(axis=1) - c2w[:3, 3]
+    view_dir /= np.linalg.norm(view_dir, axis=1, keepdims=True)
+    shade = 0.15 + 0.75 * np.abs((n * view_dir).sum(axis=1))
+
+    # pixel centers sit at i + 0.5
+    xmin = np.clip(np.ceil(u.min(axis=1) - 0.5), 0, W).astype(np.int64)
+    xmax = np.clip(np.floor(u.max(axis=1) - 0.5), -1, W - 1).astype(np.int64)
+    ymin = np.clip(np.ceil(v.min(axis=1) - 0.5), 0, H).astype(np.int64)
+    ymax = np.clip(np.floor(v.max(axis=1) - 0.5), -1, H - 1).astype(np.int64)
+    bw = np.maximum(xmax - xmin + 1, 0)
+    bh = np.maximum(ymax - ymin + 1, 0)
+    area = (u[:, 1] - u[:, 0]) * (v[:, 2] - v[:, 0]) - (u[:, 2] - u[:, 0]) * (v[:, 1] - v[:, 0])
+    ok = np.abs(area) > 1e-12
+    count = np.where(ok, bw * bh, 0)
+    area = np.where(ok, area, 1.0)
+
+    # per triangle planes in screen space: three edge functions (barycentrics) and 1/d,
+    # so each candidate pixel is one gather plus a few multiply-adds
+    coef = np.empty((len(u), 4, 3), dtype=np.float64)
+    for k in range(3):
+        i, j = (k + 1) % 3, (k + 2) % 3
+        coef[:, k, 0] = (v[:, i] - v[:, j]) / area
+        coef[:, k, 1] = (u[:, j] - u[:, i]) / area
+        coef[:, k, 2] = (u[:, i] * v[:, j] - u[:, j] * v[:, i]) / area
+    inv_d = 1.0 / d
+    coef[:, 3] = np.einsum("tkc,tk->tc", coef[:, :3], inv_d)
+    ca, cb, cc = [np.ascontiguousarray(coef[:, :, m], dtype=np.float32) for m in range(3)]
+
+    # z-buffer of packed keys: float32 depth bits (monotonic for positive floats) over triangle id
+    zbuf = np.full(H * W, np.iinfo(np.int64).max, dtype=np.int64)
+
+    live = np.nonzero(count)[0]
+    ends = np.cumsum(count[live])
+    start = 0
+    while start < len(live):
+        stop = max(int(np.searchsorted(ends, ends[start] - count[live[start]] + CHUNK, side="right")), start + 1)
+        t_idx = live[start:stop]
+        start = stop
+
+        # every (triangle, pixel) pair inside each triangle's bbox
+        n_t = count[t_idx]
+        tid = np.repeat(t_idx, n_t)
+        local = np.arange(n_t.sum()) - np.repeat(np.cumsum(n_t) - n_t, n_t)
+        row, col = np.divmod(local, bw[tid])
+        px = xmin[tid] + col
+        py = ymin[tid] + row
+
+        sx = (px + 0.5).astype(np.float32)[:, None]
+        sy = (py + 0.5).astype(np.float32)[:, None]
+        w = ca[tid] * sx + cb[tid] * sy + cc[tid]
+        inside = (np.minimum(np.minimum(w[:, 0], w[:, 1]), w[:, 2]) >= 0) & (w[:, 3] > 0)
+
+        # perspective correct depth: 1/d is linear in screen space
+        z = (1.0 / w[inside, 3]).astype(np.float32)
+        key = (z.view(np.int32).astype(np.int64) << 32) | tid[inside]
+        np.minimum.at(zbuf, py[inside] * W + px[inside], key)
+
+    hit = zbuf != np.iinfo(np.int64).max
+    tri = (zbuf & 0xffffffff)[hit]
+    zbits = (zbuf[hit] >> 32).astype(np.int32)
+
+    depth = np.full(H * W, BG_DEPTH, dtype=np.float32)
+    depth[hit] = zbits.view(np.float32)
+    part_id = np.zeros(H * W, dtype=np.float32)
+    part_id[hit] = pids[tri]
+    depth = depth.reshape(H, W)
+    part_id = part_id.reshape(H, W)
+
+    rgba = np.zeros((H * W, 4), dtype=np.uint8)
+    gray = (shade[tri] * 255.0 + 0.5).astype(np.uint8)
+    rgba[hit, 0] = gray
+    rgba[hit, 1] = gray
+    rgba[hit, 2] = gray
+    rgba[hit, 3] = 255
+
+    return depth, part_id, rgba.reshape(H, W, 4)
+
+def render_shape(in_dir, out_dir, views=48, res=512, radius=2.2, elev=15.0,
+                 view_start=0, view_end=None, save_rgb=True, cams=None):
+    view_end = views if view_end is None else view_end
+    with stagetrace.span("raster_load", shape=os.path.basename(os.path.normpath(in_dir))):
+        tris, pids, _ = load_shape(in_dir)
+    if cams is None:
+        cams = camlib.orbit_cameras(views, res, radius, elev, view_start, view_end)
+
+    os.makedirs(os.path.join(out_dir, "depth_exr"), exist_ok=True)
+    os.makedirs(os.path.join(out_dir, "part_id_exr"), exist_ok=True)
+    if save_rgb:
+        os.makedirs(os.path.join(out_dir, "rgb"), exist_ok=True)
+
+    for c in cams:
+        stem = f"{c['view']:03d}"
+        with stagetrace.span("raster_view", view=stem, tris=int(len(tris))):
+            depth, part_id, rgba = rasterize(tris, pids, np.array(c["c2w"]), c["intrinsics"])
+        with stagetrace.span("raster_write", view=stem):
+            imgio.write_exr_gray(os.path.join(out_dir, "depth_exr", f"{stem}.exr"), depth)
+            imgio.write_exr_gray(os.path.join(out_dir, "part_id_exr", f"{stem}.exr"), part_id)
+            if save_rgb:
+                imgio.write_png(os.path.join(out_dir, "rgb", f"{stem}.png"), rgba)
+
+    # same shard naming as render_multi.py so render_launcher.py can merge
+    if view_start == 0 and view_end == views:
+        cam_name = "cameras.json"
+    else:
+        cam_name = f"cameras_{view_start:03d}_{view_end:03d}.json"
+    with open(os.path.join(out_dir, cam_name), "w") as f: json.dump(cams, f, indent=2)
+
+# records of a planned cameras json inside [view_start, view_end), plus the plan's view count
+def planned_cameras(path, view_start=0, view_end=None):
+    with open(path, "r") as f:
+        cams = sorted(json.load(f), key=lambda c: int(c["view"]))
+    view_end = len(cams) if view_end is None else view_end
+    return [c for c in cams if view_start <= int(c["view"]) < view_end], len(cams)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--in_dir", required=True)
+    ap.add_argument("--out_dir", required=True)
+    ap.add_argument("--views", type=int, default=48)
+    ap.add_argument("--res", type=int, default=512)
+    ap.add_argument("--radius", type=float, default=2.2)
+    ap.add_argument("--elev", type=float, default=15.0)
+    ap.add_argument("--view_start", type=int, default=0)
+    ap.add_argument("--view_end", type=int, default=None)
+    ap.add_argument("--save_rgb", type=int, default=1)
+    ap.add_argument("--trace", default=None)
+    ap.add_argument("--cameras", default=None, help="cameras json to render instead of the orbit")
+    args = ap.parse_args()
+    stagetrace.configure(args.trace, "raster")
+
+    views, cams = args.views, None
+    if args.cameras is not None:
+        cams, views = planned_cameras(args.cameras, args.view_start, args.view_end)
+    render_shape(args.in_dir, args.out_dir, views, args.res, args.radius, args.elev,
+                 args.view_start, args.view_end, bool(args.save_rgb), cams)
+    print("raster complete at", args.out_dir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+import os
+import sys
+import json
+import glob
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+r'''
+runs several blender workers of render_multi.py over view shards and/or shapes,
+then merges each shape's per-shard camera records into one cameras.json
+
+cli:
+
+python src/render/render_launcher.py `
+  --blender $blender42 `
+  --in_dir "$proj\data\partnet_datasets\725" --out_dir "$proj\data\output\725" `
+  --workers 8 --threads_per_worker 2 `
+  -- --views 24 --res 512 --engine CYCLES --radius 2.2 --elev 15
+
+python src/render/render_launcher.py `
+  --blender $blender42 `
+  --list "$proj\data\partnet_datasets\list.txt" --out_root "$proj\data\output" `
+  --workers 8 --shards 2 -- --views 24
+
+anything after the bare -- is passed through to every render_multi.py worker
+'''
+
+RENDER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "render_multi.py")
+
+# list.txt lines look like "1297 - ", the id is the first token
+def read_shape_list(path):
+    ids = []
+    with open(path, "r") as f:
+        for line in f:
+            sid = line.split("-")[0].strip()
+            if sid:
+                ids.append(sid)
+    return ids
+
+def collect_shapes(args):
+    if args.in_dir is not None:
+        return [(None, args.in_dir, args.out_dir)]
+
+    if args.list is not None:
+        in_root = args.in_root if args.in_root is not None else os.path.dirname(os.path.abspath(args.list))
+        ids = read_shape_list(args.list)
+        return [(sid, os.path.join(in_root, sid), os.path.join(args.out_root, sid)) for sid in ids]
+
+    dirs = sorted(d for d in glob.glob(args.glob) if os.path.isdir(d))
+    out = []
+    for d in dirs:
+        sid = os.path.basename(os.path.normpath(d))
+        out.append((sid, d, os.path.join(args.out_root, sid)))
+    return out
+
+def get_passthrough_arg(extra, name, default, cast):
+    if name in extra:
+        i = extra.index(name)
+        if i + 1 < len(extra):
+            return cast(extra[i + 1])
+    return default
+
+# camera file a render_multi.py --shard i/n worker writes (the same view split it uses)
+def shard_cameras_name(i, n, views):
+    start, end = i * views // n, (i + 1) * views // n
+    if start == 0 and end == views:
+        return "cameras.json"
+    return f"cameras_{start:03d}_{end:03d}.json"
+
+# same cameras.json the serial renderer writes, built from the shard files of this run only;
+# shard files an earlier run with another shard layout left behind are not read
+def merge_cameras(out_dir, views, shards, keep_shards=False):
+    if shards <= 1:
+        return os.path.exists(os.path.join(out_dir, "cameras.json"))
+    shard_files = [os.path.join(out_dir, shard_cameras_name(s, shards, views)) for s in range(shards)]
+    absent = [os.path.basename(sf) for sf in shard_files if not os.path.exists(sf)]
+    if absent:
+        print(f"not merging {out_dir}, missing {absent}")
+        return False
+
+    by_view = {}
+    for sf in shard_files:
+        with open(sf, "r") as f:
+            for rec in json.load(f):
+                by_view[int(rec["view"])] = rec
+
+    missing = [v for v in range(views) if v not in by_view]
+    if missing:
+        print(f"not merging {out_dir}, missing views {missing}")
+        return False
+
+    cameras = [by_view[v] for v in range(views)]
+    with open(os.path.join(out_dir, "cameras.json"), "w") as f: json.dump(cameras, f, indent=2)
+
+    if not keep_shards:
+        for sf in shard_files:
+            os.remove(sf)
+    return True
+
+def worker_env(threads):
+    env = dict(os.environ)
+    if threads > 0:
+        for k in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+            env[k] = str(threads)
+    return env
+
+def run_job(cmd, env, log_path):
+    with open(log_path, "w") as log:
+        proc = subprocess.run(cmd, stdout=log, stderr=subprocess.STDOUT, env=env)
+    return proc.returncode
+
+def main():
+    argv = sys.argv[1:]
+    extra = []
+    if "--" in argv:
+        extra = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--blender", required=True)
+    ap.add_argument("--in_dir", default=None)
+    ap.add_argument("--out_dir", default=None)
+    ap.add_argument("--list", default=None)
+    ap.add_argument("--glob", default=None)
+    ap.add_argument("--in_root", default=None)
+    ap.add_argument("--out_root", default=None)
+    ap.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 2))
+    ap.add_argument("--shards", type=int, default=0, help="view shards per shape, 0 = workers for one shape else 1")
+    ap.add_argument("--threads_per_worker", type=int, default=0, help="0 = cpu_count // workers")
+    ap.add_argument("--keep_shards", type=int, default=0)
+    args = ap.parse_args(argv)
+
+    if args.in_dir is None and args.list is None and args.glob is None:
+        raise SystemExit("need --in_dir/--out_dir, --list or --glob")
+    if args.in_dir is not None and args.out_dir is None:
+        raise SystemExit("--in_dir needs --out_dir")
+    if args.in_dir is None and args.out_root is None:
+        raise SystemExit("--list/--glob need --out_root")
+
+    shapes = collect_shapes(args)
+    views = get_passthrough_arg(extra, "--views", 48, int)
+    # a planned camera file (viewplan.py) sets the view count
+    cameras = get_passthrough_arg(extra, "--cameras", None, str)
+    if cameras is not None:
+        with open(cameras, "r") as f:
+            views = len(json.load(f))
+    workers = max(1, args.workers)
+    shards = args.shards if args.shards > 0 else (workers if len(shapes) == 1 else 1)
+    shards = min(shards, views)
+    threads = args.threads_per_worker
+    if threads <= 0:
+        threads = max(1, (os.cpu_count() or 1) // workers)
+
+    log_dir = os.path.join(args.out_dir if args.in_dir is not None else args.out_root, "render_logs")
+    os.makedirs(log_dir, exist_ok=True)
+
+    jobs = []
+    roots = {os.path.dirname(os.path.normpath(in_dir)) for _, in_dir, _ in shapes}
+    batch = shards == 1 and len(shapes) > 1 and len(roots) == 1
+    if batch:
+        # whole shapes per worker, each worker runs render_multi.py batch mode over its own list
+        # so it pays blender startup and scene setup once
+        in_root = roots.pop()
+        for k in range(min(workers, len(shapes))):
+            ids = [sid for sid, _, _ in shapes[k::workers]]
+            list_path = os.path.join(log_dir, f"worker_{k:03d}.txt")
+            with open(list_path, "w") as f: f.write("\n".join(ids) + "\n")
+            cmd = [args.blender, "-b", "-P", RENDER_SCRIPT, "--",
+                   "--list", list_path, "--in_root", in_root, "--out_root", args.out_root,
+                   "--manifest", os.path.join(args.out_root, f"manifest_w{k:03d}.json"),
+                   "--threads", str(threads)] + extra
+            jobs.append((f"worker{k:03d}", cmd))
+    else:
+        for sid, in_dir, out_dir in shapes:
+            for s in range(shards):
+                cmd = [args.blender, "-b", "-P", RENDER_SCRIPT, "--",
+                       "--in_dir", in_dir, "--out_dir", out_dir,
+                       "--shard", f"{s}/{shards}", "--threads", str(threads)] + extra
+                jobs.append((f"{sid or 'shape'}_shard{s:03d}", cmd))
+
+    print(f"{len(shapes)} shapes x {shards} shards on {workers} workers, {threads} threads each")
+    env = worker_env(threads)
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        futs = {ex.submit(run_job, cmd, env, os.path.join(log_dir, f"{name}.log")): name for name, cmd in jobs}
+        for fut, name in futs.items():
+            rc = fut.result()
+            if rc != 0:
+                failed.append(name)
+            print(f"{name}: {'ok' if rc == 0 else f'failed ({rc})'}")
+
+    for sid, _, out_dir in shapes:
+        if not merge_cameras(out_dir, views, shards if not batch else 1, keep_shards=bool(args.keep_shards)):
+            failed.append(f"{sid or out_dir} (cameras)")
+
+    if failed:
+        raise SystemExit(f"failed jobs: {failed}")
+    print("render launcher finished")
+
+if __name__ == "__main__":
+    main()
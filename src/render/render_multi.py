@@ -1,6 +1,4 @@
-import bpy
-import os, sys, json, math
-from mathutils import Vector
+import os, sys, json, math, glob, time
 
 r"""
 CLI:
@@ -12,6 +10,32 @@ $proj = "C:\Users\jmu5\OneDrive - Brown University\Documents\temp school stuff\n
   --in_dir "$proj\data\partnet_datasets\725" `
   --out_dir "$proj\data\output\725" `
   --views 24 --res 512 --engine CYCLES --radius 2.2 --elev 15 --save_previews 1
+
+batch mode, one blender process for a whole shape list (or --glob "$proj\data\partnet_datasets\*"):
+
+& $blender42 -b -P "$proj\src\render\render_multi.py" -- `
+  --list "$proj\data\partnet_datasets\list.txt" `
+  --out_root "$proj\data\output" `
+  --views 24 --res 512 --engine CYCLES --radius 2.2 --elev 15
+
+geometry passes only, plain python and no blender (numpy rasterizer, see raster.py):
+
+python "$proj\src\render\render_multi.py" -- --engine RASTER --in_dir ... --out_dir ...
+
+add --shard i/n (or --view_start a --view_end b) and --threads t to render part of the views,
+render_launcher.py runs such workers in parallel and merges their cameras
+
+--cameras plan.json renders the poses viewplan.py picked (coverage driven, fewer views) instead
+of the ring, same cameras.json records come out
+
+--quality draft|fast|final|high picks cycles samples, noise threshold, denoising and light paths
+(final, the default, is the old 64 sample render). every preset writes all passes from one
+layer (--passes single), --passes geometry skips rgb and traces depth and IndexOB at 1 sample.
+only the projected object bbox (+ --border_margin px) is path traced (--border 0 for the full frame),
+outputs stay RES x RES and cameras.json is unchanged
+
+--trace run.jsonl records scene setup and per view render time and memory (see stagetrace.py).
+all passes come out of one render call per view, so they are timed together
 """
 
 # arguments
@@ -35,20 +59,83 @@ ENGINE = get_arg("--engine", "CYCLES", str)
 RADIUS = get_arg("--radius", 2.2, float)
 ELEV_DEG = get_arg("--elev", 15.0, float)
 SAVE_PREVIEWS = get_arg("--save_previews", 0, int)
-
-if IN_DIR is None or OUT_DIR is None:
+# planned poses (viewplan.py) instead of the --views ring at --elev
+CAMERAS = get_arg("--cameras", None, str)
+PLANNED = None
+if CAMERAS is not None:
+    with open(CAMERAS, "r") as f:
+        PLANNED = {int(c["view"]): c["c2w"] for c in json.load(f)}
+    VIEWS = len(PLANNED)
+
+# batch mode
+LIST_PATH = get_arg("--list", None, str)
+GLOB_PAT = get_arg("--glob", None, str)
+IN_ROOT = get_arg("--in_root", None, str)
+OUT_ROOT = get_arg("--out_root", None, str)
+MANIFEST = get_arg("--manifest", None, str)
+RETRY_FAILED = get_arg("--retry_failed", 0, int)
+
+# view range for sharded workers, --shard i/n overrides --view_start/--view_end
+VIEW_START = get_arg("--view_start", 0, int)
+VIEW_END = get_arg("--view_end", VIEWS, int)
+SHARD = get_arg("--shard", None, str)
+THREADS = get_arg("--threads", 0, int)
+TRACE = get_arg("--trace", None, str)
+
+# cycles quality, see QUALITY_PRESETS
+QUALITY = get_arg("--quality", "final", str)
+PASSES = get_arg("--passes", "single", str)
+# path trace only the projected object bbox (+ margin px), outputs stay full size
+BORDER = get_arg("--border", 1, int)
+BORDER_MARGIN = get_arg("--border_margin", 8, int)
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import stagetrace
+from render_launcher import read_shape_list
+stagetrace.configure(TRACE, "render_multi")
+
+if SHARD is not None:
+    shard_i, shard_n = map(int, SHARD.split("/"))
+    if not (shard_n > 0 and 0 <= shard_i < shard_n):
+        raise SystemExit(f"bad --shard {SHARD}")
+    VIEW_START = shard_i * VIEWS // shard_n
+    VIEW_END = (shard_i + 1) * VIEWS // shard_n
+
+VIEW_START = max(0, VIEW_START)
+VIEW_END = min(VIEWS, VIEW_END)
+
+BATCH = LIST_PATH is not None or GLOB_PAT is not None
+
+if BATCH:
+    if OUT_ROOT is None:
+        raise SystemExit("batch mode needs --out_root")
+elif IN_DIR is None or OUT_DIR is None:
     raise SystemExit("Missing --in_dir or --out_dir")
 
-# outputs
-rgb_dir = os.path.join(OUT_DIR, "rgb")
-depth_exr_dir = os.path.join(OUT_DIR, "depth_exr")
-pid_exr_dir = os.path.join(OUT_DIR, "part_id_exr")
-prev_dir = os.path.join(OUT_DIR, "previews")
+def collect_shapes():
+    if LIST_PATH is not None:
+        in_root = IN_ROOT if IN_ROOT is not None else os.path.dirname(os.path.abspath(LIST_PATH))
+        return [(sid, os.path.join(in_root, sid)) for sid in read_shape_list(LIST_PATH)]
 
-os.makedirs(rgb_dir, exist_ok=True)
-os.makedirs(depth_exr_dir, exist_ok=True)
-os.makedirs(pid_exr_dir, exist_ok=True)
-os.makedirs(prev_dir, exist_ok=True)
+    dirs = sorted(d for d in glob.glob(GLOB_PAT) if os.path.isdir(d))
+    return [(os.path.basename(os.path.normpath(d)), d) for d in dirs]
+
+# --engine RASTER renders depth / part id (plus a flat shaded rgb) with the numpy
+# z-buffer in raster.py, no blender needed: python render_multi.py -- --engine RASTER ...
+if ENGINE == "RASTER":
+    import raster
+
+    shapes = collect_shapes() if BATCH else [(None, IN_DIR)]
+    for sid, in_dir in shapes:
+        out_dir = OUT_DIR if sid is None else os.path.join(OUT_ROOT, sid)
+        print("rasterizing", in_dir)
+        cams = raster.planned_cameras(CAMERAS, VIEW_START, VIEW_END)[0] if CAMERAS is not None else None
+        raster.render_shape(in_dir, out_dir, VIEWS, RES, RADIUS, ELEV_DEG, VIEW_START, VIEW_END, cams=cams)
+    print("raster complete")
+    sys.exit(0)
+
+import bpy
+from mathutils import Matrix, Vector
 
 # scene set
 bpy.ops.wm.read_factory_settings(use_empty=True)
@@ -60,34 +147,120 @@ scene.render.resolution_percentage = 100
 scene.render.film_transparent = True
 scene.render.use_compositing = True
 
+# cap cycles threads so several workers can share the cpu
+if THREADS > 0:
+    scene.render.threads_mode = "FIXED"
+    scene.render.threads = THREADS
+
+# color settings of the scene. there is no geometry section: depth and IndexOB come from the
+# first sample in cycles, so they ride along with the rgb render at no extra cost, and a separate
+# 1 sample geometry layer (the old --passes split) measured no faster for draft and 19% slower
+# for fast, with identical depth / part ids. light path limits of None keep blender's defaults.
+# "final" is the original 64 sample adaptive render.
+#
+# seconds per view, cycles cpu (bpy 4.2, 1 core), shape 725, 8 views at 512px, --trace:
+#   preset   --border 0   --border 1 (40% of the pixels)
+#   draft        7.1          3.7
+#   fast         8.2          5.0
+#   final       11.4          7.8
+#   high        31.7         24.6
+#   --passes geometry         0.25
+QUALITY_PRESETS = {
+    "draft": {
+        "color": {"samples": 8, "adaptive_threshold": 0.1, "denoise": True,
+                  "bounces": {"max": 2, "diffuse": 1, "glossy": 1, "transmission": 1, "transparent": 2, "volume": 0}}},
+    "fast": {
+        "color": {"samples": 24, "adaptive_threshold": 0.05, "denoise": True,
+                  "bounces": {"max": 4, "diffuse": 2, "glossy": 2, "transmission": 2, "transparent": 4, "volume": 0}}},
+    "final": {
+        "color": {"samples": 64, "adaptive_threshold": None, "denoise": False, "bounces": None}},
+    "high": {
+        "color": {"samples": 256, "adaptive_threshold": 0.005, "denoise": True, "bounces": None}},
+}
+
+if QUALITY not in QUALITY_PRESETS:
+    raise SystemExit(f"unknown --quality {QUALITY}, one of {sorted(QUALITY_PRESETS)}")
+PRESET = QUALITY_PRESETS[QUALITY]
+if PASSES not in ("single", "geometry"):
+    raise SystemExit(f"unknown --passes {PASSES}, one of single, geometry")
+
+def apply_color_quality(color):
+    scene.cycles.samples = color["samples"]
+    scene.cycles.use_adaptive_sampling = True
+    if color["adaptive_threshold"] is not None:
+        scene.cycles.adaptive_threshold = color["adaptive_threshold"]
+    scene.cycles.use_denoising = color["denoise"]
+    if color["denoise"]:
+        scene.cycles.denoiser = "OPENIMAGEDENOISE"
+    b = color["bounces"]
+    if b is not None:
+        scene.cycles.max_bounces = b["max"]
+        scene.cycles.diffuse_bounces = b["diffuse"]
+        scene.cycles.glossy_bounces = b["glossy"]
+        scene.cycles.transmission_bounces = b["transmission"]
+        scene.cycles.transparent_max_bounces = b["transparent"]
+        scene.cycles.volume_bounces = b["volume"]
+        scene.cycles.caustics_reflective = False
+        scene.cycles.caustics_refractive = False
+
 # cycle engine
 if ENGINE == "CYCLES":
-    scene.cycles.samples = 64
-    scene.cycles.use_adaptive_sampling = True
+    apply_color_quality(PRESET["color"])
 
-# enable passes
+# enable passes: "single" renders everything on one layer, "geometry" swaps it for a 1 sample
+# depth / IndexOB layer and skips rgb altogether
 view_layer = scene.view_layers["ViewLayer"]
-view_layer.use_pass_z = True
-view_layer.use_pass_object_index = True
-
-# imp obs
-obj_files = sorted([f for f in os.listdir(IN_DIR) if f.lower().endswith(".obj")])
-if not obj_files: raise SystemExit(f"no obj files found in {IN_DIR}")
-
-# collect all part objects together
-part_objs = []
-
-for idx, fn in enumerate(obj_files):
-
-    path = os.path.join(IN_DIR, fn)
-    bpy.ops.wm.obj_import(filepath=path)
-
-    imported = [o for o in bpy.context.selected_objects if o.type == "MESH"]
-    for o in imported:
-
-        o.name = f"part_{idx:03d}"
-        o.pass_index = idx + 1
-        part_objs.append(o)
+geom_layer = view_layer
+if PASSES == "single":
+    view_layer.use_pass_z = True
+    view_layer.use_pass_object_index = True
+else:
+    geom_layer = scene.view_layers.new("Geometry")
+    geom_layer.use_pass_z = True
+    geom_layer.use_pass_object_index = True
+    geom_layer.samples = 1
+    geom_layer.cycles.use_denoising = False
+    # one bounce-free material for the whole layer, its rays end at the first hit
+    flat = bpy.data.materials.new("GeometryOverride")
+    flat.use_nodes = True
+    flat.node_tree.nodes.clear()
+    emit = flat.node_tree.nodes.new("ShaderNodeEmission")
+    out = flat.node_tree.nodes.new("ShaderNodeOutputMaterial")
+    flat.node_tree.links.new(emit.outputs["Emission"], out.inputs["Surface"])
+    geom_layer.material_override = flat
+    view_layer.use = False
+
+# imp obs, collect all part objects together
+def load_parts(in_dir):
+    obj_files = sorted([f for f in os.listdir(in_dir) if f.lower().endswith(".obj")])
+    if not obj_files: raise SystemExit(f"no obj files found in {in_dir}")
+
+    part_objs = []
+
+    for idx, fn in enumerate(obj_files):
+
+        path = os.path.join(in_dir, fn)
+        bpy.ops.wm.obj_import(filepath=path)
+
+        imported = [o for o in bpy.context.selected_objects if o.type == "MESH"]
+        for o in imported:
+
+            o.name = f"part_{idx:03d}"
+            o.pass_index = idx + 1
+            part_objs.append(o)
+
+    return part_objs
+
+# drop the previous shape's meshes, lights/camera/compositor stay
+def clear_parts():
+    for o in [o for o in scene.objects if o.name.startswith("part_")]:
+        mesh = o.data
+        bpy.data.objects.remove(o, do_unlink=True)
+        if mesh is not None and mesh.users == 0:
+            bpy.data.meshes.remove(mesh)
+
+    for mat in [m for m in bpy.data.materials if m.users == 0]:
+        bpy.data.materials.remove(mat)
 
 # normalize scale and object
 
@@ -102,17 +275,18 @@ def compute_bbox_world(objs):
 
     return mins, maxs
 
-bpy.context.view_layer.update()
-mins, maxs = compute_bbox_world(part_objs)
-center = (mins + maxs) * 0.5
-size = max((maxs - mins).x, (maxs - mins).y, (maxs - mins).z)
-scale = 1.0 / size if size > 1e-9 else 1.0
+def normalize_parts(part_objs):
+    bpy.context.view_layer.update()
+    mins, maxs = compute_bbox_world(part_objs)
+    center = (mins + maxs) * 0.5
+    size = max((maxs - mins).x, (maxs - mins).y, (maxs - mins).z)
+    scale = 1.0 / size if size > 1e-9 else 1.0
 
-for o in part_objs:
-    o.location = (o.location - center)
-    o.scale = (o.scale * scale)
+    for o in part_objs:
+        o.location = (o.location - center)
+        o.scale = (o.scale * scale)
 
-bpy.context.view_layer.update()
+    bpy.context.view_layer.update()
 
 # lights
 def add_area_light(name, loc, energy):
@@ -148,6 +322,7 @@ nt.nodes.clear()
 
 rl = nt.nodes.new("CompositorNodeRLayers")
 rl.location = (0, 0)
+rl.layer = geom_layer.name
 
 # depth normal
 mapr = nt.nodes.new("CompositorNodeMapRange")
@@ -161,100 +336,210 @@ mapr.inputs["To Max"].default_value = 1.0
 comp = nt.nodes.new("CompositorNodeComposite")
 comp.location = (520, 0)
 
-def get_rl_output(names):
+def get_rl_output(node, names):
     for n in names:
-        if n in rl.outputs:
-            return rl.outputs[n]
-        
+        if n in node.outputs:
+            return node.outputs[n]
+
     raise RuntimeError("goon")
 
-sock_image = get_rl_output(["Image"])
-sock_depth = get_rl_output(["Depth", "Z"])
-sock_index = get_rl_output(["IndexOB"])
+sock_image = get_rl_output(rl, ["Image"])
+sock_depth = get_rl_output(rl, ["Depth", "Z"])
+sock_index = get_rl_output(rl, ["IndexOB"])
 
 # wdp
 nt.links.new(sock_depth, mapr.inputs["Value"])
-
-def connect_to_composite(src_socket):
-    for link in list(nt.links):
-        if link.to_node == comp and link.to_socket == comp.inputs[0]:
-            nt.links.remove(link)
-    nt.links.new(src_socket, comp.inputs[0])
-
-# rendering settings
-def set_png_rgba(scene):
-    s = scene.render.image_settings
-    s.file_format = "PNG"
-    s.color_mode = "RGBA"
-    s.color_depth = "8"
-
-def set_exr32(scene):
-    s = scene.render.image_settings
-    s.file_format = "OPEN_EXR"
-    s.color_mode = "RGB"
-    s.color_depth = "32"
-    s.exr_codec = "ZIP"
-
-def set_png_bw16(scene):
-    s = scene.render.image_settings
-    s.file_format = "PNG"
-    s.color_mode = "BW"
-    s.color_depth = "16"
+nt.links.new(sock_image if PASSES != "geometry" else mapr.outputs["Value"], comp.inputs[0])
+
+# one file output node writes every pass of a single render
+# slot paths use ### so the node substitutes the view index (frame number)
+fout = nt.nodes.new("CompositorNodeOutputFile")
+fout.location = (520, -300)
+fout.file_slots.clear()
+
+def set_png_rgba(fmt):
+    fmt.file_format = "PNG"
+    fmt.color_mode = "RGBA"
+    fmt.color_depth = "8"
+
+def set_exr32(fmt):
+    fmt.file_format = "OPEN_EXR"
+    fmt.color_mode = "RGB"
+    fmt.color_depth = "32"
+    fmt.exr_codec = "ZIP"
+
+def set_png_bw16(fmt):
+    fmt.file_format = "PNG"
+    fmt.color_mode = "BW"
+    fmt.color_depth = "16"
+
+def add_output_slot(src_socket, path, set_format):
+    fout.file_slots.new(path)
+    slot = fout.file_slots[len(fout.file_slots) - 1]
+    slot.path = path
+    slot.use_node_format = False
+    set_format(slot.format)
+    nt.links.new(src_socket, fout.inputs[len(fout.inputs) - 1])
+
+if PASSES != "geometry":
+    add_output_slot(sock_image, "rgb/###", set_png_rgba)
+add_output_slot(sock_depth, "depth_exr/###", set_exr32)
+add_output_slot(sock_index, "part_id_exr/###", set_exr32)
+if SAVE_PREVIEWS:
+    add_output_slot(mapr.outputs["Value"], "previews/depth_preview_###", set_png_bw16)
 
 # render
 target = Vector((0, 0, 0))
 elev = math.radians(ELEV_DEG)
-cameras = []
-
-for i in range(VIEWS):
-    print(f"rendering view {i+1}/{VIEWS}")
-
-    az = 2.0 * math.pi * (i / VIEWS)
-    x = RADIUS * math.cos(az) * math.cos(elev)
-    y = RADIUS * math.sin(az) * math.cos(elev)
-    z = RADIUS * math.sin(elev)
-
-    cam.location = (x, y, z)
-    look_at(cam, target)
-
-    fx = (cam_data.lens / cam_data.sensor_width) * RES
-    fy = fx
-    cx = RES / 2.0
-    cy = RES / 2.0
-    c2w = cam.matrix_world.copy()
-    w2c = cam.matrix_world.inverted()
-
-    cameras.append({
-        "view": i,
-        "intrinsics": {"fx": fx, "fy": fy, "cx": cx, "cy": cy, "w": RES, "h": RES},
-        "c2w": [list(row) for row in c2w],
-        "w2c": [list(row) for row in w2c]})
-
-    # rgb
-    connect_to_composite(sock_image)
-    set_png_rgba(scene)
-    scene.render.filepath = os.path.join(rgb_dir, f"{i:03d}.png")
-    bpy.ops.render.render(write_still=True)
-
-    # depth
-    connect_to_composite(sock_depth)
-    set_exr32(scene)
-    scene.render.filepath = os.path.join(depth_exr_dir, f"{i:03d}.exr")
-    bpy.ops.render.render(write_still=True)
-
-    # part and object id
-    connect_to_composite(sock_index)
-    set_exr32(scene)
-    scene.render.filepath = os.path.join(pid_exr_dir, f"{i:03d}.exr")
-    bpy.ops.render.render(write_still=True)
-
-    # depth preview
-    if SAVE_PREVIEWS:
-        connect_to_composite(mapr.outputs["Value"])
-        set_png_bw16(scene)
-        scene.render.filepath = os.path.join(prev_dir, f"depth_preview_{i:03d}.png")
-        bpy.ops.render.render(write_still=True)
-
-with open(os.path.join(OUT_DIR, "cameras.json"), "w") as f: json.dump(cameras, f, indent=2)
-
-print("render complete at", OUT_DIR)
\ No newline at end of file
+
+# pixel rect (x0, y0, x1, y1 from the top left) of the box corners seen from w2c, None when a
+# corner is behind the camera (then the whole frame is rendered)
+def project_box(w2c, box_min, box_max, fx, fy, cx, cy, margin):
+    us, vs = [], []
+    for x in (box_min.x, box_max.x):
+        for y in (box_min.y, box_max.y):
+            for z in (box_min.z, box_max.z):
+                p = w2c @ Vector((x, y, z))
+                d = -p.z
+                if d <= cam_data.clip_start:
+                    return None
+                us.append(cx + fx * p.x / d)
+                vs.append(cy - fy * p.y / d)
+    x0 = max(0, int(math.floor(min(us))) - margin)
+    y0 = max(0, int(math.floor(min(vs))) - margin)
+    x1 = min(RES, int(math.ceil(max(us))) + margin)
+    y1 = min(RES, int(math.ceil(max(vs))) + margin)
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return x0, y0, x1, y1
+
+# blender borders are fractions of the frame with y going up; no crop keeps outputs RES x RES
+# and pixel aligned, everything outside stays empty (alpha 0, depth 0, part id 0)
+def set_border(rect):
+    scene.render.use_border = rect is not None
+    scene.render.use_crop_to_border = False
+    if rect is None:
+        return
+    x0, y0, x1, y1 = rect
+    scene.render.border_min_x = x0 / RES
+    scene.render.border_max_x = x1 / RES
+    scene.render.border_min_y = 1.0 - y1 / RES
+    scene.render.border_max_y = 1.0 - y0 / RES
+
+# world bbox of the normalized parts, set per shape
+OBJECT_BOX = None
+
+def render_views(out_dir):
+    # outputs
+    if PASSES != "geometry":
+        os.makedirs(os.path.join(out_dir, "rgb"), exist_ok=True)
+    os.makedirs(os.path.join(out_dir, "depth_exr"), exist_ok=True)
+    os.makedirs(os.path.join(out_dir, "part_id_exr"), exist_ok=True)
+    os.makedirs(os.path.join(out_dir, "previews"), exist_ok=True)
+    fout.base_path = out_dir
+
+    cameras = []
+
+    for i in range(VIEW_START, VIEW_END):
+        print(f"rendering view {i+1}/{VIEWS}")
+
+        if PLANNED is not None:
+            cam.matrix_world = Matrix(PLANNED[i])
+        else:
+            az = 2.0 * math.pi * (i / VIEWS)
+            x = RADIUS * math.cos(az) * math.cos(elev)
+            y = RADIUS * math.sin(az) * math.cos(elev)
+            z = RADIUS * math.sin(elev)
+
+            cam.location = (x, y, z)
+            look_at(cam, target)
+        # refresh matrix_world so the recorded pose is this view's and not the last one
+        bpy.context.view_layer.update()
+
+        fx = (cam_data.lens / cam_data.sensor_width) * RES
+        fy = fx
+        cx = RES / 2.0
+        cy = RES / 2.0
+        c2w = cam.matrix_world.copy()
+        w2c = cam.matrix_world.inverted()
+
+        cameras.append({
+            "view": i,
+            "intrinsics": {"fx": fx, "fy": fy, "cx": cx, "cy": cy, "w": RES, "h": RES},
+            "c2w": [list(row) for row in c2w],
+            "w2c": [list(row) for row in w2c]})
+
+        rect = None
+        if BORDER and OBJECT_BOX is not None:
+            rect = project_box(w2c, OBJECT_BOX[0], OBJECT_BOX[1], fx, fy, cx, cy, BORDER_MARGIN)
+        set_border(rect)
+
+        # single render, the file output node writes rgb, depth, part id and preview
+        scene.frame_current = i
+        with stagetrace.span("render_view", view=f"{i:03d}", engine=ENGINE, res=RES, quality=QUALITY, passes=PASSES, border=BORDER) as rec:
+            if rect is not None:
+                rec["border_px"] = (rect[2] - rect[0]) * (rect[3] - rect[1])
+            bpy.ops.render.render(write_still=False)
+
+    # a shard only writes its own records, render_launcher.py merges them into cameras.json
+    if VIEW_START == 0 and VIEW_END == VIEWS:
+        cam_name = "cameras.json"
+    else:
+        cam_name = f"cameras_{VIEW_START:03d}_{VIEW_END:03d}.json"
+    with open(os.path.join(out_dir, cam_name), "w") as f: json.dump(cameras, f, indent=2)
+
+def render_shape(in_dir, out_dir):
+    global OBJECT_BOX
+    with stagetrace.span("render_setup", shape=os.path.basename(os.path.normpath(in_dir))):
+        clear_parts()
+        part_objs = load_parts(in_dir)
+        normalize_parts(part_objs)
+        OBJECT_BOX = compute_bbox_world(part_objs)
+    render_views(out_dir)
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+# write through a temp file so a killed batch never leaves a torn manifest
+def save_manifest(path, manifest):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f: json.dump(manifest, f, indent=2)
+    os.replace(tmp, path)
+
+def run_batch():
+    os.makedirs(OUT_ROOT, exist_ok=True)
+    manifest_path = MANIFEST if MANIFEST is not None else os.path.join(OUT_ROOT, "manifest.json")
+    manifest = load_manifest(manifest_path)
+
+    shapes = collect_shapes()
+    for k, (sid, in_dir) in enumerate(shapes):
+        status = manifest.get(sid, {}).get("status")
+        if status == "done" or (status == "failed" and not RETRY_FAILED):
+            print(f"skipping {sid} ({status})")
+            continue
+
+        out_dir = os.path.join(OUT_ROOT, sid)
+        print(f"shape {k+1}/{len(shapes)}: {sid}")
+        manifest[sid] = {"status": "running", "in_dir": in_dir, "out_dir": out_dir}
+        save_manifest(manifest_path, manifest)
+
+        t0 = time.time()
+        try:
+            render_shape(in_dir, out_dir)
+        except (RuntimeError, OSError, SystemExit) as e:
+            manifest[sid].update({"status": "failed", "error": str(e)})
+        else:
+            manifest[sid].update({"status": "done", "views": [VIEW_START, VIEW_END]})
+        manifest[sid]["seconds"] = round(time.time() - t0, 2)
+        save_manifest(manifest_path, manifest)
+
+    print("batch complete at", OUT_ROOT)
+
+if BATCH:
+    run_batch()
+else:
+    render_shape(IN_DIR, OUT_DIR)
+    print("render complete at", OUT_DIR)
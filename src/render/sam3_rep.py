@@ -1,20 +1,310 @@
+import os
 import sys
+import json
+import time
+import hashlib
+import inspect
+import argparse
+import importlib
+import numpy as np
 
-# import inference code
-sys.path.append("notebook")
-from inference import Inference, load_image, load_single_mask
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from imgio import load_png_rgb_u8
+from maskstore import open_view_masks
+import stagetrace
 
-# load model
-tag = "hf"
-config_path = f"checkpoints/{tag}/pipeline.yaml"
-inference = Inference(config_path, compile=False)
+r'''
+sam 3d object reconstruction for every mask sam_seg.py kept, one model load per run:
 
-# load image and mask
-image = load_image("notebook/images/shutterstock_stylish_kidsroom_1640806567/image.png")
-mask = load_single_mask("notebook/images/shutterstock_stylish_kidsroom_1640806567", index=14)
+python src/render/sam3_rep.py --render_dir "$out/725" --sam_dir "$out/725sam" `
+  --out_dir "$out/725splats" --sam3d_root "$proj\sam-3d-objects" [--device cpu]
 
-# run model
-output = inference(image, mask, seed=42)
+views come from <sam_dir>/view_XXX/meta.json (masks from its masks.npz or png dir), images
+from <render_dir>/rgb. every image is decoded and prepared once for all its masks (for sam3d
+the pointmap of the whole image, the depth model run the pipeline otherwise repeats per mask),
+then each mask is reconstructed and written right away:
 
-# export gaussian splat
-output["gs"].save_ply(f"splat.ply")
\ No newline at end of file
+  <out_dir>/view_XXX/mask_XXX.ply   gaussian splat
+  <out_dir>/splats.jsonl            one line per finished mask (image / mask hashes, settings)
+
+a rerun skips masks whose line matches (same image, same mask, same backend settings) and whose
+ply is still there, so an interrupted run resumes and a sam rerun only redoes changed masks.
+a failing mask is logged to splats.jsonl with its error and retried next run; masks whose size
+differs from the image fail up front, without touching the backend.
+
+--backend sam3d     the sam 3d objects notebook pipeline (<sam3d_root>/notebook/inference.py,
+                    --config default <sam3d_root>/checkpoints/hf/pipeline.yaml)
+--backend stub      numpy stand-in, writes a flat colored point cloud of the mask, for testing
+--backend pkg.mod:Cls  any class with the same prepare / reconstruct / settings methods, built as Cls(args)
+
+--device cpu hides the gpus before torch loads, --threads sets torch's cpu threads.
+--min_area / --max_masks / --views pick what to reconstruct, --trace run.jsonl records model
+load, per image preparation and per mask reconstruction (see stagetrace.py)
+'''
+
+MANIFEST = "splats.jsonl"
+
+# ---- backends ----
+
+# the notebook Inference pipeline stays loaded for the whole run. Inference(image, mask) runs
+# the pipeline on the image with the mask as alpha, and the pipeline estimates a pointmap of
+# the image (its depth model, the expensive image-only step) unless one is passed in. prepare
+# estimates it once per image and every mask of the image reuses it
+class Sam3dBackend:
+    def __init__(self, args):
+        if args.device == "cpu":
+            # the pipeline picks cuda whenever torch sees a gpu
+            os.environ["CUDA_VISIBLE_DEVICES"] = ""
+        import torch
+        if args.threads > 0:
+            torch.set_num_threads(args.threads)
+        root = args.sam3d_root if args.sam3d_root is not None else os.getcwd()
+        sys.path.append(os.path.join(root, "notebook"))
+        from inference import Inference
+        self.config = args.config if args.config is not None else os.path.join(root, "checkpoints", "hf", "pipeline.yaml")
+        self.device = args.device
+        self.inference = Inference(self.config, compile=bool(args.compile))
+        pipeline = getattr(self.inference, "_pipeline", None)
+        self.compute_pointmap = getattr(pipeline, "compute_pointmap", None)
+        if self.compute_pointmap is None or "pointmap" not in inspect.signature(self.inference.__call__).parameters:
+            # an older checkout: nothing to share but the decoded image
+            print("this sam 3d objects pipeline takes no pointmap, the image is prepared per mask")
+            self.compute_pointmap = None
+
+    def settings(self):
+        return {"backend": "sam3d", "config": os.path.abspath(self.config), "device": self.device}
+
+    def prepare(self, image):
+        image = np.ascontiguousarray(image[..., :3])
+        if self.compute_pointmap is None:
+            return {"image": image, "pointmap": None}
+        # the whole image as foreground, the pointmap does not depend on the mask
+        rgba = np.concatenate([image, np.full(image.shape[:2] + (1,), 255, np.uint8)], axis=-1)
+        pointmap = self.compute_pointmap(rgba)
+        if isinstance(pointmap, dict):
+            pointmap = pointmap["pointmap"]
+        elif isinstance(pointmap, tuple):
+            pointmap = pointmap[0]
+        return {"image": image, "pointmap": pointmap}
+
+    def reconstruct(self, prepared, mask, seed):
+        if prepared["pointmap"] is None:
+            return self.inference(prepared["image"], mask, seed=seed)["gs"]
+        return self.inference(prepared["image"], mask, seed=seed, pointmap=prepared["pointmap"])["gs"]
+
+class PointSplat:
+    def __init__(self, points, colors):
+        self.points = points
+        self.colors = colors
+
+    def save_ply(self, path):
+        write_ply(path, self.points, self.colors)
+
+# no model: the mask's pixels as a flat cloud in [-0.5, 0.5], image colors
+class StubBackend:
+    def __init__(self, args):
+        self.max_points = args.stub_points
+
+    def settings(self):
+        return {"backend": "stub", "max_points": self.max_points}
+
+    def prepare(self, image):
+        h, w = image.shape[:2]
+        s = float(max(h, w))
+        ys, xs = np.mgrid[0:h, 0:w]
+        xyz = np.stack([(xs + 0.5) / s - 0.5, 0.5 - (ys + 0.5) / s, np.zeros((h, w))], axis=-1).astype(np.float32)
+        return {"xyz": xyz.reshape(-1, 3), "rgb": image.reshape(-1, 3)}
+
+    def reconstruct(self, prepared, mask, seed):
+        idx = np.flatnonzero(mask.reshape(-1))
+        if len(idx) > self.max_points:
+            idx = np.sort(np.random.default_rng(seed).choice(idx, self.max_points, replace=False))
+        return PointSplat(prepared["xyz"][idx], prepared["rgb"][idx])
+
+BACKENDS = {"sam3d": Sam3dBackend, "stub": StubBackend}
+
+def load_backend(name, args):
+    if name in BACKENDS:
+        return BACKENDS[name](args)
+    if ":" not in name:
+        raise SystemExit(f"unknown --backend '{name}', use {', '.join(BACKENDS)} or module:Class")
+    mod, cls = name.split(":", 1)
+    return getattr(importlib.import_module(mod), cls)(args)
+
+# ---- io ----
+
+def write_ply(path, points, colors):
+    points = np.asarray(points, dtype="<f4").reshape(-1, 3)
+    colors = np.asarray(colors, dtype=np.uint8).reshape(-1, 3)
+    rec = np.empty(len(points), dtype=[("x", "<f4"), ("y", "<f4"), ("z", "<f4"), ("red", "u1"), ("green", "u1"), ("blue", "u1")])
+    rec["x"], rec["y"], rec["z"] = points[:, 0], points[:, 1], points[:, 2]
+    rec["red"], rec["green"], rec["blue"] = colors[:, 0], colors[:, 1], colors[:, 2]
+    header = ("ply\nformat binary_little_endian 1.0\n"
+              f"element vertex {len(rec)}\n"
+              "property float x\nproperty float y\nproperty float z\n"
+              "property uchar red\nproperty uchar green\nproperty uchar blue\n"
+              "end_header\n")
+    with open(path, "wb") as f:
+        f.write(header.encode("ascii"))
+        f.write(rec.tobytes())
+
+def file_hash(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def settings_key(settings, seed):
+    return hashlib.sha1(json.dumps([settings, seed], sort_keys=True).encode()).hexdigest()
+
+# last line per (view, mask) wins
+def load_manifest(out_dir):
+    done = {}
+    path = os.path.join(out_dir, MANIFEST)
+    if not os.path.exists(path):
+        return done
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                # a run killed mid line
+                continue
+            done[(rec["view"], rec["mask_id"])] = rec
+    return done
+
+def is_done(rec, out_dir, key, img_hash, mask_hash):
+    return (rec is not None and "error" not in rec and rec["key"] == key and rec["image"] == img_hash
+            and rec["mask"] == mask_hash and os.path.exists(os.path.join(out_dir, rec["ply"])))
+
+# (meta record, row in the view's mask store) of the masks to reconstruct, meta.json order
+def view_masks(view_dir, min_area, max_masks):
+    meta_path = os.path.join(view_dir, "meta.json")
+    masks = open_view_masks(view_dir)
+    if masks is None or not os.path.exists(meta_path):
+        return None, []
+    with open(meta_path, "r") as f:
+        meta = json.load(f)
+    row = {int(m): j for j, m in enumerate(masks.mask_id)}
+    picked = [(m, row[int(m["mask_id"])]) for m in meta
+              if int(m["mask_id"]) in row and int(m.get("area", min_area)) >= min_area]
+    if max_masks > 0:
+        picked = picked[:max_masks]
+    return masks, picked
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--render_dir", required=True, help="shape render dir with rgb/")
+    ap.add_argument("--sam_dir", required=True, help="sam_seg.py output with view_XXX/meta.json")
+    ap.add_argument("--out_dir", required=True)
+    ap.add_argument("--backend", default="sam3d", help="sam3d, stub or module:Class")
+    ap.add_argument("--sam3d_root", default=None, help="sam-3d-objects checkout (notebook/, checkpoints/), default cwd")
+    ap.add_argument("--config", default=None)
+    ap.add_argument("--compile", type=int, default=0)
+    ap.add_argument("--device", default="cuda", choices=["cuda", "cpu"])
+    ap.add_argument("--threads", type=int, default=0)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--min_area", type=int, default=0)
+    ap.add_argument("--max_masks", type=int, default=0, help="per view, 0 = all")
+    ap.add_argument("--views", default=None, help="comma separated view stems, default all")
+    ap.add_argument("--stub_points", type=int, default=20000)
+    ap.add_argument("--trace", default=None)
+    args = ap.parse_args()
+    stagetrace.configure(args.trace, "sam3_rep")
+
+    views = sorted(d for d in os.listdir(args.sam_dir) if d.startswith("view_"))
+    if args.views is not None:
+        wanted = set(args.views.split(","))
+        views = [d for d in views if d[len("view_"):] in wanted]
+
+    t0 = time.time()
+    with stagetrace.span("sam3_load_model", backend=args.backend):
+        backend = load_backend(args.backend, args)
+    print(f"loaded {args.backend} in {time.time() - t0:.1f}s")
+    key = settings_key(backend.settings(), args.seed)
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    done = load_manifest(args.out_dir)
+    counts = {"done": 0, "skipped": 0, "failed": 0}
+    t_prep, t_rec = 0.0, 0.0
+
+    with open(os.path.join(args.out_dir, MANIFEST), "a", buffering=1) as manifest:
+        for vd in views:
+            stem = vd[len("view_"):]
+            img_path = os.path.join(args.render_dir, "rgb", f"{stem}.png")
+            masks, picked = view_masks(os.path.join(args.sam_dir, vd), args.min_area, args.max_masks)
+            if not picked or not os.path.exists(img_path):
+                continue
+            img_hash = file_hash(img_path)
+
+            todo = []
+            for m, j in picked:
+                mask = masks.mask(j)
+                mask_hash = hashlib.sha1(np.packbits(mask).tobytes()).hexdigest()
+                if is_done(done.get((int(stem), int(m["mask_id"]))), args.out_dir, key, img_hash, mask_hash):
+                    counts["skipped"] += 1
+                else:
+                    todo.append((int(m["mask_id"]), mask, mask_hash))
+            if not todo:
+                continue
+
+            image = load_png_rgb_u8(img_path)
+            ok_before = counts["done"]
+            # masks of another resolution than the render fail here, not inside the model
+            sized = []
+            for mid, mask, mask_hash in todo:
+                if mask.shape == image.shape[:2]:
+                    sized.append((mid, mask, mask_hash))
+                    continue
+                rec = {"view": int(stem), "mask_id": mid, "ply": f"{vd}/mask_{mid:03d}.ply", "key": key,
+                       "image": img_hash, "mask": mask_hash,
+                       "error": f"ValueError: mask is {mask.shape[1]}x{mask.shape[0]}, image is {image.shape[1]}x{image.shape[0]}"}
+                counts["failed"] += 1
+                manifest.write(json.dumps(rec) + "\n")
+            if len(sized) < len(todo):
+                print(f"view {stem}: {len(todo) - len(sized)} masks do not match the "
+                      f"{image.shape[1]}x{image.shape[0]} image, skipped")
+            todo = sized
+            if not todo:
+                continue
+
+            # once per image, every mask of the view reuses it
+            t = time.time()
+            with stagetrace.span("sam3_prepare", view=stem):
+                prepared = backend.prepare(image)
+            t_prep += time.time() - t
+
+            out_view = os.path.join(args.out_dir, vd)
+            os.makedirs(out_view, exist_ok=True)
+            for mid, mask, mask_hash in todo:
+                ply = f"{vd}/mask_{mid:03d}.ply"
+                rec = {"view": int(stem), "mask_id": mid, "ply": ply, "key": key, "image": img_hash, "mask": mask_hash}
+                t = time.time()
+                try:
+                    with stagetrace.span("sam3_reconstruct", view=stem, mask=mid, area=int(mask.sum())):
+                        splat = backend.reconstruct(prepared, mask, args.seed)
+                    with stagetrace.span("sam3_write", view=stem, mask=mid):
+                        path = os.path.join(args.out_dir, ply)
+                        tmp = path + ".tmp.ply"
+                        splat.save_ply(tmp)
+                        os.replace(tmp, path)
+                    counts["done"] += 1
+                except Exception as e:
+                    # one bad mask must not end a run over hundreds
+                    rec["error"] = f"{type(e).__name__}: {e}"
+                    counts["failed"] += 1
+                    print(f"view {stem} mask {mid:03d} failed: {rec['error']}")
+                t_rec += time.time() - t
+                manifest.write(json.dumps(rec) + "\n")
+            print(f"view {stem}: {counts['done'] - ok_before} of {len(todo)} masks reconstructed")
+
+    n = counts["done"] + counts["failed"]
+    print(f"{counts['done']} reconstructed, {counts['skipped']} up to date, {counts['failed']} failed; "
+          f"prepare {t_prep:.1f}s, reconstruct {t_rec:.1f}s ({1000 * t_rec / max(n, 1):.0f} ms per mask)")
+
+if __name__ == "__main__":
+    main()
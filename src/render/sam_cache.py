@@ -0,0 +1,188 @@
+import os
+import json
+import hashlib
+import numpy as np
+import torch
+from segment_anything import SamPredictor
+
+r'''
+on-disk cache for sam_seg.py, two layers under one directory:
+
+  emb/<key>.npz   image encoder output (features, original/input size) per image,
+                  key = image bytes + model type + checkpoint fingerprint
+  gen/<key>.npz   every mask the generator returned for an image (before --rank/--topk),
+                  packed like maskstore.py, key = embedding key + generator settings
+
+re-thresholding skips the encoder, re-ranking / changing --topk skips sam entirely.
+the whole directory is kept under --cache_gb by dropping the least recently used files: the
+size is tracked in memory and the directory is only listed once it passes the limit, then
+trimmed to EVICT_TO of it so the next scan is a good while off.
+'''
+
+# checkpoints are GBs: size plus a hash of the first and last MB is enough to tell them apart
+def checkpoint_fingerprint(path, block=1 << 20):
+    h = hashlib.sha1()
+    size = os.path.getsize(path)
+    h.update(str(size).encode())
+    with open(path, "rb") as f:
+        h.update(f.read(block))
+        if size > block:
+            f.seek(max(size - block, block))
+            h.update(f.read(block))
+    return h.hexdigest()
+
+def image_key(image, *parts):
+    h = hashlib.sha1()
+    h.update(str(image.shape).encode())
+    h.update(str(image.dtype).encode())
+    h.update(np.ascontiguousarray(image).tobytes())
+    for p in parts:
+        h.update(str(p).encode())
+    return h.hexdigest()
+
+# share of --cache_gb left after an eviction
+EVICT_TO = 0.9
+
+class EmbeddingCache:
+    def __init__(self, cache_dir, model_type, checkpoint, max_bytes=4 << 30):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_bytes)
+        self.model = f"{model_type}:{checkpoint_fingerprint(checkpoint)}"
+        self.hits = 0
+        self.misses = 0
+        self.mask_hits = 0
+        # bytes in the directory; None until the first save scans it. forked sam_seg workers
+        # each count their own writes, every scan picks up the others'
+        self.size = None
+        for sub in ("emb", "gen"):
+            os.makedirs(os.path.join(cache_dir, sub), exist_ok=True)
+
+    def _path(self, sub, key):
+        return os.path.join(self.cache_dir, sub, f"{key}.npz")
+
+    def _load(self, path):
+        if not os.path.exists(path):
+            return None
+        try:
+            z = np.load(path)
+            out = {k: z[k] for k in z.files}
+        except (OSError, ValueError, EOFError):
+            # half written or corrupt entry, treat as a miss
+            return None
+        os.utime(path)
+        return out
+
+    def _save(self, path, **arrays):
+        if self.size is None:
+            self.size = sum(s for _, s, _ in self._files())
+        tmp = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp, **arrays)
+        new = os.path.getsize(tmp)
+        try:
+            old = os.path.getsize(path)
+        except FileNotFoundError:
+            old = 0
+        os.replace(tmp, path)
+        self.size += new - old
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def embedding_key(self, image, image_format="RGB"):
+        return image_key(image, image_format, self.model)
+
+    def get_embedding(self, key):
+        hit = self._load(self._path("emb", key))
+        if hit is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return hit
+
+    def put_embedding(self, key, features, original_size, input_size):
+        self._save(self._path("emb", key), features=features,
+                   original_size=np.array(original_size, dtype=np.int64),
+                   input_size=np.array(input_size, dtype=np.int64))
+
+    # generated masks are keyed on the embedding and everything that changes sam's output
+    def generator_key(self, emb_key, settings):
+        return hashlib.sha1((emb_key + json.dumps(settings, sort_keys=True)).encode()).hexdigest()
+
+    def get_masks(self, key):
+        z = self._load(self._path("gen", key))
+        if z is None:
+            return None
+        self.mask_hits += 1
+        h, w = (int(x) for x in z["shape"])
+        segs = np.unpackbits(z["bits"], axis=1, count=h * w).astype(bool).reshape(-1, h, w) if len(z["area"]) else []
+        return [{"segmentation": segs[j],
+                 "area": int(z["area"][j]),
+                 "bbox": [int(x) for x in z["bbox"][j]],
+                 "predicted_iou": float(z["predicted_iou"][j]),
+                 "stability_score": float(z["stability_score"][j])} for j in range(len(z["area"]))]
+
+    def put_masks(self, key, masks, shape):
+        h, w = shape
+        n = len(masks)
+        segs = np.stack([m["segmentation"] for m in masks]).reshape(n, -1) if n else np.zeros((0, h * w), bool)
+        self._save(self._path("gen", key),
+                   shape=np.array([h, w], dtype=np.int64),
+                   bits=np.packbits(segs, axis=1),
+                   area=np.array([m["area"] for m in masks], dtype=np.int64),
+                   bbox=np.array([m["bbox"] for m in masks], dtype=np.float64).reshape(n, 4),
+                   predicted_iou=np.array([m.get("predicted_iou", -1.0) for m in masks], dtype=np.float32),
+                   stability_score=np.array([m.get("stability_score", -1.0) for m in masks], dtype=np.float32))
+
+    # (mtime, size, path) of every finished entry
+    def _files(self):
+        files = []
+        for sub in ("emb", "gen"):
+            d = os.path.join(self.cache_dir, sub)
+            for fn in os.listdir(d):
+                if fn.endswith(".tmp.npz"):
+                    continue
+                p = os.path.join(d, fn)
+                try:
+                    st = os.stat(p)
+                except FileNotFoundError:
+                    continue
+                files.append((st.st_mtime, st.st_size, p))
+        return files
+
+    # least recently used (mtime, bumped on every hit) goes first, down to EVICT_TO of the limit
+    def evict(self):
+        files = self._files()
+        total = sum(s for _, s, _ in files)
+        target = self.max_bytes * EVICT_TO if total > self.max_bytes else self.max_bytes
+        for _, size, p in sorted(files):
+            if total <= target:
+                break
+            # sam_seg --workers share the cache, another process may have removed it already
+            try:
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self.size = total
+
+# drop-in for the generator's predictor: set_image reuses a cached embedding instead of
+# running the image encoder
+class CachedSamPredictor(SamPredictor):
+    def __init__(self, sam_model, cache):
+        super().__init__(sam_model)
+        self.cache = cache
+        self.last_key = None
+
+    def set_image(self, image, image_format="RGB"):
+        key = self.cache.embedding_key(image, image_format)
+        self.last_key = key
+        hit = self.cache.get_embedding(key)
+        if hit is None:
+            super().set_image(image, image_format)
+            self.cache.put_embedding(key, self.features.detach().cpu().numpy(), self.original_size, self.input_size)
+            return
+
+        self.reset_image()
+        self.features = torch.from_numpy(hit["features"]).to(self.device)
+        self.original_size = tuple(int(x) for x in hit["original_size"])
+        self.input_size = tuple(int(x) for x in hit["input_size"])
+        self.is_image_set = True
@@ -0,0 +1,80 @@
+import numpy as np
+import torch
+from torchvision.ops.boxes import batched_nms
+from segment_anything import SamAutomaticMaskGenerator
+from segment_anything.utils.amg import MaskData, area_from_rle, rle_to_mask, uncrop_boxes_xyxy, uncrop_points
+
+r'''
+SamAutomaticMaskGenerator fed with explicit point prompts (sam_prompts.seed_prompts) instead of
+its points_per_side grid. prompts are decoded in order, a small batch at a time, and a prompt
+that falls inside the most specific mask an earlier prompt produced is skipped. thresholds,
+nms, small region cleanup and the output dicts are the stock generator's.
+
+gen = PromptedMaskGenerator(sam, pred_iou_thresh=0.88, stability_score_thresh=0.95)
+masks = gen.generate(img_rgb, prompts)   # prompts (N,2) x,y in pixels
+'''
+
+class PromptedMaskGenerator(SamAutomaticMaskGenerator):
+    def __init__(self, model, points_per_batch=16, **kwargs):
+        kwargs.pop("points_per_side", None)
+        kwargs["crop_n_layers"] = 0
+        super().__init__(model, points_per_side=None, point_grids=[np.zeros((0, 2))],
+                         points_per_batch=points_per_batch, **kwargs)
+        self.prompts = np.zeros((0, 2))
+        self.decoded = 0
+
+    @torch.no_grad()
+    def generate(self, image, prompts):
+        self.prompts = np.asarray(prompts, dtype=np.float64).reshape(-1, 2)
+        return super().generate(image)
+
+    # only ever called for the full-image crop (crop_n_layers = 0), so prompts are image pixels
+    def _process_crop(self, image, crop_box, crop_layer_idx, orig_size):
+        H, W = orig_size
+        self.predictor.set_image(image)
+
+        covered = np.zeros((H, W), dtype=bool)
+        data = MaskData()
+        self.decoded = 0
+        for start in range(0, len(self.prompts), self.points_per_batch):
+            pts = self.prompts[start:start + self.points_per_batch]
+            x = np.clip(pts[:, 0].astype(np.int64), 0, W - 1)
+            y = np.clip(pts[:, 1].astype(np.int64), 0, H - 1)
+            pts = pts[~covered[y, x]]
+            if len(pts) == 0:
+                continue
+
+            batch = self._process_batch(pts, orig_size, crop_box, orig_size)
+            self.decoded += len(pts)
+
+            # the smallest accepted mask of every prompt marks its pixels as done
+            if len(batch["rles"]):
+                areas = np.array([area_from_rle(r) for r in batch["rles"]])
+                _, owner = np.unique(batch["points"].cpu().numpy(), axis=0, return_inverse=True)
+                owner = owner.reshape(-1)
+                order = np.lexsort((areas, owner))
+                head = np.ones(len(order), dtype=bool)
+                head[1:] = owner[order][1:] != owner[order][:-1]
+                for k in order[head]:
+                    covered |= rle_to_mask(batch["rles"][k])
+            data.cat(batch)
+            del batch
+
+        self.predictor.reset_image()
+
+        if self.decoded == 0:
+            return MaskData(rles=[], boxes=torch.zeros((0, 4)), iou_preds=torch.zeros(0),
+                            points=torch.zeros((0, 2)), stability_score=torch.zeros(0))
+        if len(data["rles"]) == 0:
+            return data
+        keep_by_nms = batched_nms(
+            data["boxes"].float(),
+            data["iou_preds"],
+            torch.zeros_like(data["boxes"][:, 0]),
+            iou_threshold=self.box_nms_thresh)
+        data.filter(keep_by_nms)
+
+        data["boxes"] = uncrop_boxes_xyxy(data["boxes"], crop_box)
+        data["points"] = uncrop_points(data["points"], crop_box)
+        data["crop_boxes"] = torch.tensor([crop_box for _ in range(len(data["rles"]))])
+        return data
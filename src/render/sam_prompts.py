@@ -0,0 +1,140 @@
+import os
+import sys
+import json
+import argparse
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from imgio import load_exr_r, load_png_alpha
+
+r'''
+point prompts for sam placed from the render instead of a dense points_per_side^2 grid:
+only foreground pixels (rgb alpha, else valid depth) get prompts, in priority order
+
+  1. the innermost pixel of every region bounded by depth discontinuities
+  2. a band just inside those discontinuities (every spacing/2 px)
+  3. a coarse lattice (every spacing px) over the rest of the foreground
+
+sam_gen.py decodes them in that order and skips prompts inside masks it already accepted.
+
+compare against the dense grid on a render (prompt count and part recall vs part_id_exr):
+
+python src/render/sam_prompts.py --render_dir "$out/725" --points_per_side 32 --spacing 24
+'''
+
+# pixels whose depth jumps by more than rel_jump (relative) to a 4-neighbour, plus the silhouette
+def depth_edges(fg, depth=None, rel_jump=0.02):
+    H, W = fg.shape
+    edges = np.zeros((H, W), dtype=bool)
+    for dy, dx in ((0, 1), (1, 0)):
+        a = (slice(0, H - dy), slice(0, W - dx))
+        b = (slice(dy, H), slice(dx, W))
+        jump = fg[a] != fg[b]
+        if depth is not None:
+            da, db = depth[a], depth[b]
+            both = fg[a] & fg[b]
+            jump |= both & (np.abs(da - db) > rel_jump * np.minimum(da, db))
+        edges[a] |= jump
+        edges[b] |= jump
+    return edges & fg
+
+def foreground(rgb_path=None, depth=None, max_depth=1e9, alpha=None):
+    if alpha is None and rgb_path is not None:
+        alpha = load_png_alpha(rgb_path)
+    if alpha is not None:
+        half = 32768 if alpha.dtype == np.uint16 else 128
+        return alpha >= half
+    if depth is None:
+        raise ValueError("need an rgba image or a depth map for the foreground")
+    return (depth > 0) & (depth < max_depth)
+
+# keep the first point in every cell x cell square, order preserved
+def thin(points, cell, W):
+    if len(points) == 0:
+        return points
+    c = max(int(cell), 1)
+    key = (points[:, 1].astype(np.int64) // c) * (W // c + 1) + points[:, 0].astype(np.int64) // c
+    _, first = np.unique(key, return_index=True)
+    return points[np.sort(first)]
+
+def seed_prompts(fg, depth=None, spacing=24, rel_jump=0.02, band=3, min_area=64):
+    H, W = fg.shape
+    edges = depth_edges(fg, depth, rel_jump)
+    interior = (fg & ~edges).astype(np.uint8)
+    dist = cv2.distanceTransform(interior, cv2.DIST_L2, 3)
+    n, lab, stats, _ = cv2.connectedComponentsWithStats(interior, connectivity=4)
+
+    # 1. innermost pixel of each region big enough to be a part
+    flat_lab = lab.reshape(-1)
+    order = np.lexsort((-dist.reshape(-1), flat_lab))
+    head = np.ones(len(order), dtype=bool)
+    head[1:] = flat_lab[order][1:] != flat_lab[order][:-1]
+    best = order[head]
+    best = best[(flat_lab[best] > 0) & (stats[flat_lab[best], cv2.CC_STAT_AREA] >= min_area)]
+    best = best[np.argsort(-stats[flat_lab[best], cv2.CC_STAT_AREA], kind="stable")]
+    regions = np.stack([best % W, best // W], axis=1)
+
+    # 2. just inside the discontinuities, both sides
+    ys, xs = np.nonzero((dist >= band) & (dist < band + 1))
+    edge_band = thin(np.stack([xs, ys], axis=1), spacing // 2, W)
+
+    # 3. coarse lattice over what is left
+    g = np.arange(spacing // 2, max(H, W), spacing)
+    gx, gy = np.meshgrid(g[g < W], g[g < H])
+    lattice = np.stack([gx.reshape(-1), gy.reshape(-1)], axis=1)
+    lattice = lattice[dist[lattice[:, 1], lattice[:, 0]] >= 2]
+
+    pts = np.concatenate([regions, edge_band, lattice]).astype(np.float64)
+    # drop lattice / band points that crowd an earlier prompt
+    return thin(pts, spacing // 4, W) + 0.5
+
+# the dense grid SamAutomaticMaskGenerator uses (build_point_grid), in pixels
+def grid_prompts(points_per_side, H, W):
+    offset = 1.0 / (2 * points_per_side)
+    s = np.linspace(offset, 1 - offset, points_per_side)
+    gx, gy = np.meshgrid(s, s)
+    return np.stack([gx.reshape(-1) * W, gy.reshape(-1) * H], axis=1)
+
+# fraction of ground-truth parts (visible area >= min_area) with at least one prompt on them
+def part_recall(points, part_id, min_area=64):
+    pid = np.rint(part_id).astype(np.int64)
+    ids, area = np.unique(pid[pid > 0], return_counts=True)
+    ids = ids[area >= min_area]
+    if len(ids) == 0:
+        return 1.0
+    H, W = pid.shape
+    x = np.clip(points[:, 0].astype(np.int64), 0, W - 1)
+    y = np.clip(points[:, 1].astype(np.int64), 0, H - 1)
+    return float(np.isin(ids, pid[y, x]).mean())
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--render_dir", required=True)
+    ap.add_argument("--points_per_side", type=int, default=32)
+    ap.add_argument("--spacing", type=int, default=24)
+    ap.add_argument("--rel_jump", type=float, default=0.02)
+    ap.add_argument("--min_area", type=int, default=64)
+    args = ap.parse_args()
+
+    with open(os.path.join(args.render_dir, "cameras.json"), "r") as f:
+        views = sorted(int(c["view"]) for c in json.load(f))
+
+    rows = []
+    for v in views:
+        stem = f"{v:03d}"
+        depth = load_exr_r(os.path.join(args.render_dir, "depth_exr", f"{stem}.exr"))
+        part_id = load_exr_r(os.path.join(args.render_dir, "part_id_exr", f"{stem}.exr"))
+        fg = foreground(os.path.join(args.render_dir, "rgb", f"{stem}.png"), depth)
+
+        seeded = seed_prompts(fg, depth, args.spacing, args.rel_jump, min_area=args.min_area)
+        grid = grid_prompts(args.points_per_side, *fg.shape)
+        rows.append((len(grid), len(seeded), part_recall(grid, part_id, args.min_area),
+                     part_recall(seeded, part_id, args.min_area)))
+        print(f"view {stem}: grid {rows[-1][0]} prompts recall {rows[-1][2]:.3f} | seeded {rows[-1][1]} prompts recall {rows[-1][3]:.3f}")
+
+    r = np.array(rows, dtype=np.float64).mean(axis=0)
+    print(f"mean: grid {r[0]:.0f} prompts recall {r[2]:.3f} | seeded {r[1]:.1f} prompts recall {r[3]:.3f}")
+
+if __name__ == "__main__":
+    main()
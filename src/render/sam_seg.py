@@ -1,9 +1,27 @@
 import os
+import sys
 import json
+import queue
 import argparse
+import threading
+import multiprocessing as mp
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import cv2
+import numpy as np
+import torch
 from segment_anything import sam_model_registry, SamAutomaticMaskGenerator
 
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from maskstore import STORE_NAME, write_mask_store
+from sam_cache import EmbeddingCache, CachedSamPredictor
+from imgio import load_exr_r
+from sam_prompts import foreground, seed_prompts
+from sam_gen import PromptedMaskGenerator
+from mask_nms import dedup_masks
+from viewstack import open_stack
+import stagetrace
+
 r'''
 cli:
 
@@ -13,6 +31,30 @@ python sam_seg.py `
   --sam_ckpt "..\..\checkpoints\sam_vit_h_4b8939.pth" `
   --points_per_side 16 --device cpu --topk 15 --rank "quality_area"
 
+masks go into one packed view_XXX/masks.npz per view (see maskstore.py),
+--mask_format png keeps the old one png per mask layout
+
+image embeddings and raw generator output are cached in --cache_dir (default <out_dir>/sam_cache,
+see sam_cache.py), so re-running with other thresholds / --topk / --rank skips the encoder.
+--cache_gb 0 turns the cache off
+
+images are decoded a few ahead on a thread and masks/meta are written on --writers threads,
+so the model only waits on inference. --workers N (cpu) forks N processes after the model
+is loaded, each takes every Nth image and runs torch with --threads_per_worker threads
+
+ranked masks go through mask nms (mask_nms.py) before --topk: --nms_iou drops near duplicates,
+--nms_contain drops masks nested in a slightly bigger kept one (1 turns either off). the kept
+mask lists what it suppressed and why under "suppressed" in meta.json
+
+--prompts seeded replaces the points_per_side grid with prompts on the foreground only, placed
+from the depth_exr discontinuities (see sam_prompts.py / sam_gen.py), --prompt_spacing sets density
+
+--stack 1 reads rgb (and depth / alpha for seeded prompts) from the render dir's memory mapped
+viewstack (viewstack.py, built first if stale) instead of decoding the pngs
+
+--trace run.jsonl records decode / encoder / decoder / nms / write time and memory per view
+(see stagetrace.py)
+
 '''
 
 # when sorting masks, use this as a cli argument
@@ -42,6 +84,157 @@ def sort_masks(masks, mode: str):
 
     raise ValueError(f"unknown --rank '{mode}'")
 
+# decode (and seed prompts) off the inference thread
+def load_view(rgb_dir, depth_dir, fn, args, stack=None):
+    stem = os.path.splitext(fn)[0]
+    img_path = os.path.join(rgb_dir, fn)
+    with stagetrace.span("sam_load", view=stem):
+        if stack is not None and stem.isdigit() and int(stem) in stack:
+            return load_stack_view(stack, fn, stem, img_path, args)
+        img_bgr = cv2.imread(img_path, cv2.IMREAD_COLOR)
+        if img_bgr is None:
+            return {"fn": fn, "img_path": img_path, "img": None}
+        view = {"fn": fn, "stem": stem, "img_path": img_path, "img": cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)}
+        if args.prompts == "seeded":
+            d_path = os.path.join(depth_dir, f"{stem}.exr")
+            depth = load_exr_r(d_path) if os.path.exists(d_path) else None
+            view["prompts"] = seed_prompts(foreground(img_path, depth), depth, args.prompt_spacing)
+    return view
+
+# same view dict from the memory mapped stack (viewstack.py), nothing to decode
+def load_stack_view(stack, fn, stem, img_path, args):
+    v = int(stem)
+    view = {"fn": fn, "stem": stem, "img_path": img_path, "img": stack.get("rgb", v)}
+    if args.prompts == "seeded":
+        depth = stack.get("depth", v) if stack.has("depth") else None
+        alpha = stack.get("alpha", v) if stack.has("alpha") else None
+        view["prompts"] = seed_prompts(foreground(depth=depth, alpha=alpha), depth, args.prompt_spacing)
+    return view
+
+def prefetch(items, load, depth):
+    q = queue.Queue(maxsize=depth)
+    def run():
+        try:
+            for it in items:
+                q.put(load(it))
+        except BaseException as e:
+            # handed to the consumer, which would otherwise wait on q.get() forever
+            q.put(e)
+        finally:
+            q.put(None)
+    threading.Thread(target=run, daemon=True).start()
+    while True:
+        it = q.get()
+        if it is None:
+            return
+        if isinstance(it, BaseException):
+            raise it
+        yield it
+
+def write_view(out_dir, stem, masks, shape, mask_format):
+    with stagetrace.span("sam_write", view=stem, masks=len(masks)):
+        return _write_view(out_dir, stem, masks, shape, mask_format)
+
+def _write_view(out_dir, stem, masks, shape, mask_format):
+    view_dir = os.path.join(out_dir, f"view_{stem}")
+    mask_dir = os.path.join(view_dir, "masks")
+    os.makedirs(view_dir, exist_ok=True)
+    write_png = mask_format in ("png", "both")
+    write_packed = mask_format in ("packed", "both")
+    if write_png:
+        os.makedirs(mask_dir, exist_ok=True)
+        # a rerun with a smaller --topk must not leave the old pngs behind
+        for fn in os.listdir(mask_dir):
+            if fn.startswith("mask_") and fn.endswith(".png"):
+                os.remove(os.path.join(mask_dir, fn))
+    if not write_packed and os.path.exists(os.path.join(view_dir, STORE_NAME)):
+        # readers prefer masks.npz, an older one would shadow the new pngs
+        os.remove(os.path.join(view_dir, STORE_NAME))
+
+    meta = []
+
+    for j, m in enumerate(masks):
+        rec = {
+            "mask_id": j,
+            "area": int(m["area"]),
+            "bbox": [int(x) for x in m["bbox"]],
+            "predicted_iou": float(m.get("predicted_iou", -1.0)),
+            "stability_score": float(m.get("stability_score", -1.0))}
+        if "suppressed" in m:
+            rec["suppressed"] = m["suppressed"]
+        if write_png:
+            seg = m["segmentation"].astype("uint8")*255
+            mpath = os.path.join(mask_dir, f"mask_{j:03d}.png")
+            cv2.imwrite(mpath, seg)
+            rec["mask_path"] = os.path.relpath(mpath, out_dir).replace("\\","/")
+        else:
+            rec["mask_path"] = f"view_{stem}/{STORE_NAME}"
+            rec["mask_index"] = j
+        meta.append(rec)
+
+    if write_packed:
+        segs = np.stack([m["segmentation"] for m in masks]) if masks else np.zeros((0,) + shape, bool)
+        write_mask_store(os.path.join(view_dir, STORE_NAME), segs, meta)
+
+    with open(os.path.join(view_dir, "meta.json"), "w") as f: json.dump(meta, f, indent=2)
+    return view_dir
+
+# prefetch -> inference here -> writer threads, for one list of images
+def run_views(gen, cache, args, imgs, depth_dir, gen_settings, tag="", stack=None):
+    pending = deque()
+    max_pending = 4 * args.writers
+
+    with ThreadPoolExecutor(max_workers=args.writers) as wpool:
+        for view in prefetch(imgs, lambda fn: load_view(args.rgb_dir, depth_dir, fn, args, stack), args.prefetch):
+            fn, img_rgb = view["fn"], view["img"]
+            if img_rgb is None:
+                print("skipping, couldn't read", view["img_path"])
+                continue
+
+            stem = view["stem"]
+            masks = None
+            if cache is not None:
+                with stagetrace.span("sam_cache_get", view=stem) as rec:
+                    gen_key = cache.generator_key(cache.embedding_key(img_rgb), gen_settings)
+                    masks = cache.get_masks(gen_key)
+                    rec["hit"] = masks is not None
+            if masks is None:
+                # sam_encode (set_image) nests in here, the rest of the span is the decoder
+                with stagetrace.span("sam_generate", view=stem) as rec:
+                    if args.prompts == "seeded":
+                        masks = gen.generate(img_rgb, view["prompts"])
+                        print(f"{tag}{fn}: decoded {gen.decoded} of {len(view['prompts'])} seeded prompts")
+                    else:
+                        masks = gen.generate(img_rgb)
+                    rec["masks"] = len(masks)
+                if cache is not None:
+                    cache.put_masks(gen_key, masks, img_rgb.shape[:2])
+
+            # sort by the argument given, drop duplicates, then keep the top k
+            with stagetrace.span("sam_nms", view=stem, masks=len(masks)):
+                masks = sort_masks(masks, args.rank)
+                masks = dedup_masks(masks, args.nms_iou, args.nms_contain, args.nms_pool)[: args.topk]
+
+            pending.append((fn, len(masks), wpool.submit(write_view, args.out_dir, stem, masks, img_rgb.shape[:2], args.mask_format)))
+            while len(pending) > max_pending or (pending and pending[0][2].done()):
+                done_fn, n, fut = pending.popleft()
+                print(f"{tag}finished, {done_fn}: wrote {n} masks to {fut.result()}")
+
+        while pending:
+            done_fn, n, fut = pending.popleft()
+            print(f"{tag}finished, {done_fn}: wrote {n} masks to {fut.result()}")
+
+    if cache is not None:
+        print(f"{tag}sam cache: {cache.mask_hits} mask hits, {cache.hits} embedding hits, {cache.misses} misses")
+
+# forked after the model is loaded, so every worker reads the parent's weights copy-on-write
+_SHARED = {}
+
+def _worker(rank, imgs, threads):
+    torch.set_num_threads(threads)
+    s = _SHARED
+    run_views(s["gen"], s["cache"], s["args"], imgs, s["depth_dir"], s["gen_settings"], tag=f"[w{rank}] ", stack=s["stack"])
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--rgb_dir", required=True)
@@ -55,58 +248,101 @@ def main():
     ap.add_argument("--min_mask_region_area", type=int, default=200)
     ap.add_argument("--topk", type=int, default=50)
     ap.add_argument("--rank", default="quality", choices=["area", "quality", "quality_area"])
+    ap.add_argument("--mask_format", default="packed", choices=["packed", "png", "both"])
+    ap.add_argument("--nms_iou", type=float, default=0.85)
+    ap.add_argument("--nms_contain", type=float, default=0.95)
+    ap.add_argument("--nms_pool", type=int, default=4)
+    ap.add_argument("--prompts", default="grid", choices=["grid", "seeded"])
+    ap.add_argument("--prompt_spacing", type=int, default=24)
+    ap.add_argument("--depth_dir", default=None)
+    ap.add_argument("--stack", type=int, default=0, help="read images from the render dir's viewstack (viewstack.py)")
+    ap.add_argument("--cache_dir", default=None)
+    ap.add_argument("--cache_gb", type=float, default=4.0)
+    ap.add_argument("--views", default=None, help="comma separated image stems, default all")
+    ap.add_argument("--prefetch", type=int, default=4)
+    ap.add_argument("--writers", type=int, default=4)
+    ap.add_argument("--workers", type=int, default=1)
+    ap.add_argument("--threads_per_worker", type=int, default=0)
+    ap.add_argument("--trace", default=None, help="append per view timing/memory json lines here")
     args = ap.parse_args()
+    stagetrace.configure(args.trace, "sam_seg")
 
     os.makedirs(args.out_dir, exist_ok=True)
+    if args.workers > 1 and not args.device.startswith("cpu"):
+        raise SystemExit("--workers shards a cpu model, run one process per gpu instead")
 
-    sam = sam_model_registry[args.model_type](checkpoint=args.sam_ckpt)
-    sam.to(device=args.device)
+    # fork shares the loaded weights; where there is no fork (windows) each worker would
+    # have to load its own model, so run serially with all threads instead
+    if args.workers > 1 and "fork" not in mp.get_all_start_methods():
+        print("no fork on this platform, running --workers 1")
+        args.workers = 1
+    # no intra-op pool in the parent before forking (an openmp pool does not survive fork)
+    if args.workers > 1:
+        torch.set_num_threads(1)
+    with stagetrace.span("sam_load_model", model=args.model_type):
+        sam = sam_model_registry[args.model_type](checkpoint=args.sam_ckpt)
+        sam.to(device=args.device)
 
-    gen = SamAutomaticMaskGenerator(
-        model=sam,
-        points_per_side=args.points_per_side,
-        pred_iou_thresh=args.pred_iou_thresh,
-        stability_score_thresh=args.stability_score_thresh,
-        min_mask_region_area=args.min_mask_region_area)
+    if args.prompts == "seeded":
+        gen = PromptedMaskGenerator(
+            sam,
+            pred_iou_thresh=args.pred_iou_thresh,
+            stability_score_thresh=args.stability_score_thresh,
+            min_mask_region_area=args.min_mask_region_area)
+    else:
+        gen = SamAutomaticMaskGenerator(
+            model=sam,
+            points_per_side=args.points_per_side,
+            pred_iou_thresh=args.pred_iou_thresh,
+            stability_score_thresh=args.stability_score_thresh,
+            min_mask_region_area=args.min_mask_region_area)
+    depth_dir = args.depth_dir if args.depth_dir is not None else os.path.join(os.path.dirname(os.path.normpath(args.rgb_dir)), "depth_exr")
 
-    imgs = sorted([f for f in os.listdir(args.rgb_dir) if f.lower().endswith(".png")])
+    cache = None
+    if args.cache_gb > 0:
+        cache_dir = args.cache_dir if args.cache_dir is not None else os.path.join(args.out_dir, "sam_cache")
+        cache = EmbeddingCache(cache_dir, args.model_type, args.sam_ckpt, int(args.cache_gb * (1 << 30)))
+        gen.predictor = CachedSamPredictor(sam, cache)
+    if stagetrace.enabled():
+        gen.predictor.set_image = stagetrace.traced("sam_encode", gen.predictor.set_image)
+    # everything besides the embedding that changes what generate returns
+    gen_settings = {
+        "points_per_side": args.points_per_side,
+        "pred_iou_thresh": args.pred_iou_thresh,
+        "stability_score_thresh": args.stability_score_thresh,
+        "min_mask_region_area": args.min_mask_region_area,
+        "prompts": args.prompts}
+    if args.prompts == "seeded":
+        gen_settings["prompt_spacing"] = args.prompt_spacing
 
-    for fn in imgs:
-        stem = os.path.splitext(fn)[0]
-        img_path = os.path.join(args.rgb_dir, fn)
-        img_bgr = cv2.imread(img_path, cv2.IMREAD_COLOR)
-        if img_bgr is None:
-            print("skipping, couldn't read", img_path)
-            continue
-
-        img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
-
-        masks = gen.generate(img_rgb)
-
-        # sort by the argument given
-        masks = sort_masks(masks, args.rank)[: args.topk]
-
-        view_dir = os.path.join(args.out_dir, f"view_{stem}")
-        mask_dir = os.path.join(view_dir, "masks")
-        os.makedirs(mask_dir, exist_ok=True)
-
-        meta = []
-
-        for j, m in enumerate(masks):
-            seg = m["segmentation"].astype("uint8")*255
-            mpath = os.path.join(mask_dir, f"mask_{j:03d}.png")
-            cv2.imwrite(mpath, seg)
-            meta.append({
-                "mask_id": j,
-                "area": int(m["area"]),
-                "bbox": [int(x) for x in m["bbox"]],
-                "predicted_iou": float(m.get("predicted_iou", -1.0)),
-                "stability_score": float(m.get("stability_score", -1.0)),
-                "mask_path": os.path.relpath(mpath, args.out_dir).replace("\\","/")})
+    imgs = sorted([f for f in os.listdir(args.rgb_dir) if f.lower().endswith(".png")])
+    stack = None
+    if args.stack:
+        # opened before forking, workers share the same maps
+        stack = open_stack(os.path.dirname(os.path.normpath(args.rgb_dir)))
+        if not stack.has("rgb"):
+            stack = None
+    if args.views is not None:
+        wanted = set(args.views.split(","))
+        imgs = [f for f in imgs if os.path.splitext(f)[0] in wanted]
 
-        with open(os.path.join(view_dir, "meta.json"), "w") as f: json.dump(meta, f, indent=2)
+    if args.workers <= 1:
+        if args.threads_per_worker > 0:
+            torch.set_num_threads(args.threads_per_worker)
+        run_views(gen, cache, args, imgs, depth_dir, gen_settings, stack=stack)
+        return
 
-        print(f"finished, {fn}: wrote {len(masks)} masks to {view_dir}")
+    threads = args.threads_per_worker if args.threads_per_worker > 0 else max(1, (os.cpu_count() or 1) // args.workers)
+    _SHARED.update(gen=gen, cache=cache, args=args, depth_dir=depth_dir, gen_settings=gen_settings, stack=stack)
+    ctx = mp.get_context("fork")
+    procs = [ctx.Process(target=_worker, args=(r, imgs[r::args.workers], threads)) for r in range(args.workers)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    failed = [r for r, p in enumerate(procs) if p.exitcode != 0]
+    if failed:
+        raise SystemExit(f"sam workers failed: {failed}")
 
 if __name__ == "__main__":
     main()
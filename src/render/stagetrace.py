@@ -0,0 +1,215 @@
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+r'''
+per view / per stage timing and memory trace shared by render_multi.py, raster.py, sam_seg.py
+and lift.py. every cli takes --trace run.jsonl (or the STAGE_TRACE environment variable, which
+child processes inherit) and appends one json line per finished span:
+
+  {"tool": "lift", "stage": "lift_backproject", "view": "007", "t": 1718000000.1,
+   "dt": 0.042, "cpu": 0.041, "rss_mb": 812.3, "peak_rss_mb": 901.0, "pid": 4242,
+   "sub": {"lift_read": 0.011}}
+
+dt is wall time, cpu the thread's cpu time, sub the wall time of spans nested in this one
+(so sam_generate minus its sam_encode is the decoder). peak_rss_mb is the highest rss while the
+span was open (linux: /proc/self/clear_refs resets VmHWM when a span opens, so neither an earlier
+stage nor a parent process before fork / exec leaks in; None where that is not available).
+spans are no-ops without a trace path.
+
+with stagetrace.span("sam_generate", view=stem) as rec:
+    masks = gen.generate(img)
+    rec["masks"] = len(masks)
+
+python src/render/stagetrace.py run.jsonl     # per stage totals, mean, p95, peak memory
+'''
+
+TRACE_ENV = "STAGE_TRACE"
+
+class _Trace:
+    def __init__(self, path, tool):
+        self.path = path
+        self.tool = tool
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.f = None
+        self.pid = None
+
+    def write(self, rec):
+        line = json.dumps(rec) + "\n"
+        with self.lock:
+            # forked workers inherit the handle, reopen so every process appends its own lines
+            if self.f is None or self.pid != os.getpid():
+                self.f = open(self.path, "a", buffering=1)
+                self.pid = os.getpid()
+            self.f.write(line)
+
+_trace = None
+_configured = False
+
+def configure(path=None, tool=None):
+    global _trace, _configured
+    path = path if path is not None else os.environ.get(TRACE_ENV)
+    tool = tool if tool is not None else os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0]
+    _configured = True
+    if not path:
+        _trace = None
+        return None
+    path = os.path.abspath(path)
+    d = os.path.dirname(path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    os.environ[TRACE_ENV] = path
+    _trace = _Trace(path, tool)
+    return path
+
+def _get():
+    if not _configured:
+        configure()
+    return _trace
+
+def enabled():
+    return _get() is not None
+
+def rss_mb():
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+# process high water mark since the last reset_peak, None without /proc
+def hwm_mb():
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 2**10
+    except (OSError, ValueError):
+        pass
+    return None
+
+def reset_peak():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+# open span records of this process with their running peak; the high water mark is per
+# process, so before every reset it is folded into every span still open (any thread)
+_peak_lock = threading.Lock()
+_peak_open = {}
+_peak_pid = None
+
+def _fold_peak(recs):
+    h = hwm_mb()
+    if h is not None:
+        for r in recs:
+            r["peak"] = max(r["peak"], h)
+
+def _peak_begin(key):
+    global _peak_pid
+    with _peak_lock:
+        if _peak_pid != os.getpid():
+            # spans a forked child inherited are the parent's
+            _peak_open.clear()
+            _peak_pid = os.getpid()
+        _fold_peak(_peak_open.values())
+        ok = reset_peak()
+        now = rss_mb()
+        _peak_open[key] = {"peak": now if ok and now is not None else float("nan")}
+
+def _peak_end(key):
+    with _peak_lock:
+        rec = _peak_open.pop(key, None)
+        if rec is None:
+            return None
+        _fold_peak(list(_peak_open.values()) + [rec])
+        return None if rec["peak"] != rec["peak"] else rec["peak"]
+
+@contextmanager
+def span(stage, **fields):
+    tr = _get()
+    if tr is None:
+        yield {}
+        return
+    stack = getattr(tr.local, "stack", None)
+    if stack is None:
+        stack = tr.local.stack = []
+    rec = {"tool": tr.tool, "stage": stage}
+    rec.update(fields)
+    rec["t"] = time.time()
+    _peak_begin(id(rec))
+    t0, c0 = time.perf_counter(), time.thread_time()
+    stack.append(rec)
+    try:
+        yield rec
+    finally:
+        stack.pop()
+        rec["dt"] = time.perf_counter() - t0
+        rec["cpu"] = time.thread_time() - c0
+        rec["rss_mb"] = rss_mb()
+        rec["peak_rss_mb"] = _peak_end(id(rec))
+        rec["pid"] = os.getpid()
+        if stack:
+            sub = stack[-1].setdefault("sub", {})
+            sub[stage] = sub.get(stage, 0.0) + rec["dt"]
+        tr.write(rec)
+
+# wrap a callable so every call is one span (e.g. the sam predictor's set_image = encoder)
+def traced(stage, fn, **fields):
+    def run(*args, **kwargs):
+        with span(stage, **fields):
+            return fn(*args, **kwargs)
+    return run
+
+def read(paths):
+    recs = []
+    for p in paths:
+        with open(p, "r") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    recs.append(json.loads(line))
+    return recs
+
+# per stage: count, total / mean / p95 wall, self time (minus nested spans), peak memory
+def summarize(recs):
+    by = {}
+    for r in recs:
+        by.setdefault((r.get("tool", ""), r["stage"]), []).append(r)
+    out = {}
+    for (tool, stage), rs in by.items():
+        dt = sorted(r["dt"] for r in rs)
+        own = sum(r["dt"] - sum(r.get("sub", {}).values()) for r in rs)
+        peaks = [r["peak_rss_mb"] for r in rs if r.get("peak_rss_mb") is not None]
+        out[f"{tool}/{stage}"] = {
+            "n": len(rs),
+            "total_s": sum(dt),
+            "self_s": own,
+            "cpu_s": sum(r.get("cpu", 0.0) for r in rs),
+            "mean_s": sum(dt) / len(dt),
+            "p95_s": dt[min(len(dt) - 1, int(0.95 * len(dt)))],
+            "max_s": dt[-1],
+            "peak_rss_mb": max(peaks) if peaks else None}
+    return out
+
+def print_summary(summary):
+    print(f"{'stage':32s} {'n':>6s} {'total s':>9s} {'self s':>9s} {'cpu s':>9s} {'mean ms':>9s} {'p95 ms':>9s} {'peak MB':>8s}")
+    for name, s in sorted(summary.items(), key=lambda kv: -kv[1]["total_s"]):
+        peak = f"{s['peak_rss_mb']:8.0f}" if s["peak_rss_mb"] is not None else f"{'-':>8s}"
+        print(f"{name:32s} {s['n']:6d} {s['total_s']:9.2f} {s['self_s']:9.2f} {s['cpu_s']:9.2f} "
+              f"{1000 * s['mean_s']:9.1f} {1000 * s['p95_s']:9.1f} {peak}")
+
+def main():
+    if len(sys.argv) < 2:
+        raise SystemExit("usage: stagetrace.py trace.jsonl [more.jsonl ...]")
+    print_summary(summarize(read(sys.argv[1:])))
+
+if __name__ == "__main__":
+    main()
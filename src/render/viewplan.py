@@ -0,0 +1,208 @@
+import os
+import sys
+import json
+import math
+import argparse
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import cameras as camlib
+from raster import load_shape, rasterize
+
+r'''
+coverage driven camera planning: candidate cameras on a sphere around the normalized shape,
+per part surface visibility of every candidate from a low res z-buffer (raster.py), then a
+greedy pick of the fewest views that see --target of every part's surface (or as much of it
+as any candidate can). parts count equally, so a stretcher needs covering as much as the seat.
+
+python src/render/viewplan.py --in_dir "$proj\data\partnet_datasets\725" `
+  --out "$proj\data\output\725\cameras_plan.json" --target 0.95 --res 512
+
+writes a cameras.json (same records as render_multi.py / raster.py, views 0..k-1) plus a
+<out>.report.json with per part coverage and, for comparison, what the --compare_views ring at
+--elev covers. render the plan with
+
+& $blender42 -b -P render_multi.py -- --cameras "...\cameras_plan.json" --in_dir ... --out_dir ...
+python src/render/raster.py --cameras "...\cameras_plan.json" --in_dir ... --out_dir ...
+
+candidates: --candidates fibonacci (--n_candidates points, --min_elev..--max_elev) or
+rings (--rings elevations, --ring_views cameras each). --skip aabb.obj (default) leaves the
+dataset's part bounding box file out of the visibility model, it is not a part to cover.
+--redundancy 2 wants every surface sample in two chosen views, so fuse.py can match masks across views
+'''
+
+# points on the sphere band between min_elev and max_elev (degrees), evenly spread
+def fibonacci_eyes(n, radius, min_elev=-60.0, max_elev=80.0):
+    z_lo, z_hi = math.sin(math.radians(min_elev)), math.sin(math.radians(max_elev))
+    k = np.arange(n) + 0.5
+    z = z_lo + (z_hi - z_lo) * k / n
+    az = math.pi * (3.0 - math.sqrt(5.0)) * k
+    r = np.sqrt(1.0 - z * z)
+    return radius * np.stack([r * np.cos(az), r * np.sin(az), z], axis=1)
+
+def ring_eyes(elevs, per_ring, radius):
+    eyes = []
+    for j, e in enumerate(elevs):
+        for i in range(per_ring):
+            # stagger alternate rings so azimuths do not line up
+            eyes.append(camlib.orbit_eye(i + 0.5 * (j % 2), per_ring, radius, e))
+    return np.array(eyes, dtype=np.float64)
+
+# area weighted surface samples, the same number per part, with unit face normals
+def sample_surface(tris, pids, per_part=400, seed=0):
+    rng = np.random.default_rng(seed)
+    cross = np.cross(tris[:, 1] - tris[:, 0], tris[:, 2] - tris[:, 0])
+    area = 0.5 * np.linalg.norm(cross, axis=1)
+    normal = cross / (2.0 * area[:, None] + 1e-12)
+    pts, nrm, part = [], [], []
+    for p in np.unique(pids):
+        t = np.flatnonzero((pids == p) & (area > 0))
+        if len(t) == 0:
+            continue
+        pick = t[rng.choice(len(t), per_part, p=area[t] / area[t].sum())]
+        a, b = rng.random(per_part), rng.random(per_part)
+        flip = a + b > 1.0
+        a[flip], b[flip] = 1.0 - a[flip], 1.0 - b[flip]
+        tr = tris[pick]
+        pts.append(tr[:, 0] + a[:, None] * (tr[:, 1] - tr[:, 0]) + b[:, None] * (tr[:, 2] - tr[:, 0]))
+        nrm.append(normal[pick])
+        part.append(np.full(per_part, p, dtype=np.int32))
+    return np.concatenate(pts), np.concatenate(nrm), np.concatenate(part)
+
+# (candidates, samples) bool: sample in frame, its own part in front at its pixel (and about
+# its depth), not seen edge on
+def visibility(tris, pids, eyes, samples, normals, part, res=128, depth_tol=0.02, max_angle=80.0):
+    intr = camlib.intrinsics(res)
+    cos_min = math.cos(math.radians(max_angle))
+    vis = np.zeros((len(eyes), len(samples)), dtype=bool)
+    for c, eye in enumerate(eyes):
+        c2w = camlib.look_at_c2w(eye)
+        depth, part_id, _ = rasterize(tris, pids, c2w, intr)
+        w2c = np.linalg.inv(c2w)
+        cam = samples @ w2c[:3, :3].T + w2c[:3, 3]
+        d = -cam[:, 2]
+        u = intr["cx"] + intr["fx"] * cam[:, 0] / np.maximum(d, 1e-9)
+        v = intr["cy"] - intr["fy"] * cam[:, 1] / np.maximum(d, 1e-9)
+        x, y = np.floor(u).astype(np.int64), np.floor(v).astype(np.int64)
+        inside = (d > 0) & (x >= 0) & (x < res) & (y >= 0) & (y < res)
+        ray = samples - eye
+        ray /= np.linalg.norm(ray, axis=1, keepdims=True)
+        facing = np.abs((ray * normals).sum(axis=1)) >= cos_min
+        ok = np.flatnonzero(inside & facing)
+        vis[c, ok] = (part_id[y[ok], x[ok]] == part[ok]) & (depth[y[ok], x[ok]] >= d[ok] * (1.0 - depth_tol))
+    return vis
+
+# (parts,) coverage of every part by the chosen views, a sample counts 1/k per view seeing it up to k
+def part_coverage(vis, part, views, parts, k=1):
+    hits = vis[views].sum(axis=0) if len(views) else np.zeros(vis.shape[1])
+    seen = np.minimum(hits, k) / k
+    return np.array([seen[part == p].mean() for p in parts])
+
+# fewest views so every part reaches min(target, what all candidates together reach);
+# k > 1 asks for every sample in k views (fuse.py merges masks seen from several views)
+def greedy_plan(vis, part, target=0.95, max_views=64, k=1):
+    parts, inv = np.unique(part, return_inverse=True)
+    n_parts = len(parts)
+    per_part = np.bincount(inv, minlength=n_parts).astype(np.float64)
+    reachable = np.bincount(inv, weights=np.minimum(vis.sum(axis=0), k) / k, minlength=n_parts) / per_part
+    goal = np.minimum(target, reachable)
+
+    # one-hot (samples, parts) so a view's gain on every part is one matmul
+    onehot = np.zeros((vis.shape[1], n_parts), dtype=np.float32)
+    onehot[np.arange(vis.shape[1]), inv] = 1.0 / (k * per_part[inv])
+
+    chosen = []
+    hits = np.zeros(vis.shape[1], dtype=np.int64)
+    cov = np.zeros(n_parts)
+    while len(chosen) < max_views and (cov < goal - 1e-9).any():
+        new = (vis & (hits < k)).astype(np.float32) @ onehot
+        # capped gain: coverage past a part's goal is worth nothing
+        gain = np.minimum(cov + new, goal).sum(axis=1) - np.minimum(cov, goal).sum()
+        gain[chosen] = 0.0
+        best = int(np.argmax(gain))
+        if gain[best] <= 1e-9:
+            break
+        chosen.append(best)
+        hits += vis[best]
+        cov = np.bincount(inv, weights=np.minimum(hits, k) / k, minlength=n_parts) / per_part
+    return chosen, parts, cov, goal
+
+def plan_views(in_dir, radius=2.2, res=512, target=0.95, candidates="fibonacci", n_candidates=200,
+               min_elev=-60.0, max_elev=80.0, rings=(-30.0, 0.0, 15.0, 45.0, 75.0), ring_views=12,
+               vis_res=128, per_part=400, max_views=64, compare_views=48, compare_elev=15.0, skip=("aabb.obj",),
+               redundancy=1):
+    tris, pids, obj_files = load_shape(in_dir)
+    # pass indices stay the renderer's (file order), skipped files just drop out
+    keep = ~np.isin(pids, [i + 1 for i, fn in enumerate(obj_files) if fn in skip])
+    tris, pids = tris[keep], pids[keep]
+    if candidates == "fibonacci":
+        eyes = fibonacci_eyes(n_candidates, radius, min_elev, max_elev)
+    elif candidates == "rings":
+        eyes = ring_eyes(rings, ring_views, radius)
+    else:
+        raise ValueError(f"unknown candidates '{candidates}'")
+
+    samples, normals, part = sample_surface(tris, pids, per_part)
+    vis = visibility(tris, pids, eyes, samples, normals, part, vis_res)
+    chosen, parts, cov, goal = greedy_plan(vis, part, target, max_views, redundancy)
+
+    cams = [camlib.camera_record(i, camlib.look_at_c2w(eyes[c]), res) for i, c in enumerate(chosen)]
+
+    ring = np.array([camlib.orbit_eye(i, compare_views, radius, compare_elev) for i in range(compare_views)])
+    ring_vis = visibility(tris, pids, ring, samples, normals, part, vis_res)
+    ring_cov = part_coverage(ring_vis, part, np.arange(compare_views), parts, redundancy)
+    report = {
+        "candidates": int(len(eyes)),
+        "views": len(chosen),
+        "target": target,
+        "redundancy": redundancy,
+        "eyes": [[float(x) for x in eyes[c]] for c in chosen],
+        "parts": [{"part": obj_files[p - 1], "pass_index": int(p), "coverage": float(c), "goal": float(g),
+                   "ring_coverage": float(r)} for p, c, g, r in zip(parts, cov, goal, ring_cov)],
+        "ring": {"views": compare_views, "elev": compare_elev,
+                 "min_coverage": float(ring_cov.min()), "mean_coverage": float(ring_cov.mean())},
+        "min_coverage": float(cov.min()), "mean_coverage": float(cov.mean())}
+    return cams, report
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--in_dir", required=True)
+    ap.add_argument("--out", required=True, help="cameras json to write")
+    ap.add_argument("--radius", type=float, default=2.2)
+    ap.add_argument("--res", type=int, default=512)
+    ap.add_argument("--target", type=float, default=0.95)
+    ap.add_argument("--candidates", default="fibonacci", choices=["fibonacci", "rings"])
+    ap.add_argument("--n_candidates", type=int, default=200)
+    ap.add_argument("--min_elev", type=float, default=-60.0)
+    ap.add_argument("--max_elev", type=float, default=80.0)
+    ap.add_argument("--rings", default="-30,0,15,45,75")
+    ap.add_argument("--ring_views", type=int, default=12)
+    ap.add_argument("--vis_res", type=int, default=128)
+    ap.add_argument("--per_part", type=int, default=400)
+    ap.add_argument("--max_views", type=int, default=64)
+    ap.add_argument("--compare_views", type=int, default=48)
+    ap.add_argument("--elev", type=float, default=15.0, help="elevation of the comparison ring")
+    ap.add_argument("--skip", default="aabb.obj", help="comma separated obj files to leave out")
+    ap.add_argument("--redundancy", type=int, default=1, help="views every surface sample should be seen from")
+    args = ap.parse_args()
+
+    cams, report = plan_views(
+        args.in_dir, args.radius, args.res, args.target, args.candidates, args.n_candidates,
+        args.min_elev, args.max_elev, [float(e) for e in args.rings.split(",")], args.ring_views,
+        args.vis_res, args.per_part, args.max_views, args.compare_views, args.elev,
+        tuple(s for s in args.skip.split(",") if s), args.redundancy)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, "w") as f: json.dump(cams, f, indent=2)
+    with open(os.path.splitext(args.out)[0] + ".report.json", "w") as f: json.dump(report, f, indent=2)
+
+    for p in report["parts"]:
+        print(f"  {p['part']:40s} coverage {p['coverage']:.3f} (goal {p['goal']:.3f})  ring {p['ring_coverage']:.3f}")
+    r = report["ring"]
+    print(f"{report['views']} views of {report['candidates']} candidates: min part coverage {report['min_coverage']:.3f}, "
+          f"mean {report['mean_coverage']:.3f} | ring of {r['views']} at {r['elev']:.0f} deg: min {r['min_coverage']:.3f}, "
+          f"mean {r['mean_coverage']:.3f}")
+    print("wrote", args.out)
+
+if __name__ == "__main__":
+    main()
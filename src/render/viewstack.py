@@ -0,0 +1,236 @@
+import os
+import sys
+import json
+import glob
+import time
+import argparse
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from imgio import read_png, load_exr_r
+import stagetrace
+
+r'''
+one packed, memory mapped copy of a shape's render outputs, so lift.py / sam_seg.py /
+score_seg.py stop decoding png and exr per view:
+
+  <out_dir>/viewstack/rgb.npy         (V,H,W,3) uint8
+  <out_dir>/viewstack/alpha.npy       (V,H,W) uint8, only when the pngs have alpha
+  <out_dir>/viewstack/depth.npy       (V,H,W) float32 or float16 (background stays > --max_depth)
+  <out_dir>/viewstack/part_id.npy     (V,H,W) uint8, uint16 when a shape has 255+ parts
+  <out_dir>/viewstack/c2w.npy         (V,4,4) float64
+  <out_dir>/viewstack/intrinsics.npy  (V,4) fx, fy, cx, cy
+  <out_dir>/viewstack/views.npy       (V,) view index of every row
+  <out_dir>/viewstack/stack.json      shape, dtypes, source file count
+
+written one view at a time and opened with np.load(mmap_mode="r"), so opening is instant and
+memory only grows by the views (or pixel rows) actually read. a missing render pass
+(--passes geometry has no rgb) is just left out.
+
+python src/render/viewstack.py --out_dir "$out/725" [--depth_dtype float16]
+
+stack = open_stack(out_dir)          # builds it first when missing or older than the renders
+depth = stack.get("depth", 7)         # (H,W) float32
+cam = stack.camera(7)                 # same dict as the cameras.json record
+'''
+
+STACK_NAME = "viewstack"
+# name -> (render sub dir, file extension)
+SOURCES = {"rgb": ("rgb", ".png"), "depth": ("depth_exr", ".exr"), "part_id": ("part_id_exr", ".exr")}
+
+def source_files(out_dir):
+    files = [os.path.join(out_dir, "cameras.json")]
+    for sub, ext in SOURCES.values():
+        files += glob.glob(os.path.join(out_dir, sub, f"*{ext}"))
+    return [f for f in files if os.path.exists(f)]
+
+# stack missing, built before a render file changed, or the file count differs (a view added / gone)
+def stack_stale(out_dir, stack_dir=None):
+    stack_dir = stack_dir if stack_dir is not None else os.path.join(out_dir, STACK_NAME)
+    meta_path = os.path.join(stack_dir, "stack.json")
+    if not os.path.exists(meta_path):
+        return True
+    with open(meta_path, "r") as f:
+        meta = json.load(f)
+    files = source_files(out_dir)
+    built = os.path.getmtime(meta_path)
+    return len(files) != meta.get("source_files") or any(os.path.getmtime(p) > built for p in files)
+
+def _open_out(stack_dir, name, dtype, shape):
+    return np.lib.format.open_memmap(os.path.join(stack_dir, f"{name}.tmp.npy"), mode="w+", dtype=dtype, shape=shape)
+
+def _commit(stack_dir, name):
+    os.replace(os.path.join(stack_dir, f"{name}.tmp.npy"), os.path.join(stack_dir, f"{name}.npy"))
+
+def build_stack(out_dir, stack_dir=None, depth_dtype="float32"):
+    stack_dir = stack_dir if stack_dir is not None else os.path.join(out_dir, STACK_NAME)
+    with open(os.path.join(out_dir, "cameras.json"), "r") as f:
+        cams = sorted(json.load(f), key=lambda d: int(d.get("view", 0)))
+
+    def path(name, view):
+        sub, ext = SOURCES[name]
+        return os.path.join(out_dir, sub, f"{view:03d}{ext}")
+
+    # a pass is stacked when its dir exists, a view when every stacked pass has it
+    names = [n for n in SOURCES if os.path.isdir(os.path.join(out_dir, SOURCES[n][0]))]
+    cams = [c for c in cams if all(os.path.exists(path(n, int(c["view"]))) for n in names)]
+    if not cams or not names:
+        raise SystemExit(f"nothing to stack in {out_dir}")
+    files = source_files(out_dir)
+
+    os.makedirs(stack_dir, exist_ok=True)
+    # readers treat a stack without stack.json as missing
+    meta_path = os.path.join(stack_dir, "stack.json")
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    V = len(cams)
+    first = cams[0]["intrinsics"]
+    H, W = int(first["h"]), int(first["w"])
+    has_alpha = False
+    if "rgb" in names:
+        img = read_png(path("rgb", int(cams[0]["view"])))
+        has_alpha = img.ndim == 3 and img.shape[2] in (2, 4)
+        H, W = img.shape[:2]
+
+    out = {}
+    if "rgb" in names:
+        out["rgb"] = _open_out(stack_dir, "rgb", np.uint8, (V, H, W, 3))
+        if has_alpha:
+            out["alpha"] = _open_out(stack_dir, "alpha", np.uint8, (V, H, W))
+    if "depth" in names:
+        out["depth"] = _open_out(stack_dir, "depth", depth_dtype, (V, H, W))
+    if "part_id" in names:
+        # uint16 while writing, narrowed to uint8 at the end when every id fits
+        out["part_id"] = _open_out(stack_dir, "part_id", np.uint16, (V, H, W))
+    max_id = 0
+
+    for r, c in enumerate(cams):
+        v = int(c["view"])
+        with stagetrace.span("stack_view", view=f"{v:03d}"):
+            if "rgb" in names:
+                img = read_png(path("rgb", v))
+                if img.dtype == np.uint16:
+                    img = (img >> 8).astype(np.uint8)
+                if img.ndim == 2:
+                    img = img[..., None]
+                out["rgb"][r] = img[..., :3] if img.shape[2] >= 3 else img[..., :1]
+                if has_alpha:
+                    out["alpha"][r] = img[..., -1]
+            if "depth" in names:
+                d = load_exr_r(path("depth", v))
+                if np.dtype(depth_dtype) == np.float16:
+                    # blender's 1e10 background overflows half floats, keep it as inf
+                    d = np.where(d > np.finfo(np.float16).max, np.inf, d)
+                out["depth"][r] = d
+            if "part_id" in names:
+                pid = np.rint(load_exr_r(path("part_id", v)))
+                max_id = max(max_id, int(pid.max()))
+                out["part_id"][r] = np.clip(pid, 0, 65535)
+
+    arrays = list(out)
+    for arr in out.values():
+        arr.flush()
+    out.clear()
+    if "part_id" in names and max_id < 256:
+        wide = np.load(os.path.join(stack_dir, "part_id.tmp.npy"), mmap_mode="r")
+        narrow = np.lib.format.open_memmap(os.path.join(stack_dir, "part_id.narrow.npy"), mode="w+", dtype=np.uint8, shape=wide.shape)
+        for r in range(V):
+            narrow[r] = wide[r]
+        narrow.flush()
+        del wide, narrow
+        os.replace(os.path.join(stack_dir, "part_id.narrow.npy"), os.path.join(stack_dir, "part_id.tmp.npy"))
+
+    for name in arrays:
+        _commit(stack_dir, name)
+    # passes this build no longer has must not be picked up from an older stack
+    for name in ("rgb", "alpha", "depth", "part_id"):
+        if name not in arrays and os.path.exists(os.path.join(stack_dir, f"{name}.npy")):
+            os.remove(os.path.join(stack_dir, f"{name}.npy"))
+
+    np.save(os.path.join(stack_dir, "c2w.npy"), np.array([c["c2w"] for c in cams], dtype=np.float64))
+    np.save(os.path.join(stack_dir, "intrinsics.npy"),
+            np.array([[c["intrinsics"][k] for k in ("fx", "fy", "cx", "cy")] for c in cams], dtype=np.float64))
+    np.save(os.path.join(stack_dir, "views.npy"), np.array([int(c["view"]) for c in cams], dtype=np.int32))
+
+    meta = {"views": V, "h": H, "w": W, "arrays": arrays, "depth_dtype": np.dtype(depth_dtype).name,
+            "part_id_dtype": "uint8" if max_id < 256 else "uint16", "source_files": len(files)}
+    with open(meta_path + ".tmp", "w") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(meta_path + ".tmp", meta_path)
+    return stack_dir
+
+# the stack of a render dir, (re)built when stale; build=False gives None instead
+def open_stack(out_dir, build=True, depth_dtype="float32"):
+    stack_dir = os.path.join(out_dir, STACK_NAME)
+    if stack_stale(out_dir, stack_dir):
+        if not build:
+            return None
+        print("building view stack for", out_dir)
+        build_stack(out_dir, stack_dir, depth_dtype)
+    return ViewStack(stack_dir)
+
+class ViewStack:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "stack.json"), "r") as f:
+            self.meta = json.load(f)
+        self.arrays = {n: np.load(os.path.join(path, f"{n}.npy"), mmap_mode="r") for n in self.meta["arrays"]}
+        self.c2w = np.load(os.path.join(path, "c2w.npy"))
+        self.intrinsics = np.load(os.path.join(path, "intrinsics.npy"))
+        self.views = np.load(os.path.join(path, "views.npy"))
+        self.rows = {int(v): r for r, v in enumerate(self.views)}
+
+    def __len__(self):
+        return len(self.views)
+
+    def __contains__(self, view):
+        return int(view) in self.rows
+
+    def has(self, name):
+        return name in self.arrays
+
+    # writable (H,W[,3]) copy of one view, rows / cols slice a pixel region; only those pages
+    # are read. depth comes back float32 whatever it is stored as
+    def get(self, name, view, rows=slice(None), cols=slice(None)):
+        a = self.arrays[name][self.rows[int(view)], rows, cols]
+        return np.array(a, dtype=np.float32) if name == "depth" else np.array(a)
+
+    # cameras.json record of a view
+    def camera(self, view):
+        r = self.rows[int(view)]
+        c2w = self.c2w[r]
+        fx, fy, cx, cy = (float(x) for x in self.intrinsics[r])
+        return {"view": int(view),
+                "intrinsics": {"fx": fx, "fy": fy, "cx": cx, "cy": cy, "w": self.meta["w"], "h": self.meta["h"]},
+                "c2w": c2w.tolist(), "w2c": np.linalg.inv(c2w).tolist()}
+
+    def cameras(self):
+        return [self.camera(v) for v in self.views]
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--out_dir", required=True, help="render dir with rgb/, depth_exr/, part_id_exr/, cameras.json")
+    ap.add_argument("--stack", default=None, help="default <out_dir>/viewstack")
+    ap.add_argument("--depth_dtype", default="float32", choices=["float32", "float16"])
+    ap.add_argument("--force", type=int, default=0)
+    ap.add_argument("--trace", default=None)
+    args = ap.parse_args()
+    stagetrace.configure(args.trace, "viewstack")
+
+    stack_dir = args.stack if args.stack is not None else os.path.join(args.out_dir, STACK_NAME)
+    t0 = time.time()
+    if args.force or stack_stale(args.out_dir, stack_dir):
+        build_stack(args.out_dir, stack_dir, args.depth_dtype)
+        print(f"built {stack_dir} in {time.time() - t0:.1f}s")
+    else:
+        print(stack_dir, "is up to date")
+
+    t0 = time.time()
+    stack = ViewStack(stack_dir)
+    size = sum(a.nbytes for a in stack.arrays.values())
+    print(f"{len(stack)} views {stack.meta['h']}x{stack.meta['w']}, {', '.join(stack.arrays)}: "
+          f"{size / 2**20:.1f} MB, opened in {1000 * (time.time() - t0):.1f} ms")
+
+if __name__ == "__main__":
+    main()
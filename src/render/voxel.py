@@ -0,0 +1,194 @@
+import numpy as np
+
+r'''
+voxel grid reductions over one packed int64 key per point (no row-wise unique).
+
+modes:
+  first       the first point seen in each voxel and its color (what lift.py always did)
+  centroid    mean position and mean color of the voxel
+  mean_color  the first point seen (stays on the surface) with the voxel's mean color
+
+one shot:     pts, cols = voxel_downsample(points, colors, 0.01, "centroid")
+incremental:  grid = VoxelGrid(0.01, "centroid"); grid.add(p0, c0); grid.add(p1, c1); pts, cols = grid.result()
+'''
+
+MODES = ("first", "centroid", "mean_color")
+
+# voxels are found with a dense array indexed by the key while the occupied bounding box
+# has at most DENSE_FACTOR cells per point, otherwise with a sort of the 1-d keys (the dense
+# tables cost bbox volume, not point count)
+DENSE_FACTOR = 4
+# keys are int64, bounding boxes with more cells than this are grouped by a row sort instead
+MAX_PACKED_CELLS = 1 << 62
+
+def voxel_coords(points, voxel):
+    return np.floor(np.asarray(points) / voxel).astype(np.int64)
+
+# one int64 per point, row-major over the occupied bounding box of the coords;
+# OverflowError when the box has more cells than an int64 key can tell apart
+def pack_keys(coords):
+    lo = coords.min(axis=0)
+    ext = coords.max(axis=0) - lo + 1
+    cells = float(np.prod(ext, dtype=np.float64))
+    if cells > MAX_PACKED_CELLS:
+        raise OverflowError(f"{cells:.3g} cells in the voxel bounding box do not fit an int64 key")
+    c = coords - lo
+    return (c[:, 0] * ext[1] + c[:, 1]) * ext[2] + c[:, 2], int(cells)
+
+# voxel label per point (0..m-1, in order of first occurrence) and the index of the first point of every voxel
+def group(coords):
+    n = len(coords)
+    if n == 0:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64)
+    try:
+        key, cells = pack_keys(coords)
+    except OverflowError:
+        return _group_rows(coords)
+
+    if cells <= DENSE_FACTOR * n:
+        # repeated fancy assignment keeps the last write, so write in reverse to keep the first point
+        first_of = np.full(cells, n, dtype=np.int64)
+        first_of[key[::-1]] = np.arange(n - 1, -1, -1, dtype=np.int64)
+        occupied = np.flatnonzero(first_of < n)
+        first = first_of[occupied]
+        order = np.argsort(first)
+        label_of = np.empty(cells, dtype=np.int64)
+        label_of[occupied[order]] = np.arange(len(occupied), dtype=np.int64)
+        return label_of[key], first[order]
+
+    _, first, inv = np.unique(key, return_index=True, return_inverse=True)
+    return _by_first(inv.reshape(-1), first)
+
+# coords too spread out for one key: stable sort of the rows, runs of equal rows are voxels
+def _group_rows(coords):
+    order = np.lexsort((coords[:, 2], coords[:, 1], coords[:, 0]))
+    c = coords[order]
+    start = np.r_[True, (c[1:] != c[:-1]).any(axis=1)]
+    run = np.cumsum(start) - 1
+    inv = np.empty(len(coords), dtype=np.int64)
+    inv[order] = run
+    # stable, so a run starts with its earliest point
+    return _by_first(inv, order[start])
+
+# relabel voxels in order of their first point
+def _by_first(inv, first):
+    order = np.argsort(first)
+    rank = np.empty(len(first), dtype=np.int64)
+    rank[order] = np.arange(len(first), dtype=np.int64)
+    return rank[inv], first[order]
+
+# per voxel column sums of (n,k) values
+def reduce_sum(labels, m, values):
+    values = np.asarray(values, dtype=np.float64)
+    return np.stack([np.bincount(labels, weights=values[:, k], minlength=m) for k in range(values.shape[1])], axis=1)
+
+def _mean_u8(csum, count):
+    return np.clip(np.rint(csum / count[:, None]), 0, 255).astype(np.uint8)
+
+def voxel_downsample(points, colors, voxel, mode="first"):
+    if voxel <= 0 or len(points) == 0: return points, colors
+    if mode not in MODES: raise ValueError(f"unknown voxel mode {mode}")
+
+    labels, first = group(voxel_coords(points, voxel))
+    if mode == "first":
+        return points[first], colors[first]
+
+    m = len(first)
+    count = np.bincount(labels, minlength=m).astype(np.float64)
+    cols = _mean_u8(reduce_sum(labels, m, colors), count)
+    if mode == "mean_color":
+        return points[first], cols
+    pts = (reduce_sum(labels, m, points) / count[:, None]).astype(points.dtype)
+    return pts, cols
+
+# grid keys: 21 bits per axis around zero, the same key for a voxel in every add()
+GRID_BITS = 21
+GRID_OFF = 1 << (GRID_BITS - 1)
+
+def grid_keys(coords):
+    c = coords + GRID_OFF
+    if len(c) and (c.min() < 0 or c.max() >= (1 << GRID_BITS)):
+        raise OverflowError(f"voxel coords outside +-{GRID_OFF}, use a larger voxel")
+    return (c[:, 0] << (2 * GRID_BITS)) | (c[:, 1] << GRID_BITS) | c[:, 2]
+
+# accumulates masks / views into one grid. the voxels seen so far keep a sorted key -> slot
+# index, each add() groups only its own points, looks their voxels up with searchsorted and
+# appends the new ones, so memory is bounded by the occupied voxels and an add costs its own
+# points (plus inserting the new keys), not every voxel stored before
+class VoxelGrid:
+    def __init__(self, voxel, mode="first"):
+        if voxel <= 0: raise ValueError("voxel size must be > 0")
+        if mode not in MODES: raise ValueError(f"unknown voxel mode {mode}")
+        self.voxel = float(voxel)
+        self.mode = mode
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.slots = np.zeros(0, dtype=np.int64)
+        self.n = 0
+        # per slot, in order of first occurrence; grown by doubling, rows >= n unused
+        self.coords = np.zeros((0, 3), dtype=np.int64)
+        self.count = np.zeros(0, dtype=np.float64)
+        self.first_points = np.zeros((0, 3), dtype=np.float32)
+        self.first_colors = np.zeros((0, 3), dtype=np.uint8)
+        self.psum = np.zeros((0, 3), dtype=np.float64)
+        self.csum = np.zeros((0, 3), dtype=np.float64)
+
+    def __len__(self):
+        return self.n
+
+    def _reserve(self, n):
+        cap = len(self.coords)
+        if n <= cap:
+            return
+        cap = max(n, 2 * cap, 1024)
+        for name in ("coords", "count", "first_points", "first_colors", "psum", "csum"):
+            old = getattr(self, name)
+            new = np.zeros((cap,) + old.shape[1:], dtype=old.dtype)
+            new[:self.n] = old[:self.n]
+            setattr(self, name, new)
+
+    def add(self, points, colors):
+        if len(points) == 0:
+            return self
+        points = np.asarray(points, dtype=np.float32)
+        colors = np.asarray(colors, dtype=np.uint8)
+
+        coords = voxel_coords(points, self.voxel)
+        labels, first = group(coords)
+        keys = grid_keys(coords[first])
+
+        # voxels already in the grid keep their slot (and their earlier first point)
+        pos = np.searchsorted(self.keys, keys)
+        found = pos < len(self.keys)
+        found[found] = self.keys[pos[found]] == keys[found]
+        slot = np.empty(len(keys), dtype=np.int64)
+        slot[found] = self.slots[pos[found]]
+        new = np.flatnonzero(~found)
+        slot[new] = self.n + np.arange(len(new), dtype=np.int64)
+
+        self._reserve(self.n + len(new))
+        fresh = slot[new]
+        self.coords[fresh] = coords[first[new]]
+        self.first_points[fresh] = points[first[new]]
+        self.first_colors[fresh] = colors[first[new]]
+        self.n += len(new)
+        by_key = np.argsort(keys[new])
+        self.keys = np.insert(self.keys, pos[new][by_key], keys[new][by_key])
+        self.slots = np.insert(self.slots, pos[new][by_key], fresh[by_key])
+
+        if self.mode != "first":
+            # slots are unique per batch voxel, so plain fancy += is safe
+            m = len(first)
+            self.count[slot] += np.bincount(labels, minlength=m)
+            self.csum[slot] += reduce_sum(labels, m, colors)
+            if self.mode == "centroid":
+                self.psum[slot] += reduce_sum(labels, m, points)
+        return self
+
+    def result(self):
+        n = self.n
+        if self.mode == "first":
+            return self.first_points[:n].copy(), self.first_colors[:n].copy()
+        cols = _mean_u8(self.csum[:n], self.count[:n])
+        if self.mode == "mean_color":
+            return self.first_points[:n].copy(), cols
+        return (self.psum[:n] / self.count[:n, None]).astype(np.float32), cols